@@ -1,4 +1,5 @@
 __author__ = 'Peter Zabriskie'
+import numpy
 from FradStructure import FradStructure
 
 class AsciiParser:
@@ -11,14 +12,19 @@ class AsciiParser:
 	It loads a FradStructure with the values obtained from the specified file
 	"""
 
-	def __init__(self):
+	def __init__(self, blockSize=4194304, stats=None):
 		"""
 		Construct a new EssentialBitParser object
+		:param blockSize: Number of bytes read from a file at a time. Memory use depends on this, not on the file size.
+		:param stats: Optional StageStats object which records the time and counters of every parsing stage
 		:return: returns nothing
 		"""
+		self.blockSize = blockSize
+		self.stats = stats
 		# A type 2 packet specifying a write (or read in some cases) marks the beginning of the frame data
 		self.type2WriteMask = 0x50000000
 		self.type2ReadMask = 0x48000000
+		self.SYNC_WORD = 0xAA995566
 
 	def parse_rbd_file(self, rbdFile, fradStructure):
 		"""
@@ -26,50 +32,9 @@ class AsciiParser:
 		:param rbdFile: Path to rba file to be parsed
 		:param fradStructure: FradStructure object to be loaded
 		:return: returns nothing
-		"""		
-		lines = open(rbdFile, 'r').read().split('\n')
-		fradStructure.set_current_frad(0)
-		frameCount = 0
-		wordCount = 0
-		padFlag = 0
-		dummyFlag = 0
-		dummyWordCount = 0
-		foundSyncWord = 0
-		storeWords = 0
-		prevType = 0
-		prevTopBottom = 0
-		prevRow = 0
-		for line in lines:
-			if (len(line) > 0 and line[0] == "0") or (line[0] == "1"):
-				if (storeWords):
-					if(dummyFlag):
-						# skip over 202 dummy words at row, topBottom, or type boundaries
-						dummyWordCount += 1
-						if dummyWordCount == 202:
-							dummyFlag = 0
-							dummyWordCount = 0
-							prevType = fradStructure.get_type()
-							prevTopBottom = fradStructure.get_top_bottom()
-							prevRow = fradStructure.get_row()
-						continue
-					if (len(line) > 0):
-						result = self.ascii_to_int(line)
-						fradStructure.append_word(result)
-						wordCount += 1
-						if wordCount == fradStructure.wordsPerFrame:
-							wordCount = 0
-							frameCount += 1
-							if(frameCount == fradStructure.numFrads):
-								break
-							fradStructure.step_forward()
-							if(fradStructure.get_type() != prevType or fradStructure.get_top_bottom() != prevTopBottom or fradStructure.get_row() != prevRow):
-								dummyFlag = 1
-				#clear a frame of pad words
-				else:
-					wordCount += 1
-					if(wordCount == fradStructure.wordsPerFrame):
-						wordCount = 0
-						storeWords = 1
+		"""
+		self.extract_frame_data(self.read_words(rbdFile), fradStructure, 1, 1)
+
 	def parse_rba_file(self, rbaFile, fradStructure):
 		"""
 		Parses an rba file and loads a FradStructure object with the data. An rba file has pad frame and dummy frames
@@ -77,61 +42,8 @@ class AsciiParser:
 		:param fradStructure: FradStructure object to be loaded
 		:return: returns nothing
 		"""
-		lines = open(rbaFile, 'r').read().split('\n')
-		fradStructure.set_current_frad(0)
-		frameCount = 0
-		wordCount = 0
-		padFlag = 0
-		dummyFlag = 0
-		dummyWordCount = 0
-		foundSyncWord = 0
-		storeWords = 0
-		prevType = 0
-		prevTopBottom = 0
-		prevRow = 0
-		for line in lines:
-			if (storeWords):
-				if(dummyFlag):
-					# skip over 202 dummy words at row, topBottom, or type boundaries
-					dummyWordCount += 1
-					if dummyWordCount == 202:
-						dummyFlag = 0
-						dummyWordCount = 0
-						prevType = fradStructure.get_type()
-						prevTopBottom = fradStructure.get_top_bottom()
-						prevRow = fradStructure.get_row()
-					continue
-				if (len(line) > 0):
-					result = self.ascii_to_int(line)
-					fradStructure.append_word(result)
-					wordCount += 1
-					if wordCount == fradStructure.wordsPerFrame:
-						wordCount = 0
-						frameCount += 1
-						if(frameCount == fradStructure.numFrads):
-							break
-						fradStructure.step_forward()
-						if(fradStructure.get_type() != prevType or fradStructure.get_top_bottom() != prevTopBottom or fradStructure.get_row() != prevRow):
-							dummyFlag = 1
-			elif (foundSyncWord == 0):
-				if (len(line) > 0 and ((line[0] == "0") or (line[0] == "1"))):
-					result = self.ascii_to_int(line)
-					if(result == 0xAA995566):
-						foundSyncWord = 1
-						continue
-				else:
-					continue
-			elif padFlag:
-				wordCount += 1
-				if(wordCount == fradStructure.wordsPerFrame):
-					wordCount = 0
-					padFlag = 0
-					storeWords = 1
-			elif len(line) > 0:
-				result = self.ascii_to_int(line)
-				if (result & self.type2ReadMask) == self.type2ReadMask:
-					padFlag = 1
-					continue
+		wordBlocks = self.find_packet(self.read_words(rbaFile), self.type2ReadMask)
+		self.extract_frame_data(wordBlocks, fradStructure, 1, 1)
 
 	def parse_msd_file(self, msdFile, fradStructure):
 		"""
@@ -150,76 +62,157 @@ class AsciiParser:
 		:param fradStructure: FradStructure object to be loaded
 		:return: returns nothing
 		"""
-		lines = open(rbtFile, 'r').read().split('\n')
-		fradStructure.set_current_frad(0)
-		frameCount = 0
-		wordCount = 0
-		dummyFlag = 0
-		dummyWordCount = 0
-		foundSyncWord = 0
-		storeWords = 0
-		prevType = 0
-		prevTopBottom = 0
-		prevRow = 0
-		for line in lines:
-			if (storeWords):
-				if(dummyFlag):
-					# skip over 202 dummy words at row, topBottom, or type boundaries
-					dummyWordCount += 1
-					if dummyWordCount == 202:
-						dummyFlag = 0
-						dummyWordCount = 0
-						prevType = fradStructure.get_type()
-						prevTopBottom = fradStructure.get_top_bottom()
-						prevRow = fradStructure.get_row()
-					continue
-				if (len(line) > 0):
-					result = self.ascii_to_int(line)
-					fradStructure.append_word(result)
-					wordCount += 1
-					if wordCount == fradStructure.wordsPerFrame:
-						wordCount = 0
-						frameCount += 1
-						if(frameCount == fradStructure.numFrads):
-							break
-						fradStructure.step_forward()
-						if(fradStructure.get_type() != prevType or fradStructure.get_top_bottom() != prevTopBottom or fradStructure.get_row() != prevRow):
-							dummyFlag = 1
-			elif (foundSyncWord == 0):
-				if (len(line) > 0 and ((line[0] == "0") or (line[0] == "1"))):
-					result = self.ascii_to_int(line)
-					if(result == 0xAA995566):
-						foundSyncWord = 1
-						continue
-				else:
-					continue
-			elif len(line) > 0:
-				result = self.ascii_to_int(line)
-				if (result & self.type2WriteMask) == self.type2WriteMask:
-					storeWords = 1
-					continue
+		wordBlocks = self.find_packet(self.read_words(rbtFile), self.type2WriteMask)
+		self.extract_frame_data(wordBlocks, fradStructure, 0, 1)
 
 	def parse_ebd_file(self, ebdFile, fradStructure):
 		"""
 		This function parses the specified ebd file and loads a FradStructure object with the data.
 		The ebd file is still somewhat mysterious and proprietary. No BRAM is included but there are far more bits than the configuration memory holds.
+		Words beyond the last frame of the device are ignored.
 		:param ebdFile: Path to .ebd file to be parsed
 		:param fradStructure: FradStructure object to be loaded
 		:return: returns nothing
 		"""
-		lines = open(ebdFile, 'r').read().split('\n')
+		self.extract_frame_data(self.read_words(ebdFile), fradStructure, 0, 0)
+
+	def read_words(self, asciiFile):
+		"""
+		Generator which reads a file blockSize bytes at a time and converts the ascii bit lines of each block.
+		:param asciiFile: Path to file to be read
+		:return: Yields arrays of 32 bit words in file order
+		"""
+		with open(asciiFile, 'r') as f:
+			remainder = ''
+			block = self.read_block(f)
+			while len(block) > 0:
+				block = remainder + block
+				# Only convert whole lines. The partial last line is kept for the next block
+				end = block.rfind('\n') + 1
+				remainder = block[end:]
+				if end > 0:
+					yield self.decode_block(block[:end])
+				block = self.read_block(f)
+			if len(remainder) > 0:
+				yield self.decode_block(remainder)
+
+	def read_block(self, f):
+		"""
+		Helper function which reads the next blockSize bytes of a file
+		:param f: File object
+		:return: String of at most blockSize bytes, empty at the end of the file
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		block = f.read(self.blockSize)
+		if self.stats is not None:
+			self.stats.record('AsciiParser.read', startTime, bytes=len(block))
+		return block
+
+	def decode_block(self, text):
+		"""
+		Helper function which converts a block of whole lines of text with ascii_to_words
+		:param text: Text to be converted
+		:return: Array of 32 bit words
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		words = self.ascii_to_words(text)
+		if self.stats is not None:
+			self.stats.record('AsciiParser.ascii_decode', startTime, bytes=len(text), words=len(words))
+		return words
+
+	def find_packet(self, wordBlocks, packetMask):
+		"""
+		Generator which skips words up to the sync word (0xAA995566) and then up to the first type 2 packet matching packetMask.
+		:param wordBlocks: Iterable of arrays of 32 bit words
+		:param packetMask: type2ReadMask or type2WriteMask
+		:return: Yields arrays of 32 bit words starting with the first word after the type 2 packet header (start of the frame data)
+		"""
+		wordBlocks = iter(wordBlocks)
+		foundSyncWord = 0
+		for words in wordBlocks:
+			startTime = self.stats.start() if self.stats is not None else 0
+			numWords = len(words)
+			if foundSyncWord == 0:
+				syncIndices = numpy.flatnonzero(words == self.SYNC_WORD)
+				if len(syncIndices) == 0:
+					if self.stats is not None:
+						self.stats.record('AsciiParser.sync_search', startTime, words=numWords, skippedWords=numWords)
+					continue
+				foundSyncWord = 1
+				words = words[syncIndices[0] + 1:]
+				if self.stats is not None:
+					self.stats.record('AsciiParser.sync_search', startTime, words=numWords - len(words), skippedWords=numWords - len(words))
+					startTime = self.stats.start()
+					numWords = len(words)
+			packetIndices = numpy.flatnonzero((words & packetMask) == packetMask)
+			if self.stats is not None:
+				skippedWords = numWords if len(packetIndices) == 0 else packetIndices[0] + 1
+				self.stats.record('AsciiParser.packet_search', startTime, words=skippedWords, skippedWords=skippedWords)
+			if len(packetIndices) > 0:
+				yield words[packetIndices[0] + 1:]
+				for words in wordBlocks:
+					yield words
+
+	def extract_frame_data(self, wordBlocks, fradStructure, padFrame, dummyFrames):
+		"""
+		This function stores every complete frame out of the words that follow the start of the configuration data.
+		Words are consumed one block at a time; only the words of a frame split between two blocks are carried over.
+		:param wordBlocks: Iterable of arrays of 32 bit words starting at the configuration data
+		:param fradStructure: FradStructure object to be loaded
+		:param padFrame: 1 if a pad frame precedes the first frame
+		:param dummyFrames: 1 if dummy words are inserted when type, row, or topBottom boundaries are crossed
+		:return: returns nothing
+		"""
+		wordsPerFrame = fradStructure.wordsPerFrame
+		# Word offset of every frame, skipping the pad frame and the 2 dummy frames at row, topBottom, or type boundaries
+		frameStarts = fradStructure.device.get_stream_layout(padFrame, dummyFrames)
+
+		frameCount = 0
+		frameEnd = 0
+		carry = numpy.zeros(0, dtype=numpy.uint32)
+		carryStart = 0
+		for words in wordBlocks:
+			startTime = self.stats.start() if self.stats is not None else 0
+			words = numpy.concatenate((carry, words))
+			blockEnd = carryStart + len(words)
+			# Store every frame that ends inside this block
+			lastFrame = numpy.searchsorted(frameStarts, blockEnd - wordsPerFrame, side='right')
+			if lastFrame > frameCount:
+				offsets = frameStarts[frameCount:lastFrame] - carryStart
+				fradStructure.append_frames(words[offsets[:, None] + numpy.arange(wordsPerFrame)], frameCount)
+				if self.stats is not None:
+					# Pad and dummy words lie between the frames stored
+					lastFrameEnd = frameStarts[lastFrame - 1] + wordsPerFrame
+					self.stats.record('AsciiParser.store_frames', startTime, frames=lastFrame - frameCount,
+						skippedWords=lastFrameEnd - frameEnd - (lastFrame - frameCount) * wordsPerFrame)
+					frameEnd = lastFrameEnd
+				frameCount = lastFrame
+			if frameCount == len(frameStarts):
+				break
+			# Carry the words of the next frame over to the next block
+			nextStart = min(frameStarts[frameCount] - carryStart, len(words))
+			carry = words[nextStart:]
+			carryStart += nextStart
 		fradStructure.set_current_frad(0)
-		wordCount = 0
-		for line in lines:
-			if(wordCount == fradStructure.wordsPerFrame):
-				wordCount = 0
-				fradStructure.step_forward()
-			if (len(line) > 0 and ((line[0] == "0") or (line[0] == "1"))):
-				result = self.ascii_to_int(line)
-				fradStructure.append_word(result)
-				wordCount += 1
-			else:
-				continue
+
+	def ascii_to_words(self, text):
+		"""
+		This function converts every line of 32 ascii 1's and 0's in a block of text to an integer at once.
+		Lines that do not start with a 1 or 0 (headers, blank lines) are skipped.
+		:param text: Text to be converted
+		:return: Array of 32 bit words, one per line of ascii bits
+		"""
+		chars = numpy.frombuffer(text, dtype=numpy.uint8)
+		newlines = numpy.flatnonzero(chars == ord('\n'))
+		lineStarts = numpy.concatenate(([0], newlines + 1))
+		lineEnds = numpy.concatenate((newlines, [len(chars)]))
+		lineStarts = lineStarts[lineEnds - lineStarts >= 32]
+		firstChars = chars[lineStarts]
+		lineStarts = lineStarts[(firstChars == ord('0')) | (firstChars == ord('1'))]
+		# View every position of the text as the start of a 32 character line and pick the bit lines
+		lines = numpy.lib.stride_tricks.as_strided(chars, shape=(max(len(chars) - 31, 0), 32), strides=(1, 1))
+		bits = lines[lineStarts] == ord('1')
+		return numpy.packbits(bits, axis=1).view('>u4').ravel().astype(numpy.uint32)
 
 	def ascii_to_int(self, line):
 		"""
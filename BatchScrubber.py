@@ -0,0 +1,132 @@
+__author__ = 'Peter Zabriskie'
+import ctypes
+import multiprocessing
+import os
+import numpy
+from multiprocessing.sharedctypes import RawArray
+from FradStructure import FradStructure
+from FrameOperations import FrameOperations
+from BinParser import BinParser
+from AsciiParser import AsciiParser
+
+# Parser method used for each readback file extension
+PARSERS = {
+	'.bit': (BinParser, 'parse_bit_file'),
+	'.bin': (BinParser, 'parse_bin_file'),
+	'.rbb': (BinParser, 'parse_rbb_file'),
+	'.data': (BinParser, 'parse_data_file'),
+	'.rbt': (AsciiParser, 'parse_rbt_file'),
+	'.rba': (AsciiParser, 'parse_rba_file'),
+	'.rbd': (AsciiParser, 'parse_rbd_file'),
+}
+
+# State of a worker process, set once by init_worker
+workerState = {}
+
+def init_worker(fradFile, series, goldenData, mskData, includeBram):
+	"""
+	Sets up a worker process. The golden and mask FradStructures wrap the shared memory arrays directly.
+	:param fradFile: Path to file containing list of frame addresses
+	:param series: The series of the device
+	:param goldenData: Shared array holding the golden frame data
+	:param mskData: Shared array holding the mask frame data, or None
+	:param includeBram: 1 to compare every frame, 0 to compare logic frames only
+	:return: returns nothing
+	"""
+	workerState['fradFile'] = fradFile
+	workerState['series'] = series
+	workerState['includeBram'] = includeBram
+	workerState['golden'] = attach_shared_image(fradFile, series, goldenData)
+	workerState['mask'] = None if mskData is None else attach_shared_image(fradFile, series, mskData)
+
+def attach_shared_image(fradFile, series, sharedData):
+	"""
+	Builds a contiguous FradStructure whose frame data is a shared memory array
+	:return: FradStructure object
+	"""
+	fradStructure = FradStructure(series)
+	fradStructure.load_frads(fradFile)
+	frameData = numpy.frombuffer(sharedData, dtype=numpy.uint32).reshape(fradStructure.numFrads, fradStructure.wordsPerFrame)
+	fradStructure.allocate_frame_data(frameData)
+	return fradStructure
+
+def scrub_file(readbackFile):
+	"""
+	Parses one readback file in a worker process and compares it against the golden image, ignoring masked bits
+	:param readbackFile: Path to readback file
+	:return: (readbackFile, upsets, error) where upsets is an N x 3 array of (frad, word, bit) upset coordinates,
+	or None with an error message if the file could not be parsed
+	"""
+	try:
+		parserClass, parseMethod = PARSERS[os.path.splitext(readbackFile)[1].lower()]
+		readback = FradStructure(workerState['series'], 1)
+		readback.load_frads(workerState['fradFile'])
+		if parseMethod == 'parse_rbb_file':
+			parserClass().parse_rbb_file(readbackFile, readback, workerState['includeBram'])
+		else:
+			getattr(parserClass(), parseMethod)(readbackFile, readback)
+		frameOps = FrameOperations(workerState['golden'], readback)
+		return readbackFile, frameOps.diff_array(workerState['includeBram'], workerState['mask']), None
+	except Exception as e:
+		return readbackFile, None, "%s: %s" % (type(e).__name__, e)
+
+class BatchScrubber:
+	"""
+	This class compares many readback files against one golden FradStructure (and optional mask) in a pool of worker processes.
+	The golden and mask images are copied once into shared memory that every worker reads, instead of being pickled to each worker.
+	"""
+
+	def __init__(self, goldenFradStructure, mskFradStructure=None, includeBram=0, processes=None):
+		"""
+		Construct a new BatchScrubber object
+		:param goldenFradStructure: FradStructure object holding the golden configuration
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored
+		:param includeBram: 1 to compare every frame, 0 to compare logic frames only
+		:param processes: Number of worker processes (defaults to the number of CPUs)
+		:return: returns nothing
+		"""
+		self.fradFile = goldenFradStructure.device.fradFile
+		self.series = goldenFradStructure.series
+		self.includeBram = includeBram
+		self.processes = processes if processes else multiprocessing.cpu_count()
+		self.goldenData = self.share_image(goldenFradStructure)
+		self.mskData = None if mskFradStructure is None else self.share_image(mskFradStructure)
+
+	def share_image(self, fradStructure):
+		"""
+		Helper function which copies all frame data of a FradStructure into shared memory
+		:param fradStructure: FradStructure object
+		:return: Shared array of numFrads x wordsPerFrame 32 bit words
+		"""
+		sharedData = RawArray(ctypes.c_uint32, fradStructure.numFrads * fradStructure.wordsPerFrame)
+		frameData = numpy.frombuffer(sharedData, dtype=numpy.uint32).reshape(fradStructure.numFrads, fradStructure.wordsPerFrame)
+		frameData[:] = fradStructure.get_frame_range(0, fradStructure.numFrads)
+		return sharedData
+
+	def scrub(self, readbackFiles):
+		"""
+		Generator which parses and compares readback files in the worker pool. File types are chosen by extension
+		(.bit, .bin, .rbb, .data, .rbt, .rba, .rbd).
+		:param readbackFiles: Iterable of paths to readback files
+		:return: Yields (readbackFile, upsets, error) tuples as soon as each file is done (completion order)
+		"""
+		pool = multiprocessing.Pool(self.processes, init_worker,
+			(self.fradFile, self.series, self.goldenData, self.mskData, self.includeBram))
+		try:
+			for result in pool.imap_unordered(scrub_file, readbackFiles):
+				yield result
+			pool.close()
+		finally:
+			pool.terminate()
+			pool.join()
+
+	def scrub_directory(self, directory, extensions=('.rbb', '.data')):
+		"""
+		Generator which scrubs every readback file in a directory
+		:param directory: Path to directory holding readback files
+		:param extensions: File extensions to include
+		:return: Yields (readbackFile, upsets, error) tuples in completion order
+		"""
+		readbackFiles = sorted([os.path.join(directory, name) for name in os.listdir(directory)
+			if os.path.splitext(name)[1].lower() in extensions])
+		return self.scrub(readbackFiles)
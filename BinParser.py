@@ -1,4 +1,6 @@
 __author__ = 'Peter Zabriskie'
+import struct
+import numpy
 from FradStructure import FradStructure
 
 class BinParser:
@@ -11,14 +13,29 @@ class BinParser:
 		JCM readback files (.data)
 	It loads a FradStructure with the values obtained from the specified file
 	"""
-	def __init__(self):
+	def __init__(self, stats=None):
 		"""
 		Construct a new BinParser object
+		:param stats: Optional StageStats object which records the time and counters of every parsing stage
 		:return: returns nothing
 		"""
-		# A type 2 packet specifying a write (or read in some cases) marks the beginning of the frame data
-		self.type2WriteMask = 0x50000000
-		self.type2ReadMask = 0x48000000
+		self.stats = stats
+		self.SYNC_BYTES = '\xAA\x99\x55\x66'
+
+		# Configuration packet header fields
+		self.TYPE_1_PACKET = 1
+		self.TYPE_2_PACKET = 2
+		self.READ_OPCODE = 1
+		self.WRITE_OPCODE = 2
+
+		# Configuration registers
+		self.FAR_REGISTER = 1
+		self.FDRI_REGISTER = 2
+		self.FDRO_REGISTER = 3
+		self.CMD_REGISTER = 4
+		self.MFWR_REGISTER = 10
+
+		self.DESYNC_COMMAND = 13
 
 	def parse_data_file(self, dataFile, fradStructure):
 		"""
@@ -31,48 +48,19 @@ class BinParser:
 		f = open(dataFile, "rb")
 		self.extract_frame_data(f, fradStructure, 0, 0, 1, 1)
 
-	def parse_rbb_file(self, rbbFile, fradStructure):
+	def parse_rbb_file(self, rbbFile, fradStructure, includeBram=0):
 		"""
 		This function parses the given .rbb readback file and loads the provided fradStructure with the values.
+		BRAM frames are only read back as a snapshot of live block RAM contents, so by default they are skipped and
+		the BRAM frames of the fradStructure are left as they were.
 		:param rbbFile: Path to rbbfile to be parsed
 		:param fradStructure: FradStructure object which will store frame data
+		:param includeBram: 1 to store every frame read back, 0 to store logic frames only
 		:return: returns nothing
 		"""
-
-		header_st = 0
-		firstByte_st = 1
-		secondByte_st = 2
-		thirdByte_st = 3
-		fourthByte_st = 4
-
-		currentState = header_st
-
-		# Use state machine to find sync word (0xAA995566).
-		# Sync word marks the end of the header and the start of actual commands
-
-		f = open(rbbFile, "rb")
-
-		while currentState != fourthByte_st:
-			byte = f.read(1)
-			if currentState == header_st and ord(byte) == 0xAA:
-				currentState = firstByte_st
-			elif currentState == firstByte_st and ord(byte) == 0x99:
-				currentState = secondByte_st
-			elif currentState == secondByte_st and ord(byte) == 0x55:
-				currentState = thirdByte_st
-			elif currentState == thirdByte_st and ord(byte) == 0x66:
-				currentState = fourthByte_st								
-			else:
-				currentState = header_st
-
-		# Find type 2 write packet (start of actual configuration frame data)
-		while 1:
-			bytes = f.read(4)
-			word = (ord(bytes[0]) << 24) | (ord(bytes[1]) << 16) | (ord(bytes[2]) << 8) | ord(bytes[3])
-			if (word & self.type2ReadMask) == self.type2ReadMask:
-				break
-		
-		self.extract_frame_data(f, fradStructure, 0, 1, 1, 0)
+		data = self.read_file(rbbFile)
+		self.decode_packets(data, fradStructure, fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames)
+		fradStructure.set_current_frad(0)
 
 	def parse_bin_file(self, binFile, fradStructure):
 		"""
@@ -99,81 +87,249 @@ class BinParser:
 		:param fradStructure: FradStructure object which will store frame data
 		:return: returns nothing
 		"""
+		data = self.read_file(bitFile)
+		self.decode_packets(data, fradStructure)
+		fradStructure.set_current_frad(0)
 
-		header_st = 0
-		firstByte_st = 1
-		secondByte_st = 2
-		thirdByte_st = 3
-		fourthByte_st = 4
-
-		currentState = header_st
+	def read_file(self, path):
+		"""
+		Helper function which reads a whole binary file
+		:param path: Path to file to be read
+		:return: Contents of the file
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		data = open(path, "rb").read()
+		if self.stats is not None:
+			self.stats.record('BinParser.read', startTime, bytes=len(data))
+		return data
 
-		# Use state machine to find sync word (0xAA995566).
+	def decode_packets(self, data, fradStructure, numFrames=None):
+		"""
+		This function decodes the configuration packets of a bitstream or readback file in a single pass.
+		Frame data written to FDRI, copied with MFWR, or read from FDRO is stored at the frame address
+		most recently written to the FAR register, so partial bitstreams and multiple bursts are supported.
+		:param data: Contents of the file
+		:param fradStructure: FradStructure object which will store frame data
+		:param numFrames: Only frames with a frame index below numFrames are stored (defaults to every frame)
+		:return: returns nothing
+		"""
+		if numFrames is None:
+			numFrames = fradStructure.numFrads
 		# Sync word marks the end of the header and the start of actual commands
+		startTime = self.stats.start() if self.stats is not None else 0
+		syncOffset = data.find(self.SYNC_BYTES)
+		if syncOffset < 0:
+			raise IOError("Sync word not found in BinParser:decode_packets()")
+		if self.stats is not None:
+			self.stats.record('BinParser.sync_search', startTime, bytes=syncOffset + len(self.SYNC_BYTES))
+
+		while syncOffset >= 0:
+			startTime = self.stats.start() if self.stats is not None else 0
+			start = syncOffset + len(self.SYNC_BYTES)
+			numWords = (len(data) - start) / 4
+			words = numpy.frombuffer(data, dtype='>u4', count=numWords, offset=start).astype(numpy.uint32)
+			if self.stats is not None:
+				self.stats.record('BinParser.decode_words', startTime, bytes=4 * numWords, words=numWords)
+				startTime = self.stats.start()
+
+			far = 0
+			register = 0
+			lastFrame = None
+			desync = 0
+			i = 0
+			while i < numWords and not desync:
+				header = int(words[i])
+				i += 1
+				packetType = header >> 29
+				opcode = (header >> 27) & 0x3
+				if packetType == self.TYPE_1_PACKET:
+					register = (header >> 13) & 0x3FFF
+					wordCount = header & 0x7FF
+				elif packetType == self.TYPE_2_PACKET:
+					wordCount = header & 0x7FFFFFF
+				else:
+					# Not a packet header (e.g. 0xFFFFFFFF dummy words)
+					continue
+
+				payload = words[i:i + wordCount]
+				i += wordCount
+				if len(payload) == 0:
+					continue
 
-		f = open(bitFile, "rb")
-
-		while currentState != fourthByte_st:
-			byte = f.read(1)
-			if currentState == header_st and ord(byte) == 0xAA:
-				currentState = firstByte_st
-			elif currentState == firstByte_st and ord(byte) == 0x99:
-				currentState = secondByte_st
-			elif currentState == secondByte_st and ord(byte) == 0x55:
-				currentState = thirdByte_st
-			elif currentState == thirdByte_st and ord(byte) == 0x66:
-				currentState = fourthByte_st								
-			else:
-				currentState = header_st
-
-		# Find type 2 write packet (start of actual configuration frame data)
-		while 1:
-			bytes = f.read(4)
-			word = (ord(bytes[0]) << 24) | (ord(bytes[1]) << 16) | (ord(bytes[2]) << 8) | ord(bytes[3])
-			if (word & self.type2WriteMask) == self.type2WriteMask:
-				break
-		
-		self.extract_frame_data(f, fradStructure, 1, 0, 1, 0)
+				if opcode == self.WRITE_OPCODE:
+					if register == self.FAR_REGISTER:
+						far = int(payload[-1])
+					elif register == self.CMD_REGISTER:
+						desync = (int(payload[-1]) == self.DESYNC_COMMAND)
+					elif register == self.FDRI_REGISTER:
+						# The last frame written only flushes the frame buffer
+						frames = self.store_frame_burst(payload, far, fradStructure, 0, numFrames)
+						if len(frames) > 0:
+							lastFrame = frames[-1:]
+					elif register == self.MFWR_REGISTER and lastFrame is not None:
+						# Multiple frame write copies the last frame written to the current FAR
+						if fradStructure.fradIndex.get(far, numFrames) < numFrames:
+							fradStructure.set_frames([fradStructure.fradIndex[far]], lastFrame)
+				elif opcode == self.READ_OPCODE and register == self.FDRO_REGISTER:
+					# A pad frame precedes the frames read back
+					self.store_frame_burst(payload, far, fradStructure, 1, numFrames)
+
+			if self.stats is not None:
+				self.stats.record('BinParser.decode_packets', startTime, words=min(i, numWords))
+			syncOffset = data.find(self.SYNC_BYTES, start + 4 * i) if desync else -1
+
+	def store_frame_burst(self, payload, far, fradStructure, read, numFrames):
+		"""
+		Helper function which stores a burst of FDRI or FDRO frame data starting at the given frame address.
+		Frames are assigned in fradArray order so dummy frames at row boundaries are skipped.
+		:param payload: Array of words written to FDRI or read from FDRO
+		:param far: Frame address of the first frame in the burst
+		:param fradStructure: FradStructure object which will store frame data
+		:param read: 1 if the burst was read from FDRO (leading pad frame), 0 if written to FDRI (trailing pad frame)
+		:param numFrames: Only frames with a frame index below numFrames are stored
+		:return: 2D array of the frames stored
+		"""
+		if far not in fradStructure.fradIndex:
+			print "FRAD out of bounds in BinParser:store_frame_burst()"
+			return payload[:0]
+
+		startTime = self.stats.start() if self.stats is not None else 0
+		wordsPerFrame = fradStructure.wordsPerFrame
+		frames = payload[:len(payload) / wordsPerFrame * wordsPerFrame].reshape(-1, wordsPerFrame)
+		frames = frames[1:] if read else frames[:-1]
+
+		positions = fradStructure.framePosition[fradStructure.fradIndex[far]] + numpy.arange(len(frames))
+		frames = frames[positions < len(fradStructure.streamIndex)]
+		frameIndices = fradStructure.streamIndex[positions[positions < len(fradStructure.streamIndex)]]
+		stored = (frameIndices >= 0) & (frameIndices < numFrames)
+		frames = frames[stored]
+		fradStructure.set_frames(frameIndices[stored], frames)
+		if self.stats is not None:
+			self.stats.record('BinParser.store_frames', startTime, frames=len(frames), skippedWords=len(payload) - len(frames) * wordsPerFrame)
+		return frames
+
+	def index_packets(self, data, fradStructure):
+		"""
+		This function finds where the data of every frame is in a bitstream or readback file without decoding it.
+		Only packet headers are read, following the same rules as decode_packets, so data can be a memory map of a
+		large file of which only the headers are touched.
+		:param data: Contents of the file (a string or mmap object)
+		:param fradStructure: FradStructure object of the device
+		:return: Array of the byte offset of every frame in data in frame index order, -1 for frames not in the file
+		"""
+		frameOffsets = numpy.zeros(fradStructure.numFrads, dtype=numpy.int64) - 1
+		wordsPerFrame = fradStructure.wordsPerFrame
+		syncOffset = data.find(self.SYNC_BYTES)
+		if syncOffset < 0:
+			raise IOError("Sync word not found in BinParser:index_packets()")
+
+		while syncOffset >= 0:
+			offset = syncOffset + len(self.SYNC_BYTES)
+			far = 0
+			register = 0
+			lastFrameOffset = -1
+			desync = 0
+			while offset + 4 <= len(data) and not desync:
+				header = struct.unpack_from('>I', data, offset)[0]
+				offset += 4
+				packetType = header >> 29
+				opcode = (header >> 27) & 0x3
+				if packetType == self.TYPE_1_PACKET:
+					register = (header >> 13) & 0x3FFF
+					wordCount = header & 0x7FF
+				elif packetType == self.TYPE_2_PACKET:
+					wordCount = header & 0x7FFFFFF
+				else:
+					# Not a packet header (e.g. 0xFFFFFFFF dummy words)
+					continue
+
+				payloadOffset = offset
+				wordCount = min(wordCount, (len(data) - offset) / 4)
+				offset += 4 * wordCount
+				if wordCount == 0:
+					continue
+
+				lastWord = struct.unpack_from('>I', data, offset - 4)[0]
+				if opcode == self.WRITE_OPCODE:
+					if register == self.FAR_REGISTER:
+						far = lastWord
+					elif register == self.CMD_REGISTER:
+						desync = (lastWord == self.DESYNC_COMMAND)
+					elif register == self.FDRI_REGISTER:
+						# The last frame written only flushes the frame buffer
+						numFrames = wordCount / wordsPerFrame - 1
+						offsets = self.index_frame_burst(frameOffsets, payloadOffset, numFrames, far, fradStructure)
+						if len(offsets) > 0:
+							lastFrameOffset = offsets[-1]
+					elif register == self.MFWR_REGISTER and lastFrameOffset >= 0:
+						# Multiple frame write copies the last frame written to the current FAR
+						if far in fradStructure.fradIndex:
+							frameOffsets[fradStructure.fradIndex[far]] = lastFrameOffset
+				elif opcode == self.READ_OPCODE and register == self.FDRO_REGISTER:
+					# A pad frame precedes the frames read back
+					numFrames = wordCount / wordsPerFrame - 1
+					self.index_frame_burst(frameOffsets, payloadOffset + 4 * wordsPerFrame, numFrames, far, fradStructure)
+
+			syncOffset = data.find(self.SYNC_BYTES, offset) if desync else -1
+		return frameOffsets
+
+	def index_frame_burst(self, frameOffsets, burstOffset, numFrames, far, fradStructure):
+		"""
+		Helper function which records the byte offsets of a burst of frames starting at the given frame address.
+		Frames are assigned in fradArray order so dummy frames at row boundaries are skipped.
+		:param frameOffsets: Array of the byte offset of every frame, updated in place
+		:param burstOffset: Byte offset of the first frame of the burst
+		:param numFrames: Number of frames in the burst, not counting pad frames
+		:param far: Frame address of the first frame in the burst
+		:param fradStructure: FradStructure object of the device
+		:return: Array of the byte offsets recorded
+		"""
+		if far not in fradStructure.fradIndex:
+			print "FRAD out of bounds in BinParser:index_frame_burst()"
+			return frameOffsets[:0]
+		positions = fradStructure.framePosition[fradStructure.fradIndex[far]] + numpy.arange(max(numFrames, 0))
+		offsets = burstOffset + 4 * fradStructure.wordsPerFrame * numpy.arange(len(positions), dtype=numpy.int64)
+		offsets = offsets[positions < len(fradStructure.streamIndex)]
+		frameIndices = fradStructure.streamIndex[positions[positions < len(fradStructure.streamIndex)]]
+		offsets = offsets[frameIndices >= 0]
+		frameOffsets[frameIndices[frameIndices >= 0]] = offsets
+		return offsets
 
 	def extract_frame_data(self, fd, fradStructure, includeBram, padFrame, dummyFrames, swapEndian):
 		"""
 		This function extracts frame data from a file once the location of configuration data has been found.
+		The whole configuration payload is read in one call and decoded as an array of 32 bit words.
 		:param fd: File descriptor that is pointing to the start of the configuration data
 		:param fradStructure: FradStructure object to be loaded by parsing
+		:param includeBram: 1 to extract every frame, 0 to stop after the logic frames
+		:param padFrame: 1 if a pad frame precedes the first frame
+		:param dummyFrames: 1 if 2 dummy frames are inserted when type, row, or topBottom boundaries are crossed
+		:param swapEndian: 1 if words are stored Little Endian (JCM .data files)
 		:return: returns nothing
 		"""
-		if padFrame:
-			for i in range(fradStructure.wordsPerFrame):
-				bytes = fd.read(4)
-
-		# Parse each 32 bit word and store it in appropriate word/frame location
-		prevType = 0
-		prevTopBottom = 0
-		prevRow = 0
 		numFrames = fradStructure.get_num_frads() if includeBram else fradStructure.numLogicFrames
-		frameCount = 0
+		wordsPerFrame = fradStructure.wordsPerFrame
+		frameOffsets = fradStructure.device.get_stream_layout(padFrame, dummyFrames)[:numFrames]
+		streamWords = int(frameOffsets[-1]) + wordsPerFrame if numFrames > 0 else 0
+
+		# Parse every 32 bit word at once and gather the frames out of the stream
+		startTime = self.stats.start() if self.stats is not None else 0
+		data = fd.read(streamWords * 4)
+		fd.close()
+		if len(data) < streamWords * 4:
+			raise IOError("Unexpected end of configuration data in BinParser:extract_frame_data()")
+		if self.stats is not None:
+			self.stats.record('BinParser.read', startTime, bytes=len(data))
+			startTime = self.stats.start()
+		words = numpy.frombuffer(data, dtype='<u4' if swapEndian else '>u4')
+		frames = words[frameOffsets[:, None] + numpy.arange(wordsPerFrame)].astype(numpy.uint32)
+		if self.stats is not None:
+			self.stats.record('BinParser.decode_words', startTime, bytes=len(data), words=streamWords)
+			startTime = self.stats.start()
+		fradStructure.append_frames(frames)
 		fradStructure.set_current_frad(0)
-		while frameCount < numFrames:
-			# Skip dummy frames!
-			if (dummyFrames == 1) and (fradStructure.get_type() != prevType or fradStructure.get_top_bottom() != prevTopBottom or fradStructure.get_row() != prevRow):
-				prevType = fradStructure.get_type()
-				prevTopBottom = fradStructure.get_top_bottom()
-				prevRow = fradStructure.get_row()
-				# 2 dummy frames when type, row, or topBottom boundaries crossed
-				for i in range(2*fradStructure.wordsPerFrame):
-					bytes = fd.read(4)
-			wordCount = 0
-			while wordCount < fradStructure.wordsPerFrame:
-				bytes = fd.read(4)
-				if swapEndian == 0:
-					word = (ord(bytes[0]) << 24) | (ord(bytes[1]) << 16) | (ord(bytes[2]) << 8) | ord(bytes[3])
-				else:
-					word = (ord(bytes[3]) << 24) | (ord(bytes[2]) << 16) | (ord(bytes[1]) << 8) | ord(bytes[0])
-				fradStructure.append_word(word)
-				wordCount += 1
-			frameCount += 1
-			fradStructure.step_forward()
-		fd.close()		
+		if self.stats is not None:
+			self.stats.record('BinParser.store_frames', startTime, frames=len(frames), skippedWords=streamWords - frames.size)
 
 if __name__ == '__main__':
 	from FrameOperations import FrameOperations 
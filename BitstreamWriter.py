@@ -0,0 +1,377 @@
+__author__ = 'Peter Zabriskie'
+import time
+import numpy
+from FradStructure import FradStructure
+from FrameEcc import FrameEcc
+
+class BitstreamWriter:
+	"""
+	This class writes the frame data of a FradStructure back out as:
+		Normal bitstream files (.bit)
+		.bin files
+		.rbt files
+		Raw frame dumps (frame data only, in frame index order)
+	Frames are written in the order the device auto-increments the frame address (the order of the frads/*.txt list),
+	including the 2 dummy frames at type, topBottom, and row boundaries and the pad frame that flushes the frame buffer.
+	Frame data is converted and written blockFrames frames at a time instead of word by word.
+	Configuration data writes the device IDCODE before any frame data and is checked by a CRC write after the frames.
+	Full bitstreams end with the startup sequence (GRESTORE, DGHIGH/LFRM, START) so the device goes DONE; repair
+	bitstreams do not restart the device. The IDCODE is looked up by part name (see IDCODES) unless one is given.
+	"""
+
+	def __init__(self, blockFrames=4096):
+		"""
+		Construct a new BitstreamWriter object
+		:param blockFrames: Number of frames converted and written at a time. Memory use depends on this, not on the device size.
+		:return: returns nothing
+		"""
+		self.blockFrames = blockFrames
+
+		self.DUMMY_WORD = 0xFFFFFFFF
+		self.BUS_WIDTH_SYNC_WORD = 0x000000BB
+		self.BUS_WIDTH_DETECT_WORD = 0x11220044
+		self.SYNC_WORD = 0xAA995566
+		self.NOOP = 0x20000000
+
+		# Configuration packet headers
+		self.TYPE_1_WRITE = 0x30000000
+		self.TYPE_2_WRITE = 0x50000000
+		self.REGISTER_SHIFT = 13
+		self.CRC_REGISTER = 0
+		self.FAR_REGISTER = 1
+		self.FDRI_REGISTER = 2
+		self.CMD_REGISTER = 4
+		self.IDCODE_REGISTER = 12
+
+		# Commands (the same codes on Virtex-5, 7-series, and UltraScale)
+		self.WCFG_COMMAND = 1
+		self.DGHIGH_COMMAND = 3
+		self.START_COMMAND = 5
+		self.RCRC_COMMAND = 7
+		self.GRESTORE_COMMAND = 10
+		self.DESYNC_COMMAND = 13
+		# NOOPs after DGHIGH/LFRM that give the device time before START
+		self.STARTUP_NOOPS = 100
+
+		# IDCODE of every part in frads/, with the revision bits zero as written by the vendor tools
+		self.IDCODES = {
+			'xc5vlx110t': 0x02AD6093,
+			'xc7k325t': 0x03651093,
+			'xc7z020': 0x03727093,
+			'xcku040': 0x03822093,
+		}
+		# The bitstream CRC is the same on every series
+		self.crcEngine = FrameEcc()
+
+		# .bit header up to the design name field
+		self.BIT_HEADER = '\x00\x09\x0f\xf0\x0f\xf0\x0f\xf0\x0f\xf0\x00\x00\x01'
+
+	def write_bit_file(self, bitFile, fradStructure, includeBram=1, designName='design', part=None, idcode=None):
+		"""
+		Writes a .bit file that configures every frame of a FradStructure and starts up the device
+		:param bitFile: Path to the file to be written
+		:param fradStructure: FradStructure object holding the frame data
+		:param includeBram: 1 to write every frame, 0 to stop after the logic frames
+		:param designName: Design name stored in the header
+		:param part: Part name stored in the header (defaults to the name of the frame address file, e.g. xc7k325t)
+		:param idcode: IDCODE of the device (defaults to the IDCODE of the part)
+		:return: returns nothing
+		"""
+		self.write_frame_runs(bitFile, fradStructure, self.get_full_runs(fradStructure, includeBram), 1, 1, designName, part, idcode)
+
+	def write_bin_file(self, binFile, fradStructure, includeBram=1, idcode=None):
+		"""
+		Writes a .bin file (a .bit file without the header)
+		:param binFile: Path to the file to be written
+		:param fradStructure: FradStructure object holding the frame data
+		:param includeBram: 1 to write every frame, 0 to stop after the logic frames
+		:param idcode: IDCODE of the device (defaults to the IDCODE of the part named by the frame address file)
+		:return: returns nothing
+		"""
+		self.write_frame_runs(binFile, fradStructure, self.get_full_runs(fradStructure, includeBram), 0, 1, idcode=idcode)
+
+	def write_rbt_file(self, rbtFile, fradStructure, includeBram=1, designName='design', part=None, idcode=None):
+		"""
+		Writes an .rbt file (an ASCII bitstream with one line of 32 1's and 0's per word)
+		:param rbtFile: Path to the file to be written
+		:param fradStructure: FradStructure object holding the frame data
+		:param includeBram: 1 to write every frame, 0 to stop after the logic frames
+		:param designName: Design name stored in the header
+		:param part: Part name stored in the header (defaults to the name of the frame address file)
+		:param idcode: IDCODE of the device (defaults to the IDCODE of the part)
+		:return: returns nothing
+		"""
+		if part is None:
+			part = self.get_part(fradStructure)
+		idcode = self.get_idcode(part, idcode)
+		runs = self.get_full_runs(fradStructure, includeBram)
+		numWords = self.get_configuration_length(fradStructure, runs, 1)
+		with open(rbtFile, 'wb') as f:
+			f.write("Xilinx ASCII Bitstream\n")
+			f.write("Created by BitstreamWriter\n")
+			f.write("Design name: \t" + designName + "\n")
+			f.write("Part:        \t" + part + "\n")
+			f.write("Date:        \t" + time.strftime("%a %b %d %H:%M:%S %Y") + "\n")
+			f.write("Bits:        \t" + str(32 * numWords) + "\n")
+			for words in self.configuration_blocks(fradStructure, runs, idcode, 1):
+				f.write(self.words_to_ascii(words))
+
+	def write_raw_frames(self, rawFile, fradStructure, includeBram=1, swapEndian=0):
+		"""
+		Writes only the frame data of a FradStructure in frame index order, without commands, dummy frames, or pad frames
+		:param rawFile: Path to the file to be written
+		:param fradStructure: FradStructure object holding the frame data
+		:param includeBram: 1 to write every frame, 0 to stop after the logic frames
+		:param swapEndian: 1 to write words Little Endian, 0 for Big Endian
+		:return: returns nothing
+		"""
+		numFrames = fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames
+		with open(rawFile, 'wb') as f:
+			for start in range(0, numFrames, self.blockFrames):
+				frames = fradStructure.get_frames_by_index(numpy.arange(start, min(start + self.blockFrames, numFrames)))
+				f.write(numpy.asarray(frames, dtype='<u4' if swapEndian else '>u4').tostring())
+
+	def write_repair_file(self, repairFile, goldenFradStructure, upsets=None, readback=None, includeBram=0, mergeGap=0,
+		mskFradStructure=None, careMask=None, designName='repair', part=None, idcode=None):
+		"""
+		Writes a partial bitstream that rewrites only the golden frames of the frames with upsets of a running device.
+		The frames are checked by a CRC write before DESYNC, and the device is not restarted.
+		Frames are rewritten in the order visited by step_forward, and frames that follow each other in the configuration
+		data are written with one FDRI packet. With mergeGap > 0, frames separated by at most mergeGap frames (dummy
+		frames included) are also merged, which rewrites the golden frames between them but saves the FAR write and pad
+		frame of a new packet.
+		When frames are found from a readback, bits that change at runtime (e.g. LUTRAM or SRL contents) should be
+		masked with mskFradStructure or careMask, the same way as in FrameOperations.diff_array and diff_care, so
+		frames are not rewritten over live contents. BRAM frames are only repaired with includeBram=1 for the same reason.
+		A .bit header is written when the file name ends with .bit.
+		:param repairFile: Path to the file to be written
+		:param goldenFradStructure: FradStructure object holding the golden configuration
+		:param upsets: Upsets as (frad, word, bit) tuples or an N x 3 array (e.g. from FrameOperations.diff or diff_array)
+		:param readback: FradStructure object holding readback data, used instead of upsets to find the frames that differ
+		:param includeBram: 1 to repair every frame, 0 to repair logic frames only (used with readback)
+		:param mergeGap: Largest number of frames between two frames written with one FDRI packet, 0 to write only the frames with upsets
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored (used with readback)
+		:param careMask: Optional CareMask object. Only the bits it cares about are compared, over the frames it covers (used with readback)
+		:param designName: Design name stored in the .bit header
+		:param part: Part name stored in the .bit header (defaults to the name of the frame address file)
+		:param idcode: IDCODE of the device (defaults to the IDCODE of the part)
+		:return: List of (first frad, number of frames written) of every FDRI packet
+		"""
+		frameIndices = self.find_repair_frames(goldenFradStructure, upsets, readback, includeBram, mskFradStructure, careMask)
+		runs = self.merge_frame_runs(goldenFradStructure, frameIndices, mergeGap)
+		self.write_frame_runs(repairFile, goldenFradStructure, runs, repairFile.lower().endswith('.bit'), 0, designName, part, idcode)
+		return [(int(goldenFradStructure.fradArray[start]), stop - start) for start, stop in runs]
+
+	def find_repair_frames(self, goldenFradStructure, upsets, readback, includeBram, mskFradStructure=None, careMask=None):
+		"""
+		Helper function which finds the frame indices of the frames to be rewritten
+		:return: Sorted array of frame indices
+		"""
+		if readback is not None:
+			if careMask is not None:
+				numFrames = careMask.numFrames
+			else:
+				numFrames = goldenFradStructure.numFrads if (includeBram) else goldenFradStructure.numLogicFrames
+			diffImage = goldenFradStructure.get_frame_range(0, numFrames) ^ readback.get_frame_range(0, numFrames)
+			if mskFradStructure is not None:
+				diffImage &= ~mskFradStructure.get_frame_range(0, numFrames)
+			if careMask is not None:
+				diffImage &= careMask.get_image()
+			return numpy.flatnonzero(numpy.any(diffImage != 0, axis=1))
+		upsets = numpy.asarray(upsets if upsets is not None else [], dtype=numpy.int64).reshape(-1, 3)
+		frameIndices = goldenFradStructure.get_frame_indices(numpy.unique(upsets[:, 0]))
+		if numpy.any(frameIndices < 0):
+			print "FRAD out of bounds in BitstreamWriter:find_repair_frames()"
+		return numpy.unique(frameIndices[frameIndices >= 0])
+
+	def merge_frame_runs(self, fradStructure, frameIndices, mergeGap):
+		"""
+		Helper function which merges frames into runs of positions in the configuration data
+		:param fradStructure: FradStructure object of the device
+		:param frameIndices: Sorted array of frame indices
+		:param mergeGap: Largest number of frames between two frames of the same run
+		:return: List of (start, stop) positions in fradArray
+		"""
+		positions = numpy.asarray(fradStructure.framePosition)[frameIndices]
+		if len(positions) == 0:
+			return []
+		newRun = numpy.concatenate(([True], numpy.diff(positions) > mergeGap + 1))
+		starts = positions[newRun]
+		stops = positions[numpy.concatenate((newRun[1:], [True]))] + 1
+		return zip(starts.tolist(), stops.tolist())
+
+	def get_full_runs(self, fradStructure, includeBram):
+		"""
+		:return: List holding the one run of positions in fradArray written by a full bitstream
+		"""
+		numFrames = fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames
+		if numFrames == 0:
+			return []
+		return [(0, int(fradStructure.framePosition[numFrames - 1]) + 1)]
+
+	def get_part(self, fradStructure):
+		"""
+		:return: Part name of a FradStructure taken from the name of its frame address file (e.g. xc7k325t)
+		"""
+		return fradStructure.device.fradFile.replace('\\', '/').split('/')[-1].split('_')[0]
+
+	def get_idcode(self, part, idcode=None):
+		"""
+		Helper function which returns the IDCODE written to a device
+		:param part: Part name, e.g. xc7k325t
+		:param idcode: IDCODE given by the caller, or None to look it up by part name (ValueError if the part is not in IDCODES)
+		:return: IDCODE of the device
+		"""
+		if idcode is not None:
+			return idcode
+		if part not in self.IDCODES:
+			raise ValueError("No IDCODE known for part " + part + " in BitstreamWriter:get_idcode()")
+		return self.IDCODES[part]
+
+	def write_frame_runs(self, path, fradStructure, runs, bitHeader, startup, designName='design', part=None, idcode=None):
+		"""
+		Helper function which writes binary configuration data writing runs of frames, with or without a .bit header
+		:param path: Path to the file to be written
+		:param fradStructure: FradStructure object holding the frame data
+		:param runs: List of (start, stop) positions in fradArray
+		:param bitHeader: 1 to start the file with a .bit header
+		:param startup: 1 to end with the startup sequence (full bitstreams), 0 to leave the device running (repair bitstreams)
+		:param designName: Design name stored in the header
+		:param part: Part name stored in the header (defaults to the name of the frame address file)
+		:param idcode: IDCODE of the device (defaults to the IDCODE of the part)
+		:return: returns nothing
+		"""
+		if part is None:
+			part = self.get_part(fradStructure)
+		idcode = self.get_idcode(part, idcode)
+		with open(path, 'wb') as f:
+			if bitHeader:
+				numBytes = 4 * self.get_configuration_length(fradStructure, runs, startup)
+				f.write(self.bit_header(designName, part, numBytes))
+			for words in self.configuration_blocks(fradStructure, runs, idcode, startup):
+				f.write(words.astype('>u4').tostring())
+
+	def get_configuration_length(self, fradStructure, runs, startup):
+		"""
+		:return: Number of 32 bit words of configuration data writing the given runs of frames
+		"""
+		numWords = len(self.preamble_words(0)) + len(self.postamble_words(0, startup))
+		for start, stop in runs:
+			numWords += len(self.frame_write_words(0, 0)) + (stop - start + 1) * fradStructure.wordsPerFrame
+		return numWords
+
+	def configuration_blocks(self, fradStructure, runs, idcode, startup):
+		"""
+		Generator which returns configuration data writing runs of frames, in blocks
+		:param fradStructure: FradStructure object holding the frame data
+		:param runs: List of (start, stop) positions in fradArray. Every run is written with one FDRI packet
+		:param idcode: IDCODE of the device
+		:param startup: 1 to end with the startup sequence, 0 to end with the CRC check and DESYNC only
+		:return: Yields arrays of 32 bit words in file order
+		"""
+		wordsPerFrame = fradStructure.wordsPerFrame
+		yield self.preamble_words(idcode)
+		# The CRC restarts at the RCRC command of the preamble
+		crc = self.crcEngine.crc_words(self.IDCODE_REGISTER, [idcode])
+		for start, stop in runs:
+			far = int(fradStructure.fradArray[start])
+			packet = self.frame_write_words(far, (stop - start + 1) * wordsPerFrame)
+			crc = self.crcEngine.crc_words(self.CMD_REGISTER, [self.WCFG_COMMAND], crc)
+			crc = self.crcEngine.crc_words(self.FAR_REGISTER, [far], crc)
+			yield numpy.array(packet, dtype=numpy.uint32)
+			for frames in self.stream_blocks(fradStructure, start, stop):
+				crc = self.crcEngine.crc_words(self.FDRI_REGISTER, frames.ravel(), crc)
+				yield frames.ravel()
+			# The last frame written only flushes the frame buffer
+			flushFrame = numpy.zeros(wordsPerFrame, dtype=numpy.uint32)
+			crc = self.crcEngine.crc_words(self.FDRI_REGISTER, flushFrame, crc)
+			yield flushFrame
+		yield self.postamble_words(crc, startup)
+
+	def stream_blocks(self, fradStructure, start, stop):
+		"""
+		Generator which lays out frames in configuration data order, blockFrames at a time
+		:param fradStructure: FradStructure object holding the frame data
+		:param start: Position of the first frame in fradArray
+		:param stop: Position after the last frame in fradArray
+		:return: Yields 2D arrays (frames x wordsPerFrame), with zeros in the dummy frames
+		"""
+		for blockStart in range(start, stop, self.blockFrames):
+			streamIndex = fradStructure.streamIndex[blockStart:min(blockStart + self.blockFrames, stop)]
+			frames = numpy.zeros((len(streamIndex), fradStructure.wordsPerFrame), dtype=numpy.uint32)
+			isFrame = streamIndex >= 0
+			if numpy.any(isFrame):
+				frames[isFrame] = fradStructure.get_frames_by_index(streamIndex[isFrame])
+			yield frames
+
+	def type_1_write(self, register, numWords):
+		"""
+		:return: Header of a type 1 packet writing numWords words to a register
+		"""
+		return self.TYPE_1_WRITE | (register << self.REGISTER_SHIFT) | numWords
+
+	def preamble_words(self, idcode):
+		"""
+		Returns the words from the bus width detection pattern up to the first frame write
+		:param idcode: IDCODE of the device, checked by the device before it accepts frame data
+		:return: Array of 32 bit words
+		"""
+		words = [self.DUMMY_WORD] * 8 + [self.BUS_WIDTH_SYNC_WORD, self.BUS_WIDTH_DETECT_WORD, self.DUMMY_WORD, self.DUMMY_WORD,
+			self.SYNC_WORD, self.NOOP,
+			self.type_1_write(self.CMD_REGISTER, 1), self.RCRC_COMMAND, self.NOOP, self.NOOP,
+			self.type_1_write(self.IDCODE_REGISTER, 1), idcode, self.NOOP]
+		return numpy.array(words, dtype=numpy.uint32)
+
+	def frame_write_words(self, far, numPayloadWords):
+		"""
+		Returns the packets that start a write of frame data at a frame address
+		:param far: Frame address the FDRI write starts at
+		:param numPayloadWords: Number of words written to FDRI
+		:return: List of 32 bit words, ending with the FDRI packet header
+		"""
+		return [self.type_1_write(self.CMD_REGISTER, 1), self.WCFG_COMMAND, self.NOOP,
+			self.type_1_write(self.FAR_REGISTER, 1), far, self.NOOP,
+			self.type_1_write(self.FDRI_REGISTER, 0), self.TYPE_2_WRITE | numPayloadWords]
+
+	def postamble_words(self, crc, startup):
+		"""
+		Returns the words that end the configuration data: a CRC check of everything written since RCRC, the startup
+		sequence if requested followed by a second CRC check, then DESYNC and the NOOPs that flush it
+		:param crc: CRC of the words written since RCRC
+		:param startup: 1 to start up the device (GRESTORE, DGHIGH/LFRM, START), 0 to leave it running
+		:return: Array of 32 bit words
+		"""
+		words = [self.type_1_write(self.CRC_REGISTER, 1), crc, self.NOOP]
+		if startup:
+			for command, numNoops in ((self.GRESTORE_COMMAND, 1), (self.DGHIGH_COMMAND, self.STARTUP_NOOPS), (self.START_COMMAND, 1)):
+				words += [self.type_1_write(self.CMD_REGISTER, 1), command] + [self.NOOP] * numNoops
+				crc = self.crcEngine.crc_words(self.CMD_REGISTER, [command], crc)
+			words += [self.type_1_write(self.CRC_REGISTER, 1), crc, self.NOOP]
+		words += [self.type_1_write(self.CMD_REGISTER, 1), self.DESYNC_COMMAND] + [self.NOOP] * 16
+		return numpy.array(words, dtype=numpy.uint32)
+
+	def bit_header(self, designName, part, numBytes):
+		"""
+		Returns the header of a .bit file
+		:param designName: Design name stored in the header
+		:param part: Part name stored in the header
+		:param numBytes: Number of bytes of configuration data following the header
+		:return: String holding the header
+		"""
+		fields = ''
+		for key, value in (('a', designName), ('b', part), ('c', time.strftime("%Y/%m/%d")), ('d', time.strftime("%H:%M:%S"))):
+			value += '\x00'
+			fields += key + numpy.array([len(value)], dtype='>u2').tostring() + value
+		return self.BIT_HEADER + fields + 'e' + numpy.array([numBytes], dtype='>u4').tostring()
+
+	def words_to_ascii(self, words):
+		"""
+		Converts words to lines of 32 ascii 1's and 0's at once
+		:param words: Array of 32 bit words
+		:return: String with one line per word
+		"""
+		bits = numpy.unpackbits(numpy.asarray(words, dtype='>u4').view(numpy.uint8).reshape(-1, 4), axis=1)
+		lines = numpy.empty((len(bits), 33), dtype=numpy.uint8)
+		lines[:, :32] = bits + ord('0')
+		lines[:, 32] = ord('\n')
+		return lines.tostring()
@@ -0,0 +1,85 @@
+__author__ = 'Peter Zabriskie'
+import numpy
+from SparseBitset import SparseBitset
+
+class CareMask:
+	"""
+	This class combines any number of masks of a design into one image of the bits that matter when comparing readbacks.
+	Masks are either included (only their set bits are cared about, e.g. essential bits) or excluded (their set bits
+	are ignored, e.g. .msk readback masks or LUTRAM columns). The combined image is built once per design, so every
+	diff afterwards is a single (golden ^ readback) & care pass (see FrameOperations.diff_care).
+	"""
+
+	def __init__(self, fradStructure, includeBram=0):
+		"""
+		Construct a new CareMask object that cares about every bit until masks are added
+		:param fradStructure: FradStructure object of the device (any design, only its frame addresses are used)
+		:param includeBram: 1 to cover every frame, 0 to cover logic frames only
+		:return: returns nothing
+		"""
+		self.device = fradStructure.device
+		self.wordsPerFrame = fradStructure.wordsPerFrame
+		self.includeBram = includeBram
+		self.numFrames = fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames
+		self.care = numpy.zeros((self.numFrames, self.wordsPerFrame), dtype=numpy.uint32)
+		self.care[:] = 0xFFFFFFFF
+
+	def include(self, mask):
+		"""
+		Only care about the bits set in the mask (and any mask included before)
+		:param mask: FradStructure, MappedFradStructure or FrameStore object, SparseBitset object, or 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:return: returns this CareMask so calls can be chained
+		"""
+		self.care &= self.get_mask_image(mask)
+		return self
+
+	def exclude(self, mask):
+		"""
+		Ignore the bits set in the mask
+		:param mask: FradStructure, MappedFradStructure or FrameStore object, SparseBitset object, or 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:return: returns this CareMask so calls can be chained
+		"""
+		self.care &= ~self.get_mask_image(mask)
+		return self
+
+	def exclude_frames(self, frads):
+		"""
+		Ignore every bit of the given frames (e.g. the frames of LUTRAM or SRL columns)
+		:param frads: Iterable of frame addresses. Frame addresses not on the device or beyond numFrames are skipped
+		:return: returns this CareMask so calls can be chained
+		"""
+		frads = numpy.asarray(list(frads), dtype=numpy.int64)
+		positions = numpy.minimum(numpy.searchsorted(self.device.sortedFrads, frads), len(self.device.sortedFrads) - 1)
+		frameIndices = self.device.sortOrder[positions[self.device.sortedFrads[positions] == frads]]
+		self.care[frameIndices[frameIndices < self.numFrames]] = 0
+		return self
+
+	def get_mask_image(self, mask):
+		"""
+		Helper function which returns the first numFrames frames of a mask as a 2D array
+		:param mask: FradStructure, MappedFradStructure or FrameStore object, SparseBitset object, or 2D array of 32 bit words
+		:return: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		"""
+		if isinstance(mask, SparseBitset):
+			return mask.to_image(self.numFrames)
+		if hasattr(mask, 'get_frame_range'):
+			return mask.get_frame_range(0, self.numFrames)
+		return numpy.asarray(mask, dtype=numpy.uint32)[:self.numFrames]
+
+	def get_image(self):
+		"""
+		:return: 2D array (numFrames x wordsPerFrame) with a 1 at every bit that is cared about
+		"""
+		return self.care
+
+	def to_bitset(self):
+		"""
+		:return: SparseBitset object holding the bits that are cared about
+		"""
+		return SparseBitset.from_image(self.device, self.care)
+
+	def count(self):
+		"""
+		:return: Number of bits that are cared about
+		"""
+		return int(numpy.unpackbits(self.care.view(numpy.uint8)).sum())
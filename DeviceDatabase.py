@@ -0,0 +1,188 @@
+__author__ = 'Peter Zabriskie'
+import hashlib
+import os
+import threading
+import numpy
+
+class DeviceDatabase:
+	"""
+	This class holds the frame address list of a device together with the shape of its FradStructure tree.
+	The list is compiled once into a binary file next to the text file (e.g. frads/xcku040_frads.npz)
+	and recompiled automatically whenever the text file changes.
+	DeviceDatabase.load() keeps one read-only copy per device that every FradStructure of that device shares.
+	"""
+	FORMAT_VERSION = 1
+
+	registry = {}
+	registryLock = threading.Lock()
+
+	def __init__(self, fradFile, fradStructure):
+		"""
+		Construct a new DeviceDatabase object. Use DeviceDatabase.load() to get the shared copy instead.
+		:param fradFile: Path to file containing list of frame addresses
+		:param fradStructure: FradStructure object whose series determines how frame addresses are decoded
+		:return: returns nothing
+		"""
+		self.fradFile = fradFile
+		self.compiledFile = os.path.splitext(fradFile)[0] + '.npz'
+		self.series = fradStructure.series
+		self.wordsPerFrame = fradStructure.wordsPerFrame
+		self.streamLayouts = {}
+		self.layoutLock = threading.Lock()
+
+		text = open(fradFile, 'r').read()
+		self.sourceHash = hashlib.sha1(text).hexdigest()
+		if not self.read_compiled():
+			self.compile(text, fradStructure)
+			self.write_compiled()
+		self.build_index(fradStructure)
+
+	@staticmethod
+	def load(fradFile, fradStructure):
+		"""
+		Returns the shared DeviceDatabase for a device, loading it if it is not in the registry yet
+		or if the text file changed since it was loaded.
+		:param fradFile: Path to file containing list of frame addresses
+		:param fradStructure: FradStructure object whose series determines how frame addresses are decoded
+		:return: DeviceDatabase object
+		"""
+		key = (os.path.abspath(fradFile), fradStructure.series)
+		fileStat = os.stat(fradFile)
+		version = (fileStat.st_mtime, fileStat.st_size)
+		with DeviceDatabase.registryLock:
+			entry = DeviceDatabase.registry.get(key)
+			if entry is None or entry[0] != version:
+				entry = (version, DeviceDatabase(fradFile, fradStructure))
+				DeviceDatabase.registry[key] = entry
+			return entry[1]
+
+	def compile(self, text, fradStructure):
+		"""
+		Parses the text list of frame addresses and decodes the tree location of every frame.
+		:param text: Contents of the frame address file
+		:param fradStructure: FradStructure object whose masks are used to decode the frame addresses
+		:return: returns nothing
+		"""
+		fradArray = []
+		for line in text.split("\n"):
+			if (len(line) == 0):
+				continue
+			fradString = line[fradStructure.ADDRESS_START:fradStructure.ADDRESS_START+fradStructure.ADDRESS_SIZE]
+			fradArray.append(int(fradString, 16))
+		self.fradArray = numpy.array(fradArray, dtype=numpy.uint32)
+
+		frads = self.fradArray[self.fradArray != fradStructure.DUMMY_FRAME]
+		self.types = ((frads & fradStructure.typeMask) >> fradStructure.typeShift).astype(numpy.uint8)
+		if self.series == 8:
+			self.topBottoms = numpy.zeros(len(frads), dtype=numpy.uint8)
+		else:
+			self.topBottoms = ((frads & fradStructure.topBottomMask) >> fradStructure.topBottomShift).astype(numpy.uint8)
+		self.rows = ((frads & fradStructure.rowMask) >> fradStructure.rowShift).astype(numpy.uint8)
+		self.columns = ((frads & fradStructure.columnMask) >> fradStructure.columnShift).astype(numpy.uint16)
+		self.minors = (frads & fradStructure.minorMask).astype(numpy.uint8)
+
+	def read_compiled(self):
+		"""
+		Loads the compiled file if it exists and matches this format version, series, and text file.
+		:return: 1 if the compiled file was loaded, 0 if it has to be rebuilt
+		"""
+		try:
+			compiled = numpy.load(self.compiledFile)
+			try:
+				if (int(compiled['version']) != self.FORMAT_VERSION or int(compiled['series']) != self.series or
+					str(compiled['sourceHash']) != self.sourceHash):
+					return 0
+				self.fradArray = compiled['fradArray']
+				self.types = compiled['types']
+				self.topBottoms = compiled['topBottoms']
+				self.rows = compiled['rows']
+				self.columns = compiled['columns']
+				self.minors = compiled['minors']
+			finally:
+				compiled.close()
+		except (IOError, OSError, KeyError, ValueError):
+			return 0
+		return 1
+
+	def write_compiled(self):
+		"""
+		Writes the compiled file next to the text file. A directory that cannot be written to is skipped silently.
+		:return: returns nothing
+		"""
+		tempFile = self.compiledFile + '.%d.tmp' % os.getpid()
+		try:
+			with open(tempFile, 'wb') as f:
+				numpy.savez(f, version=self.FORMAT_VERSION, series=self.series, sourceHash=self.sourceHash,
+					fradArray=self.fradArray, types=self.types, topBottoms=self.topBottoms, rows=self.rows, columns=self.columns,
+					minors=self.minors)
+			os.rename(tempFile, self.compiledFile)
+		except (IOError, OSError):
+			if os.path.exists(tempFile):
+				os.remove(tempFile)
+
+	def build_index(self, fradStructure):
+		"""
+		Derives the lookup tables shared by every FradStructure of the device and makes all arrays read-only.
+		:param fradStructure: FradStructure object of the device
+		:return: returns nothing
+		"""
+		isFrame = self.fradArray != fradStructure.DUMMY_FRAME
+		# Position in fradArray of every frame and frame index of every fradArray entry (-1 for dummy frames).
+		# fradArray lists frames in the order the device auto-increments the frame address during configuration.
+		self.framePosition = numpy.flatnonzero(isFrame)
+		self.streamIndex = numpy.cumsum(isFrame) - 1
+		self.streamIndex[~isFrame] = -1
+		self.frads = self.fradArray[self.framePosition]
+		self.numFrads = len(self.frads)
+		self.fradIndex = dict(zip(self.frads.tolist(), range(self.numFrads)))
+		# Sorted frame addresses for looking up many frame indices at once
+		self.sortOrder = numpy.argsort(self.frads, kind='mergesort')
+		self.sortedFrads = self.frads[self.sortOrder].astype(numpy.int64)
+
+		typeCounts = numpy.bincount(self.types.astype(numpy.int64), minlength=5)
+		self.numLogicFrames = int(typeCounts[0])
+		self.numBramFrames = int(typeCounts[1])
+		self.numType2Frames = int(typeCounts[2])
+		self.numType3Frames = int(typeCounts[3])
+		self.numType4Frames = int(typeCounts[4])
+
+		# A new list starts in the tree whenever a level, or any level above it, changes value
+		if self.numFrads > 0:
+			newType = numpy.concatenate(([True], self.types[1:] != self.types[:-1]))
+			newTopBottom = newType | numpy.concatenate(([True], self.topBottoms[1:] != self.topBottoms[:-1]))
+			newRow = newTopBottom | numpy.concatenate(([True], self.rows[1:] != self.rows[:-1]))
+			newColumn = newRow | numpy.concatenate(([True], self.columns[1:] != self.columns[:-1]))
+		else:
+			newType = newTopBottom = newRow = newColumn = numpy.zeros(0, dtype=bool)
+		# Row of every frame. Raw configuration data holds 2 dummy frames before every row but the first
+		self.frameRows = numpy.cumsum(newRow) - 1
+		columnStarts = numpy.flatnonzero(newColumn)
+		self.columnNewType = newType[columnStarts]
+		self.columnNewTopBottom = newTopBottom[columnStarts]
+		self.columnNewRow = newRow[columnStarts]
+		self.columnMinorCounts = numpy.diff(numpy.append(columnStarts, self.numFrads))
+
+		for array in (self.fradArray, self.types, self.topBottoms, self.rows, self.columns, self.minors, self.framePosition,
+			self.streamIndex, self.frads, self.sortOrder, self.sortedFrads, self.columnNewType, self.columnNewTopBottom, self.columnNewRow, self.columnMinorCounts, self.frameRows):
+			array.flags.writeable = False
+
+	def get_stream_layout(self, padFrame, dummyFrames):
+		"""
+		Returns where every frame is in raw configuration data (the words read from FDRO or written to FDRI) of a format.
+		The layout is computed once per device and format and shared by every parser, so frames are gathered from
+		the stream in one step. A stream of the first n frames ends at word layout[n - 1] + wordsPerFrame.
+		:param padFrame: 1 if a pad frame precedes the first frame
+		:param dummyFrames: 1 if 2 dummy frames are inserted when type, row, or topBottom boundaries are crossed
+		:return: Read-only array of the word offset of every frame in the stream, in frame index order
+		"""
+		key = (1 if padFrame else 0, 1 if dummyFrames else 0)
+		with self.layoutLock:
+			layout = self.streamLayouts.get(key)
+			if layout is None:
+				positions = numpy.arange(self.numFrads, dtype=numpy.int64) + key[0]
+				if key[1]:
+					positions += 2 * self.frameRows
+				layout = positions * self.wordsPerFrame
+				layout.flags.writeable = False
+				self.streamLayouts[key] = layout
+			return layout
@@ -1,4 +1,19 @@
 __author__ = 'Peter Zabriskie'
+import numpy
+from DeviceDatabase import DeviceDatabase
+
+def out_of_bounds(message, code, strict):
+	"""
+	Reports an out of bounds frame address or word index the same way for FradStructure, MappedFradStructure and FrameStore
+	:param message: Error message naming the calling function
+	:param code: Value returned when strict is 0 (FRAD_OUT_OF_BOUNDS or WORD_OUT_OF_BOUNDS)
+	:param strict: 1 to raise a ValueError with the message, 0 to print it
+	:return: code
+	"""
+	if strict:
+		raise ValueError(message)
+	print message
+	return code
 
 class FradStructure:
 	"""
@@ -6,10 +21,12 @@ class FradStructure:
 	of the frame addresses in the device
 	"""
 
-	def __init__(self, series):
+	def __init__(self, series, contiguous=0, stats=None):
 		"""
 		Construct a new FradStructure object. Frad = Frame Address
 		:param series: The series of the device
+		:param contiguous: 1 to store all frame data in one contiguous numFrads x wordsPerFrame uint32 array
+		:param stats: Optional StageStats object which records the time and counters of load_frads
 		:return: returns nothing
 		"""
 
@@ -43,6 +60,8 @@ class FradStructure:
 		self.DUMMY_FRAME = 0xFF000000
 
 		self.series = series
+		self.contiguous = contiguous
+		self.stats = stats
 		self.numFrads = 0
 		self.numLogicFrames = 0
 		self.numBramFrames = 0
@@ -51,6 +70,13 @@ class FradStructure:
 		self.numType4Frames = 0
 		self.fradStructure = []
 		self.fradArray = []
+		self.frameList = []
+		self.device = None
+		self.fradIndex = {}
+		self.streamIndex = []
+		self.framePosition = []
+		self.frameData = None
+		self.frameFill = None
 		self.type = 0
 		self.topBottom = 0
 		self.row = 0
@@ -98,130 +124,269 @@ class FradStructure:
 
 	def load_frads(self, fradFile):
 		"""
-		Loads the FradStructure according to a list of frame addresses for a device
+		Loads the FradStructure according to a list of frame addresses for a device.
+		The list is read from its compiled form (see DeviceDatabase), which is shared by every FradStructure of the device.
 
 		:param fradFile: Path to file containing list of frame addresses
 		:return: returns nothing
 		"""
-		frads = open(fradFile, 'r').read().split("\n")
-		prevType = -1
-		prevTopBottom = -1
-		prevRow = -1
-		prevColumn = -1
-
-		for line in frads:
-			if (len(line) == 0):
-				continue
-
-			fradString = line[self.ADDRESS_START:self.ADDRESS_START+self.ADDRESS_SIZE]
-			fradVal = int(fradString, 16)
-			self.fradArray.append(fradVal)
-
-			loadTopBottom = 0
-			loadRow = 0
-			loadColumn = 0
-
-			if fradVal == self.DUMMY_FRAME:
-				continue
-
-			curType = (fradVal & self.typeMask) >> self.typeShift
-			curTopBottom = 0 if (self.series == 8) else (fradVal & self.topBottomMask) >> self.topBottomShift
-			curRow = (fradVal & self.rowMask) >> self.rowShift
-			curColumn = (fradVal & self.columnMask) >> self.columnShift
-
-			if(curType != prevType):
+		startTime = self.stats.start() if self.stats is not None else 0
+		self.device = DeviceDatabase.load(fradFile, self)
+		if self.stats is not None:
+			self.stats.record('FradStructure.load_device', startTime, frames=self.device.numFrads)
+			startTime = self.stats.start()
+		self.fradArray = self.device.fradArray
+		self.fradIndex = self.device.fradIndex
+		self.streamIndex = self.device.streamIndex
+		self.framePosition = self.device.framePosition
+		self.numFrads = self.device.numFrads
+		self.numLogicFrames = self.device.numLogicFrames
+		self.numBramFrames = self.device.numBramFrames
+		self.numType2Frames = self.device.numType2Frames
+		self.numType3Frames = self.device.numType3Frames
+		self.numType4Frames = self.device.numType4Frames
+
+		# Build the tree one column at a time. Each column holds one array of words per minor
+		self.fradStructure = []
+		self.frameList = []
+		newTypes = self.device.columnNewType.tolist()
+		newTopBottoms = self.device.columnNewTopBottom.tolist()
+		newRows = self.device.columnNewRow.tolist()
+		for i, minorCount in enumerate(self.device.columnMinorCounts.tolist()):
+			if newTypes[i]:
 				self.fradStructure.append([])
-				prevType = curType
-				loadTopBottom = 1
-				if(self.series == 8):
-					prevTopBottom = -1
-			if(curTopBottom != prevTopBottom or loadTopBottom == 1):
-				self.fradStructure[curType].append([])
-				prevTopBottom = curTopBottom
-				loadRow = 1
-			if(curRow != prevRow or loadRow == 1):
-				self.fradStructure[curType][curTopBottom].append([])
-				prevRow = curRow
-				loadColumn = 1
-			if(curColumn != prevColumn or loadColumn == 1):
-				self.fradStructure[curType][curTopBottom][curRow].append([])
-				prevColumn = curColumn
-			self.fradStructure[curType][curTopBottom][curRow][curColumn].append([]) # append another array to hold words
-			self.numFrads += 1
-			if curType == 0:
-				self.numLogicFrames += 1
-			if curType == 1:
-				self.numBramFrames += 1
-			if curType == 2:
-				self.numType2Frames += 1
-			if curType == 3:
-				self.numType3Frames += 1
-			if curType == 4:
-				self.numType4Frames += 1
+			if newTopBottoms[i]:
+				self.fradStructure[-1].append([])
+			if newRows[i]:
+				self.fradStructure[-1][-1].append([])
+			column = [[] for minor in range(minorCount)]
+			self.fradStructure[-1][-1][-1].append(column)
+			self.frameList.extend(column)
+
+		if self.contiguous:
+			self.allocate_frame_data()
+		if self.stats is not None:
+			self.stats.record('FradStructure.build_tree', startTime, frames=self.numFrads)
+
+	def allocate_frame_data(self, frameData=None):
+		"""
+		Allocates one contiguous numFrads x wordsPerFrame array for all frame data. Every frame in the
+		structure is replaced by a view of its row in the array, so frame data is returned without copying.
+		:param frameData: Existing numFrads x wordsPerFrame uint32 array to use instead (e.g. an array in shared memory)
+		:return: returns nothing
+		"""
+		self.contiguous = 1
+		if frameData is None:
+			self.frameData = numpy.zeros((self.numFrads, self.wordsPerFrame), dtype=numpy.uint32)
+			self.frameFill = numpy.zeros(self.numFrads, dtype=numpy.int32)
+		else:
+			self.frameData = frameData
+			self.frameFill = numpy.zeros(self.numFrads, dtype=numpy.int32) + self.wordsPerFrame
+		frameIndex = 0
+		for typeRows in self.fradStructure:
+			for halfRows in typeRows:
+				for row in halfRows:
+					for column in row:
+						for minor in range(len(column)):
+							column[minor] = self.frameData[frameIndex]
+							self.frameList[frameIndex] = column[minor]
+							frameIndex += 1
 
 	def append_word(self, word):
 		"""
-		This function appends the specified word to the current frame
+		This function appends the specified word to the current frame.
+		In contiguous mode words beyond the end of the frame are dropped.
 		:param word: 32 bit word to be added
 		:return: returns nothing
 		"""
-		self.fradStructure[self.type][self.topBottom][self.row][self.column][self.minor].append(word)
+		if self.contiguous:
+			frameIndex = self.fradIndex[self.get_current_frad()]
+			if self.frameFill[frameIndex] < self.wordsPerFrame:
+				self.frameData[frameIndex, self.frameFill[frameIndex]] = word
+				self.frameFill[frameIndex] += 1
+		else:
+			self.fradStructure[self.type][self.topBottom][self.row][self.column][self.minor].append(word)
+
+	def append_frames(self, frames, startIndex=0):
+		"""
+		This function appends a block of frames at once. Row i of frames is appended to the frame
+		startIndex + i, counting frames in the order visited by step_forward.
+		In contiguous mode the rows are copied straight into the frame data array.
+		:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:param startIndex: Index of the frame that receives the first row
+		:return: returns nothing
+		"""
+		if self.contiguous:
+			self.frameData[startIndex:startIndex + len(frames)] = frames
+			self.frameFill[startIndex:startIndex + len(frames)] = self.wordsPerFrame
+			return
 
-	def get_word_from_current_frad(self, wordNum):
+		frameIndex = startIndex
+		for words in numpy.asarray(frames, dtype=numpy.int64).tolist():
+			self.frameList[frameIndex].extend(words)
+			frameIndex += 1
+
+	def set_frames(self, frameIndices, frames):
+		"""
+		This function replaces the contents of several frames at once. Row i of frames becomes the data of
+		the frame frameIndices[i], counting frames in the order visited by step_forward.
+		:param frameIndices: Array of frame indices
+		:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:return: returns nothing
+		"""
+		if self.contiguous:
+			self.frameData[frameIndices] = frames
+			self.frameFill[frameIndices] = self.wordsPerFrame
+			return
+
+		for frameIndex, words in zip(frameIndices, numpy.asarray(frames, dtype=numpy.int64).tolist()):
+			self.frameList[frameIndex][:] = words
+
+	def get_word_from_current_frad(self, wordNum, strict=0):
 		"""
 		This function returns the specified word from the current frame.
 		:param wordNum: Index of desired word
-		:return: Returns value of word at specified location
+		:param strict: 1 to raise a ValueError if wordNum is out of bounds instead of printing a message
+		:return: Returns value of word at specified location, WORD_OUT_OF_BOUNDS (-2) if wordNum is out of bounds
 		"""
+		if wordNum < 0 or wordNum >= self.wordsPerFrame:
+			return out_of_bounds("wordNum out of bounds in FradStructure:get_word_from_current_frad()", self.WORD_OUT_OF_BOUNDS, strict)
+		return self.fradStructure[self.type][self.topBottom][self.row][self.column][self.minor][wordNum]
 
-		if wordNum >= self.wordsPerFrame:
-			print "wordNum out of bounds in FradStructure:get_word_in_current_frame()"
-		else:
-			return self.fradStructure[self.type][self.topBottom][self.row][self.column][self.minor][wordNum]
-
-	def get_word_from_frad(self, frad, wordNum):
+	def get_word_from_frad(self, frad, wordNum, strict=0):
 		"""
 		This function returns the specified word from the specified frame.
 		:param frad: Frame address where desired word is located
 		:param wordNum: Index of desired word
-		:return: Returns value of word at specified location
+		:param strict: 1 to raise a ValueError if the frame address or wordNum is out of bounds instead of printing a message
+		:return: Returns value of word at specified location, FRAD_OUT_OF_BOUNDS (-1) or WORD_OUT_OF_BOUNDS (-2)
+		if the frame address or wordNum is out of bounds
 		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		if frameIndex == self.FRAD_OUT_OF_BOUNDS:
+			return out_of_bounds("FRAD 0x%X out of bounds in FradStructure:get_word_from_frad()" % frad, self.FRAD_OUT_OF_BOUNDS, strict)
+		if wordNum < 0 or wordNum >= self.wordsPerFrame:
+			return out_of_bounds("wordNum out of bounds in FradStructure:get_word_from_frad()", self.WORD_OUT_OF_BOUNDS, strict)
+		return self.frameList[frameIndex][wordNum]
 
-		newType = (frad & self.typeMask) >> self.typeShift
-		newTopBottom = 0 if (self.series == 8) else (frad & self.topBottomMask) >> self.topBottomShift
-		newRow = (frad & self.rowMask) >> self.rowShift
-		newColumn = (frad & self.columnMask) >> self.columnShift
-		newMinor = frad & self.minorMask
-		if(self.check_location(newType, newTopBottom, newRow, newColumn, newMinor) == self.FRAD_OUT_OF_BOUNDS):
-			print "FRAD out of bounds in FradStructure:get_word_from_frad()"
-			return self.FRAD_OUT_OF_BOUNDS
-		if wordNum >= self.wordsPerFrame:
-			print "wordNum out of bounds in FradStructure:get_word_in_current_frame()"
-			return self.WORD_OUT_OF_BOUNDS
-		else:
-			return self.fradStructure[newType][newTopBottom][newRow][newColumn][newMinor][wordNum]
-
-	def get_frame_data(self, frad):
+	def get_frame_data(self, frad, strict=0):
 		"""
 		This function returns an array of all the words at the specified frame address.
+		In contiguous mode the array is a view into the frame data array.
 		:param frad: Frame address where desired data is located
-		:return: An array of all the words at the specified address
-		"""
-
-		newType = (frad & self.typeMask) >> self.typeShift
-		newTopBottom = 0 if (self.series == 8) else (frad & self.topBottomMask) >> self.topBottomShift
-		newRow = (frad & self.rowMask) >> self.rowShift
-		newColumn = (frad & self.columnMask) >> self.columnShift
-		newMinor = frad & self.minorMask
-		if(self.check_location(newType, newTopBottom, newRow, newColumn, newMinor) == self.FRAD_OUT_OF_BOUNDS):
-			print "FRAD out of bounds in FradStructure:get_frame_data()"
-			return self.FRAD_OUT_OF_BOUNDS
-
-		return self.fradStructure[newType][newTopBottom][newRow][newColumn][newMinor]
+		:param strict: 1 to raise a ValueError if the frame address is out of bounds instead of printing a message
+		:return: An array of all the words at the specified address, FRAD_OUT_OF_BOUNDS (-1) if the frame address is out of bounds
+		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		if frameIndex == self.FRAD_OUT_OF_BOUNDS:
+			return out_of_bounds("FRAD 0x%X out of bounds in FradStructure:get_frame_data()" % frad, self.FRAD_OUT_OF_BOUNDS, strict)
+		return self.frameList[frameIndex]
+
+	def get_frame_index(self, frad):
+		"""
+		This function returns the index of a frame, counting frames in the order visited by step_forward.
+		:param frad: Frame address
+		:return: Index of the frame, FRAD_OUT_OF_BOUNDS (-1) if the frame address is not in the device
+		"""
+		return self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+
+	def get_frame_indices(self, frads):
+		"""
+		This function looks up the index of many frames at once.
+		:param frads: Array of frame addresses
+		:return: Array of frame indices, FRAD_OUT_OF_BOUNDS (-1) where the frame address is not in the device
+		"""
+		frads = numpy.asarray(frads, dtype=numpy.int64).ravel()
+		positions = numpy.searchsorted(self.device.sortedFrads, frads)
+		positions[positions == self.numFrads] = 0
+		frameIndices = self.device.sortOrder[positions]
+		frameIndices[self.device.sortedFrads[positions] != frads] = self.FRAD_OUT_OF_BOUNDS
+		return frameIndices
+
+	def get_frames(self, frads, strict=0):
+		"""
+		This function returns the data of many frames in one call.
+		:param frads: Array of frame addresses
+		:param strict: 1 to raise a ValueError if any frame address is not in the device
+		:return: (frames, valid) where frames is a 2D array (len(frads) x wordsPerFrame) and valid is a boolean array
+		that is False for frame addresses not in the device (their rows are all zero)
+		"""
+		frameIndices = self.get_frame_indices(frads)
+		valid = frameIndices != self.FRAD_OUT_OF_BOUNDS
+		if strict and not valid.all():
+			raise ValueError("FRAD 0x%X out of bounds in FradStructure:get_frames()" % numpy.asarray(frads).ravel()[~valid][0])
+		frames = numpy.zeros((len(frameIndices), self.wordsPerFrame), dtype=numpy.uint32)
+		frames[valid] = self.get_frames_by_index(frameIndices[valid])
+		return frames, valid
+
+	def get_words(self, frads, wordNums, strict=0):
+		"""
+		This function returns one word from each of many frames in one call.
+		:param frads: Array of frame addresses
+		:param wordNums: Array of word indices, one per frame address
+		:param strict: 1 to raise a ValueError if any frame address or word index is out of bounds
+		:return: (words, valid) where words is an array of 32 bit words and valid is a boolean array
+		that is False where the frame address or word index is out of bounds (those words are zero)
+		"""
+		frameIndices = self.get_frame_indices(frads)
+		wordNums = numpy.asarray(wordNums, dtype=numpy.int64).ravel()
+		valid = (frameIndices != self.FRAD_OUT_OF_BOUNDS) & (wordNums >= 0) & (wordNums < self.wordsPerFrame)
+		if strict and not valid.all():
+			raise ValueError("FRAD or wordNum out of bounds in FradStructure:get_words()")
+		words = numpy.zeros(len(frameIndices), dtype=numpy.uint32)
+		if self.contiguous:
+			words[valid] = self.frameData[frameIndices[valid], wordNums[valid]]
+		else:
+			words[valid] = self.get_frames_by_index(frameIndices[valid])[numpy.arange(valid.sum()), wordNums[valid]]
+		return words, valid
+
+	def get_frame_range(self, start, stop):
+		"""
+		This function returns the data of frames start to stop - 1, counting frames in the order visited by step_forward.
+		The current frame address is not changed, so several threads can read the same FradStructure at once.
+		In contiguous mode the array is a view into the frame data array.
+		:param start: Index of the first frame
+		:param stop: Index one past the last frame
+		:return: 2D array ((stop - start) x wordsPerFrame) of 32 bit words
+		"""
+		if self.contiguous:
+			return self.frameData[start:stop]
+		return self.get_frames_by_index(numpy.arange(start, stop))
+
+	def iter_frames(self, start=0, stop=None):
+		"""
+		Generator which visits frames in the same order as step_forward without changing the current frame address.
+		:param start: Index of the first frame
+		:param stop: Index one past the last frame (defaults to numFrads)
+		:return: Yields (frad, frame data) pairs
+		"""
+		if stop is None:
+			stop = self.numFrads
+		for frameIndex in xrange(start, stop):
+			yield int(self.device.frads[frameIndex]), self.frameList[frameIndex]
+
+	def get_frames_by_index(self, frameIndices):
+		"""
+		This function copies the data of the given frames into a 2D array. Frames that hold fewer than
+		wordsPerFrame words (not loaded yet) are padded with zeros.
+		:param frameIndices: Array of frame indices
+		:return: 2D array (len(frameIndices) x wordsPerFrame) of 32 bit words
+		"""
+		if self.contiguous:
+			return self.frameData[frameIndices]
+		frameList = [self.frameList[frameIndex] for frameIndex in frameIndices]
+		if len(frameList) > 0 and set(map(len, frameList)) == set([self.wordsPerFrame]):
+			return numpy.array(frameList, dtype=numpy.uint32)
+		frames = numpy.zeros((len(frameIndices), self.wordsPerFrame), dtype=numpy.uint32)
+		for i, frameIndex in enumerate(frameIndices):
+			words = self.frameList[frameIndex][:self.wordsPerFrame]
+			frames[i, :len(words)] = words
+		return frames
 
 	def get_current_frame_data(self):
 		"""
 		This function returns an array of all the words at the current frame address.
+		In contiguous mode the array is a view into the frame data array.
 		:return: An array of all the words at the specified address
 		"""
 		return self.fradStructure[self.type][self.topBottom][self.row][self.column][self.minor]
@@ -234,6 +399,19 @@ class FradStructure:
 		return self.numFrads
 		
 
+	def get_row_frame_counts(self):
+		"""
+		This function returns the number of frames in each row of the device. A new row starts whenever
+		the type, top/bottom, or row value changes, which is where dummy frames appear in the configuration data.
+		:return: Array of frame counts, one per row, in the order visited by step_forward
+		"""
+		rowFrameCounts = []
+		for typeRows in self.fradStructure:
+			for halfRows in typeRows:
+				for row in halfRows:
+					rowFrameCounts.append(sum([len(column) for column in row]))
+		return rowFrameCounts
+
 	def get_current_frad(self):
 		"""
 		This returns the current frame address as a 32 bit value
@@ -336,7 +514,7 @@ class FradStructure:
 		:return: FRAD_OK (0) if row was moved up, FRAD_OUT_OF_BOUNDS (-1) if the row was already at the top value
 		"""
 		if self.series == 5:
-			if(self.row < len(fradStructure[self.type][self.topBottom]) - 1): #Increment if there is a row above
+			if(self.row < len(self.fradStructure[self.type][self.topBottom]) - 1): #Increment if there is a row above
 				self.row += 1
 			elif(self.topBottom == 1):# 1 indicates bottom half rows. Move to top
 				self.topBottom = 0
@@ -344,7 +522,7 @@ class FradStructure:
 			else:
 				return self.FRAD_OUT_OF_BOUNDS
 		elif self.series == 6 or self.series == 7:
-			if(self.row < len(fradStructure[self.type][self.topBottom]) - 1 and self.topBottom == 0):
+			if(self.row < len(self.fradStructure[self.type][self.topBottom]) - 1 and self.topBottom == 0):
 				self.row += 1
 			elif(self.row > 0 and self.topBottom == 1):# Move from bottom toward center
 				self.row -= 1
@@ -354,7 +532,7 @@ class FradStructure:
 			else:
 				return self.FRAD_OUT_OF_BOUNDS	
 		elif self.series == 8:
-			if(self.row < len(fradStructure[self.type][self.topBottom]) - 1):
+			if(self.row < len(self.fradStructure[self.type][self.topBottom]) - 1):
 				self.row += 1
 			else:
 				return self.FRAD_OUT_OF_BOUNDS	
@@ -373,7 +551,7 @@ class FradStructure:
 				self.row -= 1
 			elif(self.topBottom == 0):# 0 indicates top half rows. Move to bottom
 				self.topBottom = 1
-				self.row = len(fradStructure[self.type][self.topBottom]) - 1
+				self.row = len(self.fradStructure[self.type][self.topBottom]) - 1
 			else:
 				return self.FRAD_OUT_OF_BOUNDS
 		elif self.series == 6 or self.series == 7:
@@ -382,7 +560,7 @@ class FradStructure:
 			elif(self.row == 0 and self.topBottom == 0):# Move to bottom half
 				self.topBottom = 1
 				self.row = 0
-			elif(self.row < len(fradStructure[self.type][self.topBottom]) - 1 and self.topBottom == 1):# Increment row if on bottom half
+			elif(self.row < len(self.fradStructure[self.type][self.topBottom]) - 1 and self.topBottom == 1):# Increment row if on bottom half
 				self.row += 1
 			else:
 				return self.FRAD_OUT_OF_BOUNDS
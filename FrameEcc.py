@@ -0,0 +1,285 @@
+__author__ = 'Peter Zabriskie'
+import numpy
+from FradStructure import FradStructure
+
+class FrameEcc:
+	"""
+	This class computes the frame ECC of 7-series frames and the CRC of bitstreams without a golden image.
+	Frame ECC is only supported for 7-series frames (101 words). UltraScale (123 word) frames use a different code
+	layout that is not implemented yet, and Virtex-5 frames are not covered either; the CRC functions work for every series.
+	Every 7-series frame stores a 13 bit Hamming code in the low bits of word 50 (the code FRAME_ECCE2 checks).
+	Bit i of word w has the address w * 32 + i plus an offset that skips addresses used by the code bits themselves;
+	the code is the XOR of the addresses of every set bit, with bit 12 replaced by an overall parity bit.
+	The syndrome (stored ^ computed code) of a frame with one flipped bit identifies that bit, so single bit upsets
+	are located in one pass over the frames. Frames whose syndrome cannot be decoded hold more than one upset.
+	The bitstream CRC is the CRC-32C of every word written to a configuration register together with its 5 bit
+	register address, reset by the RCRC command and checked by writes to the CRC register.
+	"""
+
+	def __init__(self, wordsPerFrame=101):
+		"""
+		Construct a new FrameEcc object
+		:param wordsPerFrame: Number of words in every frame. Frame ECC needs the 101 word frames of 7-series devices,
+		the CRC functions work with any
+		:return: returns nothing
+		"""
+		self.wordsPerFrame = wordsPerFrame
+		self.ECC_WORDS_PER_FRAME = 101
+		self.ECC_WORD = 50
+		self.ECC_BITS = 13
+		self.ECC_MASK = 0x1FFF
+		self.PARITY_BIT = 12
+		self.NO_ERROR = 0
+		self.SINGLE_BIT_ERROR = 1
+		self.MULTI_BIT_ERROR = 2
+
+		self.CRC32C_POLYNOMIAL = 0x82F63B78
+		self.CRC_REGISTER = 0
+		self.CMD_REGISTER = 4
+		self.RCRC_COMMAND = 7
+		self.ADDRESS_BITS = 5
+		self.SYNC_BYTES = '\xAA\x99\x55\x66'
+		self.crcTables = {}
+		if wordsPerFrame != self.ECC_WORDS_PER_FRAME:
+			return
+
+		# Address of every bit of a frame. The offsets skip the addresses 0x400 and 0x800 (single code bits)
+		words = numpy.arange(wordsPerFrame)
+		offsets = numpy.where(words > 0x25, 0x1360, numpy.where(words > 0x6, 0x1340, 0x1320))
+		self.bitAddresses = (words * 32 + offsets)[:, None] + numpy.arange(32)
+		dataBits = numpy.ones((wordsPerFrame, 32), dtype=bool)
+		dataBits[self.ECC_WORD, :self.ECC_BITS] = False
+
+		# Word masks selecting the bits whose address has code bit j set, one row per code bit
+		self.codeMasks = numpy.zeros((self.ECC_BITS, wordsPerFrame), dtype=numpy.uint32)
+		for j in range(self.ECC_BITS):
+			selected = dataBits & (((self.bitAddresses >> j) & 1) == 1)
+			self.codeMasks[j] = (selected * (1 << numpy.arange(32, dtype=numpy.uint64))).sum(axis=1).astype(numpy.uint32)
+
+		# Syndrome of every single bit error: data bits give the parity-adjusted address, code bits their own bit
+		self.syndromeWords = numpy.zeros(1 << self.ECC_BITS, dtype=numpy.int32) - 1
+		self.syndromeBits = numpy.zeros(1 << self.ECC_BITS, dtype=numpy.int32) - 1
+		syndromes = self.parity_adjust(self.bitAddresses.astype(numpy.uint32))
+		self.syndromeWords[syndromes[dataBits]] = numpy.nonzero(dataBits)[0]
+		self.syndromeBits[syndromes[dataBits]] = numpy.nonzero(dataBits)[1]
+		self.syndromeWords[1 << numpy.arange(self.ECC_BITS)] = self.ECC_WORD
+		self.syndromeBits[1 << numpy.arange(self.ECC_BITS)] = numpy.arange(self.ECC_BITS)
+
+	def check_ecc_supported(self, method):
+		"""
+		Helper function which raises a ValueError unless frame ECC is supported for the frame size
+		:param method: Name of the calling function, for the error message
+		:return: returns nothing
+		"""
+		if self.wordsPerFrame != self.ECC_WORDS_PER_FRAME:
+			raise ValueError("Frame ECC is only supported for 7-series frames (101 words) in FrameEcc:" + method + "()")
+
+	def parity_adjust(self, codes):
+		"""
+		Helper function which replaces bit 12 of codes with bit 12 XOR the parity of bits 0 to 11
+		:param codes: Array of XORed bit addresses
+		:return: Array of 13 bit codes
+		"""
+		parity = codes & 0xFFF
+		for shift in (8, 4, 2, 1):
+			parity = parity ^ (parity >> shift)
+		return (codes ^ ((parity & 1) << self.PARITY_BIT)) & self.ECC_MASK
+
+	def compute_ecc(self, frames):
+		"""
+		Computes the code of many frames at once, ignoring the code bits stored in word 50
+		:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:return: Array of 13 bit codes, one per frame
+		"""
+		self.check_ecc_supported('compute_ecc')
+		frames = numpy.asarray(frames, dtype=numpy.uint32)
+		codes = numpy.zeros(len(frames), dtype=numpy.uint32)
+		for j in range(self.ECC_BITS):
+			# Parity of the selected bits of the whole frame
+			selected = numpy.bitwise_xor.reduce(frames & self.codeMasks[j], axis=1)
+			for shift in (16, 8, 4, 2, 1):
+				selected ^= selected >> shift
+			codes |= (selected & 1) << j
+		return self.parity_adjust(codes)
+
+	def update_ecc(self, frames):
+		"""
+		Stores the correct code in word 50 of many frames at once
+		:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words, changed in place
+		:return: returns nothing
+		"""
+		frames[:, self.ECC_WORD] = (frames[:, self.ECC_WORD] & ~numpy.uint32(self.ECC_MASK)) | self.compute_ecc(frames)
+
+	def compute_syndromes(self, fradStructure, includeBram=1):
+		"""
+		Computes the syndrome of every frame of a FradStructure
+		:param fradStructure: FradStructure object holding readback or bitstream data
+		:param includeBram: 1 to check every frame, 0 to check logic frames only
+		:return: Array of 13 bit syndromes in frame index order, 0 where the frame is consistent with its code
+		"""
+		numFrames = fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames
+		frames = fradStructure.get_frame_range(0, numFrames)
+		return self.compute_ecc(frames) ^ (frames[:, self.ECC_WORD] & self.ECC_MASK)
+
+	def classify_syndromes(self, syndromes):
+		"""
+		Decodes syndromes into error kinds and single bit error locations
+		:param syndromes: Array of 13 bit syndromes
+		:return: (kinds, words, bits) arrays. kinds holds NO_ERROR, SINGLE_BIT_ERROR, or MULTI_BIT_ERROR;
+		words and bits locate single bit errors and are -1 otherwise
+		"""
+		self.check_ecc_supported('classify_syndromes')
+		words = self.syndromeWords[syndromes]
+		bits = self.syndromeBits[syndromes]
+		kinds = numpy.where(syndromes == 0, self.NO_ERROR, numpy.where(words >= 0, self.SINGLE_BIT_ERROR, self.MULTI_BIT_ERROR))
+		return kinds, words, bits
+
+	def find_error_frames(self, fradStructure, includeBram=1):
+		"""
+		Finds the frames of a FradStructure whose code does not match their data. Only these need a golden compare.
+		:param fradStructure: FradStructure object holding readback data
+		:param includeBram: 1 to check every frame, 0 to check logic frames only
+		:return: Array of frame addresses
+		"""
+		syndromes = self.compute_syndromes(fradStructure, includeBram)
+		return fradStructure.device.frads[numpy.flatnonzero(syndromes)]
+
+	def find_upsets(self, fradStructure, includeBram=1):
+		"""
+		Locates upsets of a readback from the frame codes alone
+		:param fradStructure: FradStructure object holding readback data
+		:param includeBram: 1 to check every frame, 0 to check logic frames only
+		:return: (upsets, multiBitFrads). upsets is an N x 3 array of (frad, word, bit) single bit upsets,
+		multiBitFrads the frame addresses of frames with more than one upset
+		"""
+		syndromes = self.compute_syndromes(fradStructure, includeBram)
+		kinds, words, bits = self.classify_syndromes(syndromes)
+		single = numpy.flatnonzero(kinds == self.SINGLE_BIT_ERROR)
+		upsets = numpy.empty((len(single), 3), dtype=numpy.uint32)
+		upsets[:, 0] = fradStructure.device.frads[single]
+		upsets[:, 1] = words[single]
+		upsets[:, 2] = bits[single]
+		return upsets, fradStructure.device.frads[numpy.flatnonzero(kinds == self.MULTI_BIT_ERROR)]
+
+	def crc_step(self, crc, register, word):
+		"""
+		Updates a CRC with one word written to a register, one bit at a time
+		:param crc: CRC before the word
+		:param register: Address of the register written
+		:param word: 32 bit word written
+		:return: CRC after the word
+		"""
+		value = (register << 32) | word
+		for i in range(32 + self.ADDRESS_BITS):
+			if (value ^ crc) & 1:
+				crc = (crc >> 1) ^ self.CRC32C_POLYNOMIAL
+			else:
+				crc >>= 1
+			value >>= 1
+		return crc
+
+	def get_crc_table(self, name, function):
+		"""
+		Helper function which builds (once) byte lookup tables of a linear function on 32 bit CRC values
+		:param name: Key of the tables in self.crcTables
+		:param function: Function of one integer that is linear over GF(2)
+		:return: 4 x 256 array. The function of x is the XOR of row j at byte j of x
+		"""
+		if name not in self.crcTables:
+			columns = numpy.array([function(1 << i) for i in range(32)], dtype=numpy.uint32)
+			byteBits = (numpy.arange(256)[:, None] >> numpy.arange(8)) & 1
+			table = numpy.zeros((4, 256), dtype=numpy.uint32)
+			for j in range(4):
+				for i in range(8):
+					table[j] ^= numpy.where(byteBits[:, i] == 1, columns[8 * j + i], 0).astype(numpy.uint32)
+			self.crcTables[name] = table
+		return self.crcTables[name]
+
+	def apply_crc_table(self, table, values):
+		"""
+		Helper function which applies a linear function, given as byte lookup tables, to many values at once
+		:return: Array of 32 bit results
+		"""
+		values = numpy.asarray(values, dtype=numpy.uint32)
+		return table[0][values & 0xFF] ^ table[1][(values >> 8) & 0xFF] ^ table[2][(values >> 16) & 0xFF] ^ table[3][values >> 24]
+
+	def shift_table(self, level):
+		"""
+		Helper function which returns the tables of advancing a CRC over 2 ** level words of zeros
+		"""
+		if level == 0:
+			return self.get_crc_table('shift0', lambda crc: self.crc_step(crc, 0, 0))
+		previous = self.shift_table(level - 1)
+		return self.get_crc_table('shift%d' % level,
+			lambda crc: int(self.apply_crc_table(previous, self.apply_crc_table(previous, [crc]))[0]))
+
+	def crc_words(self, register, words, crc=0):
+		"""
+		Updates a CRC with many words written to one register at once
+		:param register: Address of the register written
+		:param words: Array of 32 bit words
+		:param crc: CRC before the words
+		:return: CRC after the words
+		"""
+		words = numpy.asarray(words, dtype=numpy.uint32)
+		if len(words) == 0:
+			return crc
+		# Contribution of every word on its own, then combine neighbors pairwise: left is advanced past right
+		dataTable = self.get_crc_table('data', lambda word: self.crc_step(0, 0, word))
+		registerContribution = self.crc_step(0, register, 0)
+		contributions = self.apply_crc_table(dataTable, words) ^ numpy.uint32(registerContribution)
+		size = 1
+		while size < len(contributions):
+			size *= 2
+		# Words of zeros in front do not change a CRC that starts at 0
+		contributions = numpy.concatenate((numpy.zeros(size - len(contributions), dtype=numpy.uint32), contributions))
+		level = 0
+		while len(contributions) > 1:
+			contributions = self.apply_crc_table(self.shift_table(level), contributions[0::2]) ^ contributions[1::2]
+			level += 1
+		# Advance the starting CRC past every word
+		for bit in range(len(bin(len(words))) - 2):
+			if (len(words) >> bit) & 1:
+				crc = int(self.apply_crc_table(self.shift_table(bit), [crc])[0])
+		return crc ^ int(contributions[0])
+
+	def check_crc(self, bitFile):
+		"""
+		Checks every CRC register write of a .bit, .bin, or .msk file against the CRC of the words written before it
+		:param bitFile: Path to bitstream file
+		:return: List of (word offset after the sync word, expected CRC, computed CRC) tuples, one per CRC write
+		"""
+		data = open(bitFile, 'rb').read()
+		syncOffset = data.find(self.SYNC_BYTES)
+		if syncOffset < 0:
+			raise IOError("Sync word not found in FrameEcc:check_crc()")
+		start = syncOffset + len(self.SYNC_BYTES)
+		words = numpy.frombuffer(data, dtype='>u4', count=(len(data) - start) / 4, offset=start).astype(numpy.uint32)
+
+		checks = []
+		crc = 0
+		register = 0
+		i = 0
+		while i < len(words):
+			header = int(words[i])
+			i += 1
+			packetType = header >> 29
+			if packetType == 1:
+				register = (header >> 13) & 0x1F
+				wordCount = header & 0x7FF
+			elif packetType == 2:
+				wordCount = header & 0x7FFFFFF
+			else:
+				continue
+			payload = words[i:i + wordCount]
+			i += wordCount
+			if (header >> 27) & 0x3 != 2:
+				continue
+			if register == self.CRC_REGISTER:
+				for word in payload.tolist():
+					checks.append((i - wordCount, int(word), crc))
+			else:
+				crc = self.crc_words(register, payload, crc)
+				if register == self.CMD_REGISTER and len(payload) > 0 and int(payload[-1]) == self.RCRC_COMMAND:
+					crc = 0
+		return checks
@@ -1,14 +1,29 @@
 __author__ = 'Peter Zabriskie'
+import numpy
 from FradStructure import FradStructure
+from FrameStore import FrameStore, digest_frames
 
 class FrameOperations:
 	"""
-	This class stores two FradStructure classes and performs various operations to compare them
+	This class stores two FradStructure classes and performs various operations to compare them.
+	Comparisons read frame data without moving the current frame address of any FradStructure, so one golden
+	and one mask FradStructure can be shared by FrameOperations objects running in many threads at once.
 	"""
 
-	def __init__(self, fradStructure1, fradStructure2):
+	def __init__(self, fradStructure1, fradStructure2, stats=None):
+		"""
+		Construct a new FrameOperations object
+		:param fradStructure1: First frad structure to be used in operations.
+		:param fradStructure2: Second frad structure to be used in operations.
+		:param stats: Optional StageStats object which records the time and counters of every comparison stage
+		:return: returns nothing
+		"""
 		self.fradStructure1 = fradStructure1
 		self.fradStructure2 = fradStructure2
+		self.stats = stats
+
+		# Column of numpy.unpackbits output holding bit i of a little endian word
+		self.BIT_COLUMNS = numpy.array([8 * (i / 8) + 7 - (i % 8) for i in range(32)])
 
 	def set_frad_structures(self, fradStructure1, fradStructure2):
 		"""
@@ -25,65 +40,142 @@ class FrameOperations:
 		Report all word differences between two FradStructure objects
 		:return: Array containing (frad, word, bit) upset tuples
 		"""
-		self.fradStructure1.set_current_frad(0)
-		self.fradStructure2.set_current_frad(0)
-
-		upsetList = []
+		return self.to_tuples(self.diff_array(includeBram))
 
+	def diff_array(self, includeBram, mskFradStructure=None):
+		"""
+		Report all bit differences between two FradStructure objects by XORing their whole configuration images at once
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored
+		:return: N x 3 array of (frad, word, bit) upset coordinates ordered by frame, word, then bit
+		"""
 		limit = self.fradStructure1.numFrads if (includeBram) else self.fradStructure1.numLogicFrames
-		for i in range(limit):
-			frame1 = self.fradStructure1.get_current_frame_data()
-			frame2 = self.fradStructure2.get_current_frame_data()
-
-			# print "fradStructure1: " + str(hex(self.fradStructure1.get_current_frad()))
-			# print "fradStructure2: " + str(hex(self.fradStructure2.get_current_frad()))
-			diffList = self.compare_frame(frame1, frame2)
-
-			for pair in diffList:
-				upsetList.append((self.fradStructure1.get_current_frad(), pair[0], pair[1]))
-
-			if len(diffList) > 0:
-				self.fradStructure1.print_current_frame()
-				self.fradStructure2.print_current_frame()
+		image1 = self.get_image(self.fradStructure1, limit)
+		image2 = self.get_image(self.fradStructure2, limit)
+		maskImage = self.get_image(mskFradStructure, limit) if mskFradStructure is not None else None
+		startTime = self.stats.start() if self.stats is not None else 0
+		diffImage = image1 ^ image2
+		if maskImage is not None:
+			diffImage &= ~maskImage
+		if self.stats is not None:
+			self.stats.record('FrameOperations.compare', startTime, frames=limit, words=diffImage.size)
+		return self.find_upsets(diffImage)
+
+	def diff_care(self, careMask):
+		"""
+		Report the bit differences between two FradStructure objects at the bits a precomputed CareMask cares about.
+		Equivalent to (image1 ^ image2) & care over the frames covered by the CareMask.
+		:param careMask: CareMask object combining every mask of the design
+		:return: N x 3 array of (frad, word, bit) upset coordinates ordered by frame, word, then bit
+		"""
+		image1 = self.get_image(self.fradStructure1, careMask.numFrames)
+		image2 = self.get_image(self.fradStructure2, careMask.numFrames)
+		startTime = self.stats.start() if self.stats is not None else 0
+		diffImage = image1 ^ image2
+		diffImage &= careMask.get_image()
+		if self.stats is not None:
+			self.stats.record('FrameOperations.compare', startTime, frames=careMask.numFrames, words=diffImage.size)
+		return self.find_upsets(diffImage)
+
+	def diff_digests(self, includeBram, mskFradStructure=None):
+		"""
+		Report all bit differences between two FradStructure or FrameStore objects, word-comparing only the frames whose
+		digests differ. The digests of a FrameStore are computed once when it is built, so a golden FrameStore compared
+		with many readbacks skips the matching frames in bulk. Returns the same upsets as diff_array.
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored
+		:return: N x 3 array of (frad, word, bit) upset coordinates ordered by frame, word, then bit
+		"""
+		limit = self.fradStructure1.numFrads if (includeBram) else self.fradStructure1.numLogicFrames
+		digests1 = self.get_digests(self.fradStructure1, limit)
+		digests2 = self.get_digests(self.fradStructure2, limit)
+		startTime = self.stats.start() if self.stats is not None else 0
+		changed = numpy.flatnonzero(digests1 != digests2)
+		diffImage = self.fradStructure1.get_frames_by_index(changed) ^ self.fradStructure2.get_frames_by_index(changed)
+		if mskFradStructure is not None:
+			diffImage &= ~mskFradStructure.get_frames_by_index(changed)
+		if self.stats is not None:
+			self.stats.record('FrameOperations.compare', startTime, frames=len(changed), words=diffImage.size)
+		return self.find_upsets(diffImage, changed)
+
+	def get_digests(self, fradStructure, numFrames):
+		"""
+		Helper function which returns the digests of the first numFrames frames of a FradStructure or FrameStore.
+		The digests of a FradStructure are computed from its frame data on every call.
+		:param fradStructure: FradStructure or FrameStore object
+		:param numFrames: Number of frames, counting frames in the order visited by step_forward
+		:return: Array of uint64 digests, one per frame
+		"""
+		if isinstance(fradStructure, FrameStore):
+			return fradStructure.get_digests(numFrames)
+		image = self.get_image(fradStructure, numFrames)
+		startTime = self.stats.start() if self.stats is not None else 0
+		digests = digest_frames(image)
+		if self.stats is not None:
+			self.stats.record('FrameOperations.digest', startTime, frames=numFrames, words=image.size)
+		return digests
+
+	def find_upsets(self, diffImage, frameIndices=None):
+		"""
+		Helper function which turns an image of XORed frames into upset coordinates
+		:param diffImage: 2D array (numFrames x wordsPerFrame) with a 1 at every bit that differs
+		:param frameIndices: Optional array of the frame index of every row of diffImage (defaults to row i = frame i)
+		:return: N x 3 array of (frad, word, bit) upset coordinates ordered by frame, word, then bit
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		rows, wordIndices = numpy.nonzero(diffImage)
+		upsetWords, bits = self.find_set_bits(diffImage[rows, wordIndices])
+		frameIndices = rows if frameIndices is None else numpy.asarray(frameIndices)[rows]
+
+		upsets = numpy.empty((len(bits), 3), dtype=numpy.uint32)
+		upsets[:, 0] = self.fradStructure1.device.frads[frameIndices[upsetWords]]
+		upsets[:, 1] = wordIndices[upsetWords]
+		upsets[:, 2] = bits
+		if self.stats is not None:
+			self.stats.record('FrameOperations.find_upsets', startTime, words=len(rows), upsets=len(upsets))
+		return upsets
+
+	def find_set_bits(self, words):
+		"""
+		Helper function which finds every set bit in an array of 32 bit words at once
+		:param words: Array of 32 bit words
+		:return: (wordIndices, bits) arrays with one entry per set bit, ordered by word then bit
+		"""
+		# Unpack the bytes of every word least significant byte first and reorder each byte's bits from bit 0 up
+		wordBytes = numpy.asarray(words, dtype='<u4').view(numpy.uint8).reshape(-1, 4)
+		wordBits = numpy.unpackbits(wordBytes, axis=1)[:, self.BIT_COLUMNS]
+		return numpy.nonzero(wordBits)
 
-			self.fradStructure1.step_forward()
-			self.fradStructure2.step_forward()
+	def get_image(self, fradStructure, numFrames):
+		"""
+		Helper function which returns the first numFrames frames of a FradStructure as a 2D array
+		:param fradStructure: FradStructure object
+		:param numFrames: Number of frames, counting frames in the order visited by step_forward
+		:return: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		image = fradStructure.get_frame_range(0, numFrames)
+		if self.stats is not None:
+			self.stats.record('FrameOperations.get_image', startTime, frames=numFrames, words=image.size)
+		return image
 
+	def to_tuples(self, upsets):
+		"""
+		Helper function which turns an upset array into a list of (frad, word, bit) tuples
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates
+		:return: Array containing (frad, word, bit) upset tuples
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		upsetList = [tuple(upset) for upset in upsets.tolist()]
+		if self.stats is not None:
+			self.stats.record('FrameOperations.to_tuples', startTime, upsets=len(upsetList))
 		return upsetList
 
 	def diff_ignore_masked(self, includeBram, mskFradStructure):
 		"""
 		This function finds upsets between two fradStructures and ignores upsets in masked bits.
 		:param mskFradStructure: FradStructure object containing mask information
+		:return: Array containing (frad, word, bit) upset tuples
 		"""
-		self.fradStructure1.set_current_frad(0)
-		self.fradStructure2.set_current_frad(0)
-		mskFradStructure.set_current_frad(0)
-
-		upsetList = []
-
-		limit = self.fradStructure1.numFrads if (includeBram) else self.fradStructure1.numLogicFrames
-
-		for i in range(limit):
-			frame1 = self.fradStructure1.get_current_frame_data()
-			frame2 = self.fradStructure2.get_current_frame_data()
-			frame3 = mskFradStructure.get_current_frame_data()
-
-			diffList = self.compare_frame(frame1, frame2)
-
-			for pair in diffList:
-				if not ((frame3[pair[0]]) & (1 << pair[1])):
-					upsetList.append((self.fradStructure1.get_current_frad(), pair[0], pair[1]))
-
-			if len(diffList) > 0:
-				self.fradStructure1.print_current_frame()
-				self.fradStructure2.print_current_frame()
-
-			self.fradStructure1.step_forward()
-			self.fradStructure2.step_forward()
-			mskFradStructure.step_forward()
-
-		return upsetList
+		return self.to_tuples(self.diff_array(includeBram, mskFradStructure))
 
 	def find_essential_upsets(self, ebdFradStructure):
 		"""
@@ -92,29 +184,16 @@ class FrameOperations:
 		:param ebdFradStructure: FradStructure object containing essential bit information
 		:return: Array containing (frad, word, bit) upset tuples
 		"""
-		self.fradStructure1.set_current_frad(0)
-		self.fradStructure2.set_current_frad(0)
-		ebdFradStructure.set_current_frad(0)
-
-		upsetList = []
-
-		for i in range(self.fradStructure1.numLogicFrames):
-			frame1 = self.fradStructure1.get_current_frame_data()
-			frame2 = self.fradStructure2.get_current_frame_data()
-			frame3 = ebdFradStructure.get_current_frame_data()
-
-			diffList = self.compare_frame(frame1, frame2)
-
-			for pair in diffList:
-				if (frame3[pair[0]]) & (1 << pair[1]):
-					upsetList.append((self.fradStructure1.get_current_frad(), pair[0], pair[1]))
-
-			self.fradStructure1.step_forward()
-			self.fradStructure2.step_forward()
-			ebdFradStructure.step_forward()
-
-		return upsetList
-
+		limit = self.fradStructure1.numLogicFrames
+		image1 = self.get_image(self.fradStructure1, limit)
+		image2 = self.get_image(self.fradStructure2, limit)
+		ebdImage = self.get_image(ebdFradStructure, limit)
+		startTime = self.stats.start() if self.stats is not None else 0
+		diffImage = image1 ^ image2
+		diffImage &= ebdImage
+		if self.stats is not None:
+			self.stats.record('FrameOperations.compare', startTime, frames=limit, words=diffImage.size)
+		return self.to_tuples(self.find_upsets(diffImage))
 
 	def compare_frame(self, frame1, frame2):
 		"""
@@ -124,14 +203,6 @@ class FrameOperations:
 		:param frame2: Array of words in frame2
 		:return: Array of (word, bit) tuples where differences are found
 		"""
-		return_list = []
-		for i in range(len(frame1)):
-			# print "i: " + str(i)
-			if frame1[i] != frame2[i]:
-				# print str(hex(frame1[i])) + ", " + str(hex(frame2[i]))
-				for j in range(32):
-					msk = 1 << j
-					if(frame1[i] & msk) != (frame2[i] & msk):
-						return_list.append((i,j))
-
-		return return_list
+		diffWords = numpy.asarray(frame1, dtype=numpy.uint32) ^ numpy.asarray(frame2, dtype=numpy.uint32)
+		wordIndices, bits = self.find_set_bits(diffWords)
+		return zip(wordIndices.tolist(), bits.tolist())
@@ -0,0 +1,204 @@
+__author__ = 'Peter Zabriskie'
+import os
+import numpy
+from FradStructure import FradStructure, out_of_bounds
+from BinParser import BinParser
+from AsciiParser import AsciiParser
+
+# Constants of the frame digest: a 64 bit mix of every (word index, word) pair, summed over the frame
+DIGEST_MULTIPLIER_1 = numpy.uint64(0xBF58476D1CE4E5B9)
+DIGEST_MULTIPLIER_2 = numpy.uint64(0x94D049BB133111EB)
+DIGEST_SHIFT_1 = numpy.uint64(30)
+DIGEST_SHIFT_2 = numpy.uint64(27)
+DIGEST_SHIFT_3 = numpy.uint64(31)
+DIGEST_BLOCK_FRAMES = 4096
+
+def digest_frames(frames, blockFrames=DIGEST_BLOCK_FRAMES):
+	"""
+	Computes a 64 bit digest of every frame at once. Every word is mixed with its index in the frame, so equal
+	digests mean equal frames except for a chance collision (about 2^-64 per pair of frames).
+	:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words
+	:param blockFrames: Number of frames mixed at a time, which bounds the temporary 64 bit arrays
+	:return: Array of uint64 digests, one per frame
+	"""
+	frames = numpy.asarray(frames, dtype=numpy.uint32)
+	digests = numpy.zeros(len(frames), dtype=numpy.uint64)
+	if len(frames) == 0:
+		return digests
+	positions = numpy.arange(frames.shape[1], dtype=numpy.uint64) << numpy.uint64(32)
+	for start in xrange(0, len(frames), blockFrames):
+		keys = frames[start:start + blockFrames].astype(numpy.uint64)
+		keys |= positions
+		keys ^= keys >> DIGEST_SHIFT_1
+		keys *= DIGEST_MULTIPLIER_1
+		keys ^= keys >> DIGEST_SHIFT_2
+		keys *= DIGEST_MULTIPLIER_2
+		keys ^= keys >> DIGEST_SHIFT_3
+		digests[start:start + blockFrames] = keys.sum(axis=1, dtype=numpy.uint64)
+	return digests
+
+class FrameStore:
+	"""
+	This class holds the frame data of a FradStructure with every distinct frame stored once, and a 64 bit
+	digest of every frame. Most frames of a configuration image are identical (mostly all zero), so a design
+	or readback takes a fraction of the memory of a full image. Frames are read with the same functions as a
+	contiguous FradStructure (get_frame_range, get_frames_by_index, get_frame_data), so a FrameStore can be
+	compared with FrameOperations or written with BitstreamWriter, but it cannot be changed.
+	FrameOperations.diff_digests uses the digests to word-compare only the frames that differ.
+	"""
+
+	def __init__(self, fradStructure, includeBram=1, stats=None):
+		"""
+		Construct a new FrameStore object from the frame data of a FradStructure
+		:param fradStructure: FradStructure object holding frame data
+		:param includeBram: 1 to keep every frame, 0 to keep logic frames only
+		:param stats: Optional StageStats object which records the time and counters of digesting and deduplicating
+		:return: returns nothing
+		"""
+		self.FRAD_OUT_OF_BOUNDS = -1
+		self.series = fradStructure.series
+		self.wordsPerFrame = fradStructure.wordsPerFrame
+		self.device = fradStructure.device
+		self.fradArray = fradStructure.fradArray
+		self.fradIndex = fradStructure.fradIndex
+		self.streamIndex = fradStructure.streamIndex
+		self.framePosition = fradStructure.framePosition
+		self.numFrads = fradStructure.numFrads
+		self.numLogicFrames = fradStructure.numLogicFrames
+		self.numBramFrames = fradStructure.numBramFrames
+		self.contiguous = 1
+		self.stats = stats
+		self.numFrames = self.numFrads if (includeBram) else self.numLogicFrames
+
+		frames = fradStructure.get_frame_range(0, self.numFrames)
+		startTime = self.stats.start() if self.stats is not None else 0
+		self.digests = digest_frames(frames)
+		if self.stats is not None:
+			self.stats.record('FrameStore.digest', startTime, frames=self.numFrames, words=frames.size)
+			startTime = self.stats.start()
+		self.frameMap, self.uniqueFrames = self.deduplicate(frames, self.digests)
+		if self.stats is not None:
+			self.stats.record('FrameStore.deduplicate', startTime, frames=len(self.uniqueFrames), words=self.uniqueFrames.size)
+
+	@staticmethod
+	def load(path, fradFile, series, includeBram=1, stats=None):
+		"""
+		Parses a configuration or readback file straight into a FrameStore. The file type is chosen by extension
+		(.bit, .bin, .rbb, .data are parsed by BinParser; .rbt, .rba, .rbd by AsciiParser). The frame data is parsed into a temporary contiguous FradStructure which is
+		discarded once the distinct frames are found.
+		:param path: Path to the file to be parsed
+		:param fradFile: Path to file containing list of frame addresses
+		:param series: The series of the device
+		:param includeBram: 1 to keep every frame, 0 to keep logic frames only
+		:param stats: Optional StageStats object passed to the parser, FradStructure, and FrameStore
+		:return: FrameStore object
+		"""
+		parsers = {
+			'.bit': (BinParser, 'parse_bit_file'),
+			'.bin': (BinParser, 'parse_bin_file'),
+			'.rbb': (BinParser, 'parse_rbb_file'),
+			'.data': (BinParser, 'parse_data_file'),
+			'.rbt': (AsciiParser, 'parse_rbt_file'),
+			'.rba': (AsciiParser, 'parse_rba_file'),
+			'.rbd': (AsciiParser, 'parse_rbd_file'),
+		}
+		extension = os.path.splitext(path)[1].lower()
+		if extension not in parsers:
+			raise ValueError("Unsupported file type " + extension + " in FrameStore:load()")
+		parserClass, parseMethod = parsers[extension]
+		fradStructure = FradStructure(series, 1, stats)
+		fradStructure.load_frads(fradFile)
+		if parseMethod == 'parse_rbb_file':
+			parserClass(stats=stats).parse_rbb_file(path, fradStructure, includeBram)
+		else:
+			getattr(parserClass(stats=stats), parseMethod)(path, fradStructure)
+		return FrameStore(fradStructure, includeBram, stats)
+
+	def deduplicate(self, frames, digests):
+		"""
+		Helper function which stores every distinct frame once. Frames are grouped by digest and checked word by word
+		against the first frame of their group, so a digest collision keeps its own copy instead of merging frames.
+		:param frames: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		:param digests: Array of the digests of the frames
+		:return: (frameMap, uniqueFrames). Frame i holds the data of row frameMap[i] of the uniqueFrames array
+		"""
+		uniqueDigests, firstIndices, frameMap = numpy.unique(digests, return_index=True, return_inverse=True)
+		frameMap = frameMap.astype(numpy.int32)
+		uniqueFrames = frames[firstIndices]
+		collisions = []
+		for start in xrange(0, len(frames), DIGEST_BLOCK_FRAMES):
+			stop = start + DIGEST_BLOCK_FRAMES
+			different = (uniqueFrames[frameMap[start:stop]] != frames[start:stop]).any(axis=1)
+			collisions.extend((numpy.flatnonzero(different) + start).tolist())
+		if len(collisions) > 0:
+			frameMap[collisions] = len(uniqueFrames) + numpy.arange(len(collisions), dtype=numpy.int32)
+			uniqueFrames = numpy.concatenate((uniqueFrames, frames[collisions]))
+		return frameMap, uniqueFrames
+
+	def get_digests(self, numFrames=None):
+		"""
+		:param numFrames: Number of frames, counting frames in the order visited by step_forward (defaults to every stored frame)
+		:return: Array of the uint64 digests of the first numFrames frames
+		"""
+		if numFrames is None:
+			numFrames = self.numFrames
+		if numFrames > self.numFrames:
+			raise ValueError("Only %d frames are stored in FrameStore:get_digests()" % self.numFrames)
+		return self.digests[:numFrames]
+
+	def get_frame_range(self, start, stop):
+		"""
+		This function returns a copy of the data of frames start to stop - 1, counting frames in the order visited by step_forward.
+		:param start: Index of the first frame
+		:param stop: Index one past the last frame
+		:return: 2D array ((stop - start) x wordsPerFrame) of 32 bit words
+		"""
+		if stop > self.numFrames:
+			raise ValueError("Only %d frames are stored in FrameStore:get_frame_range()" % self.numFrames)
+		return self.uniqueFrames[self.frameMap[start:stop]]
+
+	def get_frames_by_index(self, frameIndices):
+		"""
+		This function copies the data of the given frames into a 2D array.
+		:param frameIndices: Array of frame indices
+		:return: 2D array (len(frameIndices) x wordsPerFrame) of 32 bit words
+		"""
+		return self.uniqueFrames[self.frameMap[frameIndices]]
+
+	def get_frame_data(self, frad, strict=0):
+		"""
+		This function returns an array of all the words at the specified frame address.
+		The array is shared by every frame with the same data, so it must not be changed.
+		:param frad: Frame address where desired data is located
+		:param strict: 1 to raise a ValueError if the frame address is out of bounds instead of printing a message
+		:return: An array of all the words at the specified address, FRAD_OUT_OF_BOUNDS (-1) if the frame address is out of bounds
+		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		if frameIndex == self.FRAD_OUT_OF_BOUNDS or frameIndex >= self.numFrames:
+			return out_of_bounds("FRAD 0x%X out of bounds in FrameStore:get_frame_data()" % frad, self.FRAD_OUT_OF_BOUNDS, strict)
+		return self.uniqueFrames[self.frameMap[frameIndex]]
+
+	def get_num_unique_frames(self):
+		"""
+		:return: Number of distinct frames stored
+		"""
+		return len(self.uniqueFrames)
+
+	def get_num_bytes(self):
+		"""
+		:return: Number of bytes of the stored frames, frame map, and digests
+		"""
+		return self.uniqueFrames.nbytes + self.frameMap.nbytes + self.digests.nbytes
+
+	def to_frad_structure(self, contiguous=1):
+		"""
+		Expands the stored frames into a new FradStructure
+		:param contiguous: 1 to store the frame data in one contiguous array
+		:return: FradStructure object holding a copy of every stored frame
+		"""
+		fradStructure = FradStructure(self.series, contiguous)
+		fradStructure.load_frads(self.device.fradFile)
+		for start in xrange(0, self.numFrames, DIGEST_BLOCK_FRAMES):
+			stop = min(start + DIGEST_BLOCK_FRAMES, self.numFrames)
+			fradStructure.append_frames(self.get_frame_range(start, stop), start)
+		return fradStructure
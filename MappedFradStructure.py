@@ -0,0 +1,234 @@
+__author__ = 'Peter Zabriskie'
+import mmap
+import os
+import numpy
+from FradStructure import FradStructure, out_of_bounds
+from BinParser import BinParser
+
+class MappedFradStructure(FradStructure):
+	"""
+	This class is a FradStructure whose frame data stays in a bitstream or readback file until it is read.
+	Mapping a file only locates the data of every frame (packet headers are read, frame data is not), so it takes
+	about as long as load_frads. Frames are read through a memory map of the file by the usual functions
+	(get_frame_data, get_frames, get_frame_range, ...), so memory grows with the frames actually read.
+	The frame data cannot be changed.
+	"""
+
+	def __init__(self, series, stats=None):
+		"""
+		Construct a new MappedFradStructure object. Call load_frads() and then map_file() before reading frames.
+		:param series: The series of the device
+		:param stats: Optional StageStats object which records the time and counters of load_frads and map_file
+		:return: returns nothing
+		"""
+		FradStructure.__init__(self, series, 0, stats)
+		self.mappedFile = None
+		self.mappedData = None
+		self.frameOffsets = None
+		self.wordType = '>u4'
+
+	def map_file(self, path):
+		"""
+		Maps a configuration or readback file. The file type is chosen by extension: packets of .bit, .bin, .msk,
+		and .rbb files are indexed like BinParser.decode_packets, and .data (JCM readback) files like BinParser.parse_data_file.
+		:param path: Path to the file to be mapped
+		:return: returns nothing
+		"""
+		extension = os.path.splitext(path)[1].lower()
+		if extension == '.data':
+			self.map_raw_file(path, 0, 0, 1, 1)
+		elif extension in ('.bit', '.bin', '.msk', '.rbb'):
+			self.open_map(path, '>u4')
+			startTime = self.stats.start() if self.stats is not None else 0
+			self.frameOffsets = BinParser().index_packets(self.mappedFile, self)
+			if self.stats is not None:
+				self.stats.record('MappedFradStructure.index', startTime, frames=(self.frameOffsets >= 0).sum())
+		else:
+			raise ValueError("Unsupported file type " + extension + " in MappedFradStructure:map_file()")
+
+	def map_raw_file(self, path, includeBram, padFrame, dummyFrames, swapEndian, offset=0):
+		"""
+		Maps a file of raw configuration data with the same pad frame and dummy frame rules as BinParser.extract_frame_data
+		:param path: Path to the file to be mapped
+		:param includeBram: 1 if the file holds every frame, 0 if it stops after the logic frames
+		:param padFrame: 1 if a pad frame precedes the first frame
+		:param dummyFrames: 1 if 2 dummy frames are inserted when type, row, or topBottom boundaries are crossed
+		:param swapEndian: 1 if words are stored Little Endian (JCM .data files)
+		:param offset: Byte offset of the configuration data in the file
+		:return: returns nothing
+		"""
+		self.open_map(path, '<u4' if swapEndian else '>u4')
+		numFrames = self.numFrads if (includeBram) else self.numLogicFrames
+		layout = self.device.get_stream_layout(padFrame, dummyFrames)[:numFrames]
+		if numFrames > 0 and offset + 4 * (int(layout[-1]) + self.wordsPerFrame) > len(self.mappedFile):
+			raise IOError("Unexpected end of configuration data in MappedFradStructure:map_raw_file()")
+		self.frameOffsets = numpy.zeros(self.numFrads, dtype=numpy.int64) - 1
+		self.frameOffsets[:numFrames] = offset + 4 * layout
+
+	def open_map(self, path, wordType):
+		"""
+		Helper function which memory maps a file for reading, closing any file mapped before
+		:param path: Path to the file
+		:param wordType: numpy type of the words of the file ('>u4' or '<u4')
+		:return: returns nothing
+		"""
+		self.close()
+		f = open(path, "rb")
+		try:
+			self.mappedFile = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+		self.mappedData = numpy.frombuffer(self.mappedFile, dtype=numpy.uint8)
+		self.wordType = wordType
+
+	def close(self):
+		"""
+		Unmaps the file. Frames cannot be read afterwards until another file is mapped.
+		:return: returns nothing
+		"""
+		if self.mappedFile is not None:
+			self.mappedData = None
+			self.mappedFile.close()
+			self.mappedFile = None
+			self.frameOffsets = None
+
+	def is_mapped(self, frad):
+		"""
+		:param frad: Frame address
+		:return: True if the mapped file holds data of the frame
+		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		return frameIndex != self.FRAD_OUT_OF_BOUNDS and self.frameOffsets[frameIndex] >= 0
+
+	def get_frames_by_index(self, frameIndices):
+		"""
+		This function reads the data of the given frames from the mapped file into a 2D array.
+		Frames not in the file are all zero.
+		:param frameIndices: Array of frame indices
+		:return: 2D array (len(frameIndices) x wordsPerFrame) of 32 bit words
+		"""
+		if self.frameOffsets is None:
+			raise IOError("No file mapped in MappedFradStructure:get_frames_by_index()")
+		offsets = self.frameOffsets[numpy.asarray(frameIndices, dtype=numpy.int64)]
+		frames = numpy.zeros((len(offsets), self.wordsPerFrame), dtype=numpy.uint32)
+		mapped = offsets >= 0
+		if mapped.any():
+			byteIndices = offsets[mapped][:, None] + numpy.arange(4 * self.wordsPerFrame)
+			frames[mapped] = self.mappedData[byteIndices].view(self.wordType)
+		return frames
+
+	def get_frame_range(self, start, stop):
+		"""
+		This function reads the data of frames start to stop - 1, counting frames in the order visited by step_forward.
+		:param start: Index of the first frame
+		:param stop: Index one past the last frame
+		:return: 2D array ((stop - start) x wordsPerFrame) of 32 bit words
+		"""
+		return self.get_frames_by_index(numpy.arange(start, stop))
+
+	def get_frame_data(self, frad, strict=0):
+		"""
+		This function reads an array of all the words at the specified frame address.
+		:param frad: Frame address where desired data is located
+		:param strict: 1 to raise a ValueError if the frame address is out of bounds instead of printing a message
+		:return: An array of all the words at the specified address, FRAD_OUT_OF_BOUNDS (-1) if the frame address is out of bounds
+		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		if frameIndex == self.FRAD_OUT_OF_BOUNDS:
+			return out_of_bounds("FRAD 0x%X out of bounds in MappedFradStructure:get_frame_data()" % frad, self.FRAD_OUT_OF_BOUNDS, strict)
+		return self.get_frames_by_index([frameIndex])[0]
+
+	def get_current_frame_data(self):
+		"""
+		This function reads an array of all the words at the current frame address.
+		:return: An array of all the words at the current address
+		"""
+		return self.get_frame_data(self.get_current_frad())
+
+	def get_word_from_frad(self, frad, wordNum, strict=0):
+		"""
+		This function reads the specified word from the specified frame.
+		:param frad: Frame address where desired word is located
+		:param wordNum: Index of desired word
+		:param strict: 1 to raise a ValueError if the frame address or wordNum is out of bounds instead of printing a message
+		:return: Returns value of word at specified location, FRAD_OUT_OF_BOUNDS (-1) or WORD_OUT_OF_BOUNDS (-2)
+		if the frame address or wordNum is out of bounds
+		"""
+		frameIndex = self.fradIndex.get(frad, self.FRAD_OUT_OF_BOUNDS)
+		if frameIndex == self.FRAD_OUT_OF_BOUNDS:
+			return out_of_bounds("FRAD 0x%X out of bounds in MappedFradStructure:get_word_from_frad()" % frad, self.FRAD_OUT_OF_BOUNDS, strict)
+		if wordNum < 0 or wordNum >= self.wordsPerFrame:
+			return out_of_bounds("wordNum out of bounds in MappedFradStructure:get_word_from_frad()", self.WORD_OUT_OF_BOUNDS, strict)
+		return int(self.get_frames_by_index([frameIndex])[0, wordNum])
+
+	def get_word_from_current_frad(self, wordNum, strict=0):
+		"""
+		This function reads the specified word from the current frame.
+		:param wordNum: Index of desired word
+		:param strict: 1 to raise a ValueError if wordNum is out of bounds instead of printing a message
+		:return: Returns value of word at specified location, WORD_OUT_OF_BOUNDS (-2) if wordNum is out of bounds
+		"""
+		return self.get_word_from_frad(self.get_current_frad(), wordNum, strict)
+
+	def get_words(self, frads, wordNums, strict=0):
+		"""
+		This function reads one word from each of many frames in one call.
+		:param frads: Array of frame addresses
+		:param wordNums: Array of word indices, one per frame address
+		:param strict: 1 to raise a ValueError if any frame address or word index is out of bounds
+		:return: (words, valid) where words is an array of 32 bit words and valid is a boolean array
+		that is False where the frame address or word index is out of bounds (those words are zero)
+		"""
+		frameIndices = self.get_frame_indices(frads)
+		wordNums = numpy.asarray(wordNums, dtype=numpy.int64).ravel()
+		valid = (frameIndices != self.FRAD_OUT_OF_BOUNDS) & (wordNums >= 0) & (wordNums < self.wordsPerFrame)
+		if strict and not valid.all():
+			raise ValueError("FRAD or wordNum out of bounds in MappedFradStructure:get_words()")
+		words = numpy.zeros(len(frameIndices), dtype=numpy.uint32)
+		offsets = self.frameOffsets[frameIndices[valid]]
+		mapped = offsets >= 0
+		byteIndices = (offsets[mapped] + 4 * wordNums[valid][mapped])[:, None] + numpy.arange(4)
+		validWords = numpy.zeros(len(offsets), dtype=numpy.uint32)
+		validWords[mapped] = self.mappedData[byteIndices].view(self.wordType).ravel()
+		words[valid] = validWords
+		return words, valid
+
+	def iter_frames(self, start=0, stop=None):
+		"""
+		Generator which visits frames in the same order as step_forward without changing the current frame address.
+		:param start: Index of the first frame
+		:param stop: Index one past the last frame (defaults to numFrads)
+		:return: Yields (frad, frame data) pairs
+		"""
+		if stop is None:
+			stop = self.numFrads
+		for frameIndex in xrange(start, stop):
+			yield int(self.device.frads[frameIndex]), self.get_frames_by_index([frameIndex])[0]
+
+	def print_current_frame(self):
+		"""
+		Helper function which prints out the current frame address followed by all the words in the frame.
+		:return: returns nothing
+		"""
+		print "Frame: " + hex(self.get_current_frad())
+		print "Words:"
+		for wordCount, word in enumerate(self.get_current_frame_data().tolist()):
+			print str(wordCount) + ": " + hex(word)
+
+	def append_word(self, word):
+		"""
+		Frame data of a MappedFradStructure cannot be changed
+		"""
+		raise ValueError("Frame data is read only in MappedFradStructure:append_word()")
+
+	def append_frames(self, frames, startIndex=0):
+		"""
+		Frame data of a MappedFradStructure cannot be changed
+		"""
+		raise ValueError("Frame data is read only in MappedFradStructure:append_frames()")
+
+	def set_frames(self, frameIndices, frames):
+		"""
+		Frame data of a MappedFradStructure cannot be changed
+		"""
+		raise ValueError("Frame data is read only in MappedFradStructure:set_frames()")
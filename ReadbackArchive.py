@@ -0,0 +1,322 @@
+__author__ = 'Peter Zabriskie'
+import os
+import struct
+import time
+import zlib
+import numpy
+from FradStructure import FradStructure
+
+class ReadbackArchive:
+	"""
+	This class stores a time series of readbacks of one design in a single append-only file.
+	The file starts with a reference image (e.g. the golden configuration or the first readback). Every readback
+	appended afterwards stores only the frames that differ from the reference, in zlib compressed chunks of at most
+	chunkFrames frames. Each chunk lists its frame indices uncompressed, so the index of the whole archive is built
+	by reading record headers only, and a frame of any readback is read by decompressing the one chunk holding it.
+
+	File layout (big endian):
+		header: magic, version, series, wordsPerFrame, numFrames
+		records: magic 'RC', record type, readback id, number of frames, payload length, then the payload
+			REFERENCE_CHUNK / FRAME_CHUNK payload: frame indices (int32), zlib compressed frames (uint32)
+			READBACK_END payload: timestamp (double), number of frames stored, name
+	A readback becomes visible to readers once its READBACK_END record is complete, so one process can append
+	readbacks while others read the archive (call refresh() to see new readbacks). Only one writer is supported.
+	"""
+
+	def __init__(self, path, fradFile, series, writable=0, reference=None, includeBram=1, chunkFrames=256, level=6):
+		"""
+		Opens an existing archive, or creates a new one if a reference is given
+		:param path: Path to the archive file
+		:param fradFile: Path to file containing list of frame addresses
+		:param series: The series of the device
+		:param writable: 1 to append readbacks. Anything after the last complete readback (left by a writer that stopped
+		in the middle of one) is cut off first, so readers open at that time have to be reopened
+		:param reference: Optional FradStructure object holding the reference image of a new archive. The archive is
+		written under a temporary name and then linked to path, so readers never see a partial reference. Raises IOError
+		if path already exists, so an archive is never replaced. Implies writable
+		:param includeBram: 1 to archive every frame, 0 to archive logic frames only (new archives only)
+		:param chunkFrames: Largest number of frames compressed together when appending
+		:param level: zlib compression level
+		:return: returns nothing
+		"""
+		self.MAGIC = 'FRADARCH'
+		self.VERSION = 1
+		self.HEADER_FORMAT = '>8sHHII'
+		self.RECORD_FORMAT = '>2sBxIII'
+		self.RECORD_MAGIC = 'RC'
+		self.END_FORMAT = '>dI'
+		self.REFERENCE_CHUNK = 1
+		self.FRAME_CHUNK = 2
+		self.READBACK_END = 3
+		self.headerSize = struct.calcsize(self.HEADER_FORMAT)
+		self.recordSize = struct.calcsize(self.RECORD_FORMAT)
+
+		self.path = path
+		self.chunkFrames = chunkFrames
+		self.level = level
+		self.fradStructure = FradStructure(series)
+		self.fradStructure.load_frads(fradFile)
+		self.device = self.fradStructure.device
+		self.wordsPerFrame = self.fradStructure.wordsPerFrame
+		if reference is not None:
+			self.write_reference(reference, includeBram)
+			writable = 1
+		self.writable = writable
+		self.f = open(path, 'r+b' if writable else 'rb')
+		magic, version, fileSeries, wordsPerFrame, self.numFrames = struct.unpack(self.HEADER_FORMAT, self.f.read(self.headerSize))
+		if magic != self.MAGIC or version != self.VERSION:
+			raise IOError("Not a readback archive in ReadbackArchive:__init__()")
+		if fileSeries != series or wordsPerFrame != self.wordsPerFrame or self.numFrames > self.device.numFrads:
+			raise ValueError("Archive does not match the device in ReadbackArchive:__init__()")
+
+		# Chunks: file offset and length of the compressed frames
+		self.chunkOffsets = []
+		self.chunkLengths = []
+		self.referenceChunks = numpy.zeros(self.numFrames, dtype=numpy.int32) - 1
+		self.referenceRows = numpy.zeros(self.numFrames, dtype=numpy.int32)
+		# Readbacks: (name, timestamp, frameIndices, chunks, rows) with frameIndices sorted
+		self.readbacks = []
+		self.pendingChunks = []
+		self.scanOffset = self.headerSize
+		self.committedOffset = self.headerSize
+		self.cachedChunk = (-1, None)
+		self.referenceImage = None
+		self.refresh()
+
+		if writable:
+			self.f.truncate(self.committedOffset)
+			self.scanOffset = self.committedOffset
+			self.pendingChunks = []
+
+	def write_reference(self, reference, includeBram):
+		"""
+		Helper function which writes a new archive holding only a reference image. An existing file is never replaced.
+		:param reference: FradStructure object holding the reference image
+		:param includeBram: 1 to archive every frame, 0 to archive logic frames only
+		:return: returns nothing
+		"""
+		if os.path.exists(self.path):
+			raise IOError("Archive " + self.path + " already exists in ReadbackArchive:write_reference()")
+		numFrames = reference.numFrads if (includeBram) else reference.numLogicFrames
+		tempFile = self.path + '.%d.tmp' % os.getpid()
+		try:
+			with open(tempFile, 'wb') as f:
+				f.write(struct.pack(self.HEADER_FORMAT, self.MAGIC, self.VERSION, reference.series, self.wordsPerFrame, numFrames))
+				for start in xrange(0, numFrames, self.chunkFrames):
+					stop = min(start + self.chunkFrames, numFrames)
+					f.write(self.chunk_record(self.REFERENCE_CHUNK, 0, numpy.arange(start, stop), reference.get_frame_range(start, stop)))
+			if hasattr(os, 'link'):
+				# Unlike rename, link fails if another process created the archive in the meantime
+				try:
+					os.link(tempFile, self.path)
+				except OSError:
+					raise IOError("Archive " + self.path + " already exists in ReadbackArchive:write_reference()")
+			else:
+				# Windows: rename fails if the archive exists
+				os.rename(tempFile, self.path)
+		finally:
+			if os.path.exists(tempFile):
+				os.remove(tempFile)
+
+	def chunk_record(self, recordType, readbackId, frameIndices, frames):
+		"""
+		Helper function which builds a record holding a chunk of frames
+		:param recordType: REFERENCE_CHUNK (1) or FRAME_CHUNK (2)
+		:param readbackId: Id of the readback the frames belong to
+		:param frameIndices: Array of the frame index of every frame
+		:param frames: 2D array (len(frameIndices) x wordsPerFrame) of 32 bit words
+		:return: String holding the record
+		"""
+		payload = numpy.asarray(frameIndices, dtype='>i4').tostring() + zlib.compress(numpy.asarray(frames, dtype='>u4').tostring(), self.level)
+		return struct.pack(self.RECORD_FORMAT, self.RECORD_MAGIC, recordType, readbackId, len(frameIndices), len(payload)) + payload
+
+	def refresh(self):
+		"""
+		Reads the index of the readbacks appended since the archive was opened or last refreshed
+		:return: Number of new readbacks
+		"""
+		self.f.seek(0, 2)
+		fileSize = self.f.tell()
+		numReadbacks = len(self.readbacks)
+		while self.scanOffset + self.recordSize <= fileSize:
+			self.f.seek(self.scanOffset)
+			magic, recordType, readbackId, numFrames, payloadLength = struct.unpack(self.RECORD_FORMAT, self.f.read(self.recordSize))
+			if magic != self.RECORD_MAGIC:
+				raise IOError("Corrupt record at offset %d in ReadbackArchive:refresh()" % self.scanOffset)
+			payloadOffset = self.scanOffset + self.recordSize
+			if payloadOffset + payloadLength > fileSize:
+				break
+
+			if recordType in (self.REFERENCE_CHUNK, self.FRAME_CHUNK):
+				frameIndices = numpy.frombuffer(self.f.read(4 * numFrames), dtype='>i4').astype(numpy.int32)
+				chunk = len(self.chunkOffsets)
+				self.chunkOffsets.append(payloadOffset + 4 * numFrames)
+				self.chunkLengths.append(payloadLength - 4 * numFrames)
+				if recordType == self.REFERENCE_CHUNK:
+					self.referenceChunks[frameIndices] = chunk
+					self.referenceRows[frameIndices] = numpy.arange(numFrames)
+					self.committedOffset = payloadOffset + payloadLength
+				elif readbackId == len(self.readbacks):
+					self.pendingChunks.append((frameIndices, chunk))
+			elif recordType == self.READBACK_END and readbackId == len(self.readbacks):
+				payload = self.f.read(payloadLength)
+				timestamp, numStored = struct.unpack_from(self.END_FORMAT, payload)
+				name = payload[struct.calcsize(self.END_FORMAT):]
+				self.commit_readback(name, timestamp)
+				self.committedOffset = payloadOffset + payloadLength
+			self.scanOffset = payloadOffset + payloadLength
+		return len(self.readbacks) - numReadbacks
+
+	def commit_readback(self, name, timestamp):
+		"""
+		Helper function which adds the chunks read since the last readback to the index as a new readback
+		:param name: Name of the readback
+		:param timestamp: Time the readback was archived (seconds since the epoch)
+		:return: returns nothing
+		"""
+		frameIndices = numpy.zeros(0, dtype=numpy.int32)
+		chunks = numpy.zeros(0, dtype=numpy.int32)
+		rows = numpy.zeros(0, dtype=numpy.int32)
+		if len(self.pendingChunks) > 0:
+			frameIndices = numpy.concatenate([indices for indices, chunk in self.pendingChunks])
+			chunks = numpy.concatenate([numpy.zeros(len(indices), dtype=numpy.int32) + chunk for indices, chunk in self.pendingChunks])
+			rows = numpy.concatenate([numpy.arange(len(indices), dtype=numpy.int32) for indices, chunk in self.pendingChunks])
+			order = numpy.argsort(frameIndices, kind='mergesort')
+			frameIndices, chunks, rows = frameIndices[order], chunks[order], rows[order]
+		self.readbacks.append((name, timestamp, frameIndices, chunks, rows))
+		self.pendingChunks = []
+
+	def append(self, fradStructure, name='', timestamp=None):
+		"""
+		Stores the frames of a readback that differ from the reference. Frames are compared chunkFrames at a time,
+		so a MappedFradStructure is archived without reading the whole readback into memory.
+		:param fradStructure: FradStructure (or MappedFradStructure, FrameStore) object holding the readback
+		:param name: Name stored with the readback (e.g. its file name)
+		:param timestamp: Time of the readback in seconds since the epoch (defaults to now)
+		:return: Id of the readback
+		"""
+		if not self.writable:
+			raise IOError("Archive is not open for appending in ReadbackArchive:append()")
+		reference = self.get_reference_image()
+		readbackId = len(self.readbacks)
+		records = []
+		numStored = 0
+		for start in xrange(0, self.numFrames, self.chunkFrames):
+			stop = min(start + self.chunkFrames, self.numFrames)
+			frames = fradStructure.get_frame_range(start, stop)
+			changed = numpy.flatnonzero((frames != reference[start:stop]).any(axis=1))
+			if len(changed) > 0:
+				records.append(self.chunk_record(self.FRAME_CHUNK, readbackId, changed + start, frames[changed]))
+				numStored += len(changed)
+		endPayload = struct.pack(self.END_FORMAT, time.time() if timestamp is None else timestamp, numStored) + name
+		records.append(struct.pack(self.RECORD_FORMAT, self.RECORD_MAGIC, self.READBACK_END, readbackId, 0, len(endPayload)) + endPayload)
+
+		self.f.seek(self.committedOffset)
+		self.f.write(''.join(records))
+		self.f.flush()
+		self.refresh()
+		return readbackId
+
+	def get_num_readbacks(self):
+		"""
+		:return: Number of readbacks in the archive, as of the last refresh
+		"""
+		return len(self.readbacks)
+
+	def get_readback_info(self, readbackId):
+		"""
+		:param readbackId: Id of a readback
+		:return: (name, timestamp, numStoredFrames) of the readback
+		"""
+		name, timestamp, frameIndices, chunks, rows = self.readbacks[readbackId]
+		return name, timestamp, len(frameIndices)
+
+	def get_changed_frads(self, readbackId):
+		"""
+		:param readbackId: Id of a readback
+		:return: Array of the frame addresses of the frames that differ from the reference
+		"""
+		return self.device.frads[self.readbacks[readbackId][2]]
+
+	def read_chunk(self, chunk):
+		"""
+		Helper function which decompresses one chunk. The last chunk read is kept.
+		:param chunk: Index of the chunk
+		:return: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		"""
+		if self.cachedChunk[0] != chunk:
+			self.f.seek(self.chunkOffsets[chunk])
+			data = zlib.decompress(self.f.read(self.chunkLengths[chunk]))
+			frames = numpy.frombuffer(data, dtype='>u4').astype(numpy.uint32).reshape(-1, self.wordsPerFrame)
+			self.cachedChunk = (chunk, frames)
+		return self.cachedChunk[1]
+
+	def get_reference_image(self):
+		"""
+		:return: 2D array (numFrames x wordsPerFrame) holding the reference image, decompressed once
+		"""
+		if self.referenceImage is None:
+			self.referenceImage = numpy.zeros((self.numFrames, self.wordsPerFrame), dtype=numpy.uint32)
+			for chunk in numpy.unique(self.referenceChunks).tolist():
+				frameIndices = numpy.flatnonzero(self.referenceChunks == chunk)
+				self.referenceImage[frameIndices] = self.read_chunk(chunk)[self.referenceRows[frameIndices]]
+		return self.referenceImage
+
+	def get_frames_by_index(self, readbackId, frameIndices):
+		"""
+		Reads frames of a readback, decompressing only the chunks that hold them
+		:param readbackId: Id of a readback, or None for the reference
+		:param frameIndices: Array of frame indices
+		:return: 2D array (len(frameIndices) x wordsPerFrame) of 32 bit words
+		"""
+		frameIndices = numpy.asarray(frameIndices, dtype=numpy.int64)
+		if len(frameIndices) > 0 and (frameIndices.min() < 0 or frameIndices.max() >= self.numFrames):
+			raise ValueError("Frame index out of bounds in ReadbackArchive:get_frames_by_index()")
+		chunks = self.referenceChunks[frameIndices]
+		rows = self.referenceRows[frameIndices]
+		if readbackId is not None:
+			name, timestamp, storedIndices, storedChunks, storedRows = self.readbacks[readbackId]
+			positions = numpy.minimum(numpy.searchsorted(storedIndices, frameIndices), max(len(storedIndices) - 1, 0))
+			stored = (storedIndices[positions] == frameIndices) if len(storedIndices) > 0 else numpy.zeros(len(frameIndices), dtype=bool)
+			chunks[stored] = storedChunks[positions[stored]]
+			rows[stored] = storedRows[positions[stored]]
+		frames = numpy.zeros((len(frameIndices), self.wordsPerFrame), dtype=numpy.uint32)
+		for chunk in numpy.unique(chunks).tolist():
+			inChunk = chunks == chunk
+			frames[inChunk] = self.read_chunk(chunk)[rows[inChunk]]
+		return frames
+
+	def get_frame(self, readbackId, frad):
+		"""
+		Reads one frame of a readback
+		:param readbackId: Id of a readback, or None for the reference
+		:param frad: Frame address
+		:return: Array of the words of the frame
+		"""
+		frameIndex = self.fradStructure.get_frame_index(frad)
+		if frameIndex == self.fradStructure.FRAD_OUT_OF_BOUNDS or frameIndex >= self.numFrames:
+			raise ValueError("FRAD 0x%X out of bounds in ReadbackArchive:get_frame()" % frad)
+		return self.get_frames_by_index(readbackId, [frameIndex])[0]
+
+	def get_readback(self, readbackId, contiguous=1):
+		"""
+		Rebuilds a whole readback
+		:param readbackId: Id of a readback, or None for the reference
+		:param contiguous: 1 to store the frame data in one contiguous array
+		:return: FradStructure object holding the readback
+		"""
+		fradStructure = FradStructure(self.fradStructure.series, contiguous)
+		fradStructure.load_frads(self.device.fradFile)
+		image = self.get_reference_image().copy()
+		if readbackId is not None:
+			frameIndices = self.readbacks[readbackId][2]
+			image[frameIndices] = self.get_frames_by_index(readbackId, frameIndices)
+		fradStructure.append_frames(image)
+		return fradStructure
+
+	def close(self):
+		"""
+		Closes the archive file
+		:return: returns nothing
+		"""
+		self.f.close()
@@ -0,0 +1,226 @@
+__author__ = 'Peter Zabriskie'
+import asyncore
+import socket
+import Queue
+import numpy
+from FradStructure import FradStructure
+from StreamingDiff import StreamingDiff
+
+class ReadbackConnection(asyncore.dispatcher):
+	"""
+	Helper class of ReadbackServer which compares the readback data arriving on one connection.
+	"""
+
+	def __init__(self, server, sock, peer):
+		"""
+		Construct a new ReadbackConnection object
+		:param server: ReadbackServer object that accepted the connection
+		:param sock: Connected socket
+		:param peer: Name of the connection reported with its results
+		:return: returns nothing
+		"""
+		asyncore.dispatcher.__init__(self, sock, map=server.socketMap)
+		self.server = server
+		self.peer = peer
+		self.streamingDiff = server.streamingDiff.copy()
+		self.readbackNumber = 0
+		self.start_readback()
+
+	def start_readback(self):
+		"""
+		Helper function which clears the upsets (and frames) of the readback being received
+		:return: returns nothing
+		"""
+		self.streamingDiff.reset()
+		self.upsets = []
+		self.readback = self.server.new_readback()
+
+	def readable(self):
+		"""
+		Stops reading while results wait to be consumed, so the sender is slowed down by TCP flow control
+		:return: True if data may be received
+		"""
+		return self.server.can_deliver()
+
+	def writable(self):
+		"""
+		:return: False, nothing is ever sent back
+		"""
+		return False
+
+	def handle_read(self):
+		"""
+		Compares the frames completed by the data received and reports every readback that is complete
+		:return: returns nothing
+		"""
+		data = self.recv(self.server.chunkSize)
+		while len(data) > 0:
+			needed = (self.streamingDiff.streamFrames - self.streamingDiff.streamFrame) * self.streamingDiff.frameBytes - \
+				len(self.streamingDiff.pending)
+			upsets = self.streamingDiff.feed(data[:needed], self.readback)
+			if len(upsets) > 0:
+				self.upsets.append(upsets)
+			data = data[needed:]
+			if self.streamingDiff.is_complete():
+				self.server.deliver((self.peer, self.readbackNumber, self.get_upsets(), self.readback, None))
+				self.readbackNumber += 1
+				self.start_readback()
+
+	def handle_close(self):
+		"""
+		Reports a readback cut short by the end of the connection and closes it
+		:return: returns nothing
+		"""
+		if self.streamingDiff.streamFrame > 0 or len(self.streamingDiff.pending) > 0:
+			error = "Connection closed after %d of %d frames" % (self.streamingDiff.get_num_frames_compared(), self.streamingDiff.numFrames)
+			self.server.deliver((self.peer, self.readbackNumber, self.get_upsets(), self.readback, error))
+		self.close()
+
+	def handle_error(self):
+		"""
+		Reports an unexpected error of the connection and closes it without stopping the other connections
+		:return: returns nothing
+		"""
+		error = asyncore.compact_traceback()
+		self.server.deliver((self.peer, self.readbackNumber, None, None, "%s: %s" % (error[1].__name__, error[2])))
+		self.close()
+
+	def get_upsets(self):
+		"""
+		:return: N x 3 array of (frad, word, bit) upset coordinates of the readback being received
+		"""
+		if len(self.upsets) == 0:
+			return numpy.zeros((0, 3), dtype=numpy.uint32)
+		return numpy.concatenate(self.upsets)
+
+class ReadbackServer(asyncore.dispatcher):
+	"""
+	This class receives raw readback data (as in a JCM .data file) from many boards at once over TCP or Unix sockets
+	and compares it against one golden FradStructure with StreamingDiff, in a single thread. Every connection holds
+	back to back readbacks of one board. The result of every readback is passed to a callback or put on a queue as
+	a (peer, readbackNumber, upsets, readback, error) tuple:
+		peer: address of the board's connection
+		readbackNumber: number of the readback on its connection, counting from 0
+		upsets: N x 3 array of (frad, word, bit) upset coordinates
+		readback: FradStructure object holding the frames received if keepFrames is set, else None
+		error: None, or a message if the connection ended in the middle of a readback or failed
+	While the queue is full no connection is read, so the boards are slowed down instead of results piling up.
+	"""
+
+	def __init__(self, address, goldenFradStructure, mskFradStructure=None, includeBram=0, padFrame=0, dummyFrames=1,
+		swapEndian=1, careMask=None, callback=None, resultQueue=None, keepFrames=0, chunkSize=65536, stats=None):
+		"""
+		Construct a new ReadbackServer object listening on an address. Call serve() to handle connections.
+		:param address: (host, port) tuple for TCP or a path string for a Unix socket. Port 0 picks a free port (see get_address)
+		:param goldenFradStructure: FradStructure or FrameStore object holding the golden configuration
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored
+		:param includeBram: 1 if every readback holds every frame, 0 if it stops after the logic frames
+		:param padFrame: 1 if a pad frame precedes the first frame of every readback
+		:param dummyFrames: 1 if 2 dummy frames are inserted when type, row, or topBottom boundaries are crossed
+		:param swapEndian: 1 if words are sent Little Endian (as in JCM .data files)
+		:param careMask: Optional CareMask object. Only cared about bits are compared and its frames replace includeBram
+		:param callback: Function called with every result tuple. Used instead of the queue if given
+		:param resultQueue: Queue.Queue object receiving every result tuple. A bounded queue applies backpressure.
+		A new queue holding up to 64 results is made if neither a callback nor a queue is given
+		:param keepFrames: 1 to store the frames of every readback in a new contiguous FradStructure
+		:param chunkSize: Largest number of bytes received from a connection at a time
+		:param stats: Optional StageStats object which records the time and counters of every chunk compared
+		:return: returns nothing
+		"""
+		self.socketMap = {}
+		asyncore.dispatcher.__init__(self, map=self.socketMap)
+		self.golden = goldenFradStructure
+		self.streamingDiff = StreamingDiff(goldenFradStructure, mskFradStructure, includeBram, padFrame, dummyFrames,
+			swapEndian, careMask, stats)
+		self.callback = callback
+		self.resultQueue = resultQueue
+		if callback is None and resultQueue is None:
+			self.resultQueue = Queue.Queue(64)
+		self.keepFrames = keepFrames
+		self.chunkSize = chunkSize
+		self.waitingResults = []
+
+		if isinstance(address, basestring):
+			self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		else:
+			self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.set_reuse_addr()
+		self.bind(address)
+		self.listen(64)
+
+	def get_address(self):
+		"""
+		:return: Address the server is listening on
+		"""
+		return self.socket.getsockname()
+
+	def get_connection_count(self):
+		"""
+		:return: Number of boards connected
+		"""
+		return len(self.socketMap) - 1
+
+	def handle_accept(self):
+		"""
+		Starts comparing the readback data of a new connection
+		:return: returns nothing
+		"""
+		accepted = self.accept()
+		if accepted is not None:
+			sock, peer = accepted
+			ReadbackConnection(self, sock, peer if peer else sock.getsockname())
+
+	def new_readback(self):
+		"""
+		Helper function which returns a FradStructure for the frames of a new readback
+		:return: Contiguous FradStructure object if keepFrames is set, else None
+		"""
+		if not self.keepFrames:
+			return None
+		readback = FradStructure(self.golden.series, 1)
+		readback.load_frads(self.golden.device.fradFile)
+		return readback
+
+	def deliver(self, result):
+		"""
+		Helper function which hands a result to the callback or queue. Results that do not fit in the queue wait
+		in the server and no connection is read until they are delivered.
+		:param result: (peer, readbackNumber, upsets, readback, error) tuple
+		:return: returns nothing
+		"""
+		if self.callback is not None:
+			self.callback(result)
+		else:
+			self.waitingResults.append(result)
+			self.can_deliver()
+
+	def can_deliver(self):
+		"""
+		Helper function which moves waiting results to the queue while it has room
+		:return: True if no result is waiting and the queue has room for more
+		"""
+		if self.callback is not None:
+			return True
+		while len(self.waitingResults) > 0:
+			try:
+				self.resultQueue.put_nowait(self.waitingResults[0])
+			except Queue.Full:
+				return False
+			self.waitingResults.pop(0)
+		return not self.resultQueue.full()
+
+	def serve(self, timeout=0.1, count=None):
+		"""
+		Handles connections until the server is closed, or for count passes of the event loop
+		:param timeout: Seconds to wait for activity in one pass. Also bounds how late reading resumes once the queue has room
+		:param count: Number of passes of the event loop, or None to run until closed
+		:return: returns nothing
+		"""
+		asyncore.loop(timeout, False, self.socketMap, count)
+
+	def close_all(self):
+		"""
+		Closes the server and every connection
+		:return: returns nothing
+		"""
+		asyncore.close_all(self.socketMap)
@@ -0,0 +1,188 @@
+__author__ = 'Peter Zabriskie'
+import os
+import numpy
+from FradStructure import FradStructure
+from BinParser import BinParser
+from AsciiParser import AsciiParser
+
+class SparseBitset:
+	"""
+	This class holds mask or essential bit data of a device without keeping a full image of its frames.
+	Only the words with at least one set bit are stored, as a sorted array of word ids (frameIndex * wordsPerFrame + word)
+	and an array of the matching 32 bit words. Bits are identified by a single integer, wordId * 32 + bit.
+	"""
+
+	def __init__(self, device, wordsPerFrame, wordIds=None, words=None):
+		"""
+		Construct a new SparseBitset object. Use SparseBitset.load() or SparseBitset.from_frad_structure() to build one from a file.
+		:param device: DeviceDatabase object of the device the bits belong to
+		:param wordsPerFrame: Number of 32 bit words in every frame
+		:param wordIds: Sorted array of the ids of the stored words
+		:param words: Array of the stored words, none of them zero
+		:return: returns nothing
+		"""
+		self.device = device
+		self.wordsPerFrame = wordsPerFrame
+		self.wordIds = numpy.zeros(0, dtype=numpy.int32) if wordIds is None else numpy.asarray(wordIds, dtype=numpy.int32)
+		self.words = numpy.zeros(0, dtype=numpy.uint32) if words is None else numpy.asarray(words, dtype=numpy.uint32)
+
+	@staticmethod
+	def load(path, fradFile, series, includeBram=0):
+		"""
+		Parses a mask or essential bit file and returns its set bits. The file type is chosen by extension
+		(.msk, .bit, .bin are parsed by BinParser; .msd, .ebd by AsciiParser). The frame data is parsed into a
+		temporary contiguous FradStructure which is discarded once the set bits are found.
+		:param path: Path to the file to be parsed
+		:param fradFile: Path to file containing list of frame addresses
+		:param series: The series of the device
+		:param includeBram: 1 to keep the bits of every frame, 0 to keep logic frames only
+		:return: SparseBitset object
+		"""
+		parsers = {
+			'.msk': (BinParser, 'parse_msk_file'),
+			'.bit': (BinParser, 'parse_bit_file'),
+			'.bin': (BinParser, 'parse_bin_file'),
+			'.msd': (AsciiParser, 'parse_msd_file'),
+			'.ebd': (AsciiParser, 'parse_ebd_file'),
+		}
+		extension = os.path.splitext(path)[1].lower()
+		if extension not in parsers:
+			raise ValueError("Unsupported file type " + extension + " in SparseBitset:load()")
+		parserClass, parseMethod = parsers[extension]
+		fradStructure = FradStructure(series, 1)
+		fradStructure.load_frads(fradFile)
+		getattr(parserClass(), parseMethod)(path, fradStructure)
+		return SparseBitset.from_frad_structure(fradStructure, includeBram)
+
+	@staticmethod
+	def from_frad_structure(fradStructure, includeBram=0):
+		"""
+		Returns the set bits of a FradStructure
+		:param fradStructure: FradStructure object holding mask or essential bit data
+		:param includeBram: 1 to keep the bits of every frame, 0 to keep logic frames only
+		:return: SparseBitset object
+		"""
+		numFrames = fradStructure.numFrads if (includeBram) else fradStructure.numLogicFrames
+		return SparseBitset.from_image(fradStructure.device, fradStructure.get_frame_range(0, numFrames))
+
+	@staticmethod
+	def from_image(device, image):
+		"""
+		Returns the set bits of an image of frames
+		:param device: DeviceDatabase object of the device the bits belong to
+		:param image: 2D array (numFrames x wordsPerFrame) of 32 bit words in frame index order
+		:return: SparseBitset object
+		"""
+		image = numpy.asarray(image, dtype=numpy.uint32)
+		words = image.ravel()
+		wordIds = numpy.flatnonzero(words)
+		return SparseBitset(device, image.shape[1], wordIds, words[wordIds])
+
+	def union(self, other):
+		"""
+		Returns the bits set in either bitset
+		:param other: SparseBitset object of the same device
+		:return: SparseBitset object
+		"""
+		wordIds, inverse = numpy.unique(numpy.concatenate((self.wordIds, other.wordIds)), return_inverse=True)
+		words = numpy.zeros(len(wordIds), dtype=numpy.uint32)
+		numpy.bitwise_or.at(words, inverse, numpy.concatenate((self.words, other.words)))
+		return SparseBitset(self.device, self.wordsPerFrame, wordIds, words)
+
+	def intersection(self, other):
+		"""
+		Returns the bits set in both bitsets
+		:param other: SparseBitset object of the same device
+		:return: SparseBitset object
+		"""
+		found, positions = self.find_words(other.wordIds)
+		words = self.words[positions[found]] & other.words[found]
+		wordIds = other.wordIds[found]
+		return SparseBitset(self.device, self.wordsPerFrame, wordIds[words != 0], words[words != 0])
+
+	def find_words(self, wordIds):
+		"""
+		Helper function which looks up many word ids in the stored words at once
+		:param wordIds: Array of word ids
+		:return: (found, positions) arrays. found is True where the word is stored at positions in self.words
+		"""
+		positions = numpy.searchsorted(self.wordIds, wordIds)
+		positions = numpy.minimum(positions, max(len(self.wordIds) - 1, 0))
+		if len(self.wordIds) == 0:
+			return numpy.zeros(len(positions), dtype=bool), positions
+		return self.wordIds[positions] == wordIds, positions
+
+	def contains(self, bitIds):
+		"""
+		Tests many bit ids for membership at once
+		:param bitIds: Array of bit ids
+		:return: Boolean array, True where the bit is set
+		"""
+		bitIds = numpy.asarray(bitIds, dtype=numpy.int64)
+		found, positions = self.find_words(bitIds >> 5)
+		if len(self.words) == 0:
+			return found
+		return found & ((self.words[positions] >> (bitIds & 31).astype(numpy.uint32)) & 1).astype(bool)
+
+	def is_set(self, frad, wordNum, bit):
+		"""
+		Tests a single bit for membership
+		:param frad: Frame address of the bit
+		:param wordNum: Word of the frame holding the bit
+		:param bit: Bit of the word
+		:return: 1 if the bit is set, 0 otherwise
+		"""
+		return int(self.contains_upsets(numpy.array([[frad, wordNum, bit]]))[0])
+
+	def contains_upsets(self, upsets):
+		"""
+		Tests upset coordinates (e.g. from FrameOperations.diff_array) for membership at once
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates
+		:return: Boolean array, True where the upset bit is set. Upsets in frames not on the device are never set
+		"""
+		upsets = numpy.asarray(upsets, dtype=numpy.int64).reshape(-1, 3)
+		positions = numpy.searchsorted(self.device.sortedFrads, upsets[:, 0])
+		positions = numpy.minimum(positions, len(self.device.sortedFrads) - 1)
+		valid = self.device.sortedFrads[positions] == upsets[:, 0]
+		frameIndices = self.device.sortOrder[positions]
+		bitIds = (frameIndices * self.wordsPerFrame + upsets[:, 1]) * 32 + upsets[:, 2]
+		return valid & self.contains(bitIds)
+
+	def intersect_upsets(self, upsets):
+		"""
+		Keeps the upsets at set bits, e.g. the upsets of essential bits
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates
+		:return: Array of the upsets at set bits
+		"""
+		return numpy.asarray(upsets)[self.contains_upsets(upsets)]
+
+	def subtract_upsets(self, upsets):
+		"""
+		Drops the upsets at set bits, e.g. the upsets of masked bits
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates
+		:return: Array of the upsets at bits that are not set
+		"""
+		return numpy.asarray(upsets)[~self.contains_upsets(upsets)]
+
+	def to_image(self, numFrames):
+		"""
+		Expands the set bits of the first numFrames frames into a dense image
+		:param numFrames: Number of frames in the image
+		:return: 2D array (numFrames x wordsPerFrame) of 32 bit words
+		"""
+		image = numpy.zeros(numFrames * self.wordsPerFrame, dtype=numpy.uint32)
+		inImage = self.wordIds < len(image)
+		image[self.wordIds[inImage]] = self.words[inImage]
+		return image.reshape(numFrames, self.wordsPerFrame)
+
+	def count(self):
+		"""
+		:return: Number of set bits
+		"""
+		return int(numpy.unpackbits(self.words.view(numpy.uint8)).sum())
+
+	def get_num_words(self):
+		"""
+		:return: Number of stored words (words with at least one set bit)
+		"""
+		return len(self.wordIds)
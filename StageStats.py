@@ -0,0 +1,79 @@
+__author__ = 'Peter Zabriskie'
+import threading
+import time
+
+class StageStats:
+	"""
+	This class collects wall time and counters of the stages of parsing, loading, and comparing.
+	Pass one to BinParser, AsciiParser, FradStructure, or FrameOperations (stats=...) to instrument them; without one they
+	skip all bookkeeping. Stages record the counters that apply to them:
+		bytes: bytes of input consumed
+		words: 32 bit words decoded or compared
+		frames: frames stored or compared
+		skippedWords: words of pad and dummy frames (or words before the configuration data) skipped
+		upsets: differing bits found
+	A stage may contain the stages of the helpers it calls (e.g. BinParser.decode_packets includes BinParser.store_frames).
+	An optional callback(stage, seconds, counts) is called after every recorded stage, e.g. to feed a monitoring system.
+	"""
+
+	def __init__(self, callback=None):
+		"""
+		Construct a new StageStats object
+		:param callback: Optional function called as callback(stage, seconds, counts) for every recorded stage
+		:return: returns nothing
+		"""
+		self.callback = callback
+		self.stages = {}
+		self.lock = threading.Lock()
+
+	def start(self):
+		"""
+		:return: Start time of a stage, to be passed to record()
+		"""
+		return time.time()
+
+	def record(self, stage, startTime, **counts):
+		"""
+		Adds the time since startTime and the given counters to a stage
+		:param stage: Name of the stage, e.g. 'BinParser.sync_search'
+		:param startTime: Value returned by start() when the stage began
+		:param counts: Counters of the stage (bytes, words, frames, skippedWords, upsets)
+		:return: returns nothing
+		"""
+		seconds = time.time() - startTime
+		with self.lock:
+			totals = self.stages.get(stage)
+			if totals is None:
+				totals = {'calls': 0, 'seconds': 0.0}
+				self.stages[stage] = totals
+			totals['calls'] += 1
+			totals['seconds'] += seconds
+			for name, value in counts.items():
+				totals[name] = totals.get(name, 0) + int(value)
+		if self.callback is not None:
+			self.callback(stage, seconds, counts)
+
+	def get_stages(self):
+		"""
+		:return: Dictionary mapping every stage to a dictionary of its calls, seconds, and counters
+		"""
+		with self.lock:
+			return dict((stage, dict(totals)) for stage, totals in self.stages.items())
+
+	def reset(self):
+		"""
+		Clears every stage recorded so far
+		:return: returns nothing
+		"""
+		with self.lock:
+			self.stages = {}
+
+	def format_report(self):
+		"""
+		:return: Text table of the stages sorted by total time
+		"""
+		lines = []
+		for stage, totals in sorted(self.get_stages().items(), key=lambda item: -item[1]['seconds']):
+			counts = ' '.join(["%s=%d" % (name, totals[name]) for name in sorted(totals) if name not in ('calls', 'seconds')])
+			lines.append("%-40s %6d calls %10.4f s %s" % (stage, totals['calls'], totals['seconds'], counts))
+		return '\n'.join(lines)
@@ -0,0 +1,148 @@
+__author__ = 'Peter Zabriskie'
+import copy
+import numpy
+from FrameOperations import FrameOperations
+
+class StreamingDiff:
+	"""
+	This class compares readback data against a golden FradStructure while it arrives, instead of after a whole
+	readback file is saved and parsed. Raw configuration data (the words read from FDRO, as in a JCM .data file)
+	is fed in chunks of any size; every frame is compared as soon as its last word arrives, following the same
+	pad frame and dummy frame rules as BinParser.extract_frame_data. Only the words of an incomplete frame are kept
+	between chunks, so memory does not grow with the length of the stream.
+	"""
+
+	def __init__(self, goldenFradStructure, mskFradStructure=None, includeBram=0, padFrame=0, dummyFrames=1, swapEndian=1,
+		careMask=None, stats=None):
+		"""
+		Construct a new StreamingDiff object. The defaults describe JCM .data readbacks (no pad frame, Little Endian words),
+		as does ReadbackServer; use padFrame=1, swapEndian=0 for a raw Big Endian FDRO stream.
+		:param goldenFradStructure: FradStructure or FrameStore object holding the golden configuration
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are ignored
+		:param includeBram: 1 if the readback holds every frame, 0 if it stops after the logic frames
+		:param padFrame: 1 if a pad frame precedes the first frame
+		:param dummyFrames: 1 if 2 dummy frames are inserted when type, row, or topBottom boundaries are crossed
+		:param swapEndian: 1 if words are stored Little Endian (JCM .data files)
+		:param careMask: Optional CareMask object. Only cared about bits are compared and its frames replace includeBram
+		:param stats: Optional StageStats object which records the time and counters of every chunk compared
+		:return: returns nothing
+		"""
+		self.golden = goldenFradStructure
+		self.frameOps = FrameOperations(goldenFradStructure, goldenFradStructure, stats)
+		self.stats = stats
+		self.wordsPerFrame = goldenFradStructure.wordsPerFrame
+		self.frameBytes = 4 * self.wordsPerFrame
+		self.wordType = '<u4' if swapEndian else '>u4'
+		self.numFrames = goldenFradStructure.numFrads if (includeBram) else goldenFradStructure.numLogicFrames
+		if careMask is not None:
+			self.numFrames = careMask.numFrames
+
+		# Frame index of every frame of the stream, -1 for pad and dummy frames
+		positions = goldenFradStructure.device.get_stream_layout(padFrame, dummyFrames)[:self.numFrames] / self.wordsPerFrame
+		self.streamFrames = int(positions[-1]) + 1 if self.numFrames > 0 else 0
+		self.streamFrameIndex = numpy.zeros(self.streamFrames, dtype=numpy.int32) - 1
+		self.streamFrameIndex[positions] = numpy.arange(self.numFrames)
+
+		self.care = None if careMask is None else careMask.get_image()
+		if mskFradStructure is not None:
+			notMasked = ~self.frameOps.get_image(mskFradStructure, self.numFrames)
+			self.care = notMasked if self.care is None else self.care & notMasked
+		self.reset()
+
+	def reset(self):
+		"""
+		Starts comparing a new readback from its first word
+		:return: returns nothing
+		"""
+		self.pending = ''
+		self.streamFrame = 0
+
+	def copy(self):
+		"""
+		Returns a new StreamingDiff object with the same golden, masks, and stream layout, starting a new readback.
+		The golden and mask images are shared, so comparing many streams at once costs no extra images.
+		:return: StreamingDiff object
+		"""
+		streamingDiff = copy.copy(self)
+		streamingDiff.reset()
+		return streamingDiff
+
+	def feed(self, data, readbackFradStructure=None):
+		"""
+		Compares every frame completed by a chunk of readback data. Data past the end of the readback is ignored.
+		:param data: String of bytes that continues the readback
+		:param readbackFradStructure: Optional contiguous FradStructure object which also stores the frames completed
+		:return: N x 3 array of (frad, word, bit) upset coordinates of the frames completed, ordered by frame, word, then bit
+		"""
+		startTime = self.stats.start() if self.stats is not None else 0
+		if len(self.pending) > 0:
+			data = self.pending + data
+		numStreamFrames = min(len(data) / self.frameBytes, self.streamFrames - self.streamFrame)
+		if self.streamFrame + numStreamFrames < self.streamFrames:
+			self.pending = data[numStreamFrames * self.frameBytes:]
+		else:
+			self.pending = ''
+		if numStreamFrames == 0:
+			return numpy.zeros((0, 3), dtype=numpy.uint32)
+
+		frames = numpy.frombuffer(data, dtype=self.wordType, count=numStreamFrames * self.wordsPerFrame).reshape(-1, self.wordsPerFrame)
+		frameIndices = self.streamFrameIndex[self.streamFrame:self.streamFrame + numStreamFrames]
+		self.streamFrame += numStreamFrames
+		isFrame = frameIndices >= 0
+		frameIndices = frameIndices[isFrame]
+		diffImage = frames[isFrame].astype(numpy.uint32)
+		if readbackFradStructure is not None:
+			readbackFradStructure.set_frames(frameIndices, diffImage)
+		diffImage ^= self.golden.get_frames_by_index(frameIndices)
+		if self.care is not None:
+			diffImage &= self.care[frameIndices]
+		if self.stats is not None:
+			self.stats.record('StreamingDiff.compare', startTime, bytes=numStreamFrames * self.frameBytes, frames=len(frameIndices),
+				words=diffImage.size, skippedWords=(numStreamFrames - len(frameIndices)) * self.wordsPerFrame)
+		return self.frameOps.find_upsets(diffImage, frameIndices)
+
+	def is_complete(self):
+		"""
+		:return: True once every frame of the readback has been compared
+		"""
+		return self.streamFrame == self.streamFrames
+
+	def get_num_frames_compared(self):
+		"""
+		:return: Number of frames of the current readback compared so far (pad and dummy frames not counted)
+		"""
+		return int((self.streamFrameIndex[:self.streamFrame] >= 0).sum())
+
+	def scrub_stream(self, stream, chunkSize=65536, continuous=0):
+		"""
+		Generator which reads a byte stream and compares its frames as they arrive.
+		Sockets are read with recv() and io module streams (e.g. io.open(path, 'rb') of a pipe) with read1(), which
+		return whatever data is available, so upsets are reported without waiting for a whole chunk.
+		:param stream: File, pipe, or socket holding raw readback data
+		:param chunkSize: Largest number of bytes read at a time
+		:param continuous: 1 if the stream holds back to back readbacks; a new readback starts when one is complete
+		:return: Yields (readbackNumber, upsets) for every chunk with upsets, where upsets is an N x 3 array of
+		(frad, word, bit) upset coordinates and readbackNumber counts readbacks from 0
+		"""
+		if hasattr(stream, 'recv'):
+			read = stream.recv
+		elif hasattr(stream, 'read1'):
+			read = stream.read1
+		else:
+			read = stream.read
+		readbackNumber = 0
+		while True:
+			data = read(chunkSize)
+			if len(data) == 0:
+				return
+			while len(data) > 0:
+				needed = (self.streamFrames - self.streamFrame) * self.frameBytes - len(self.pending)
+				upsets = self.feed(data[:needed])
+				if len(upsets) > 0:
+					yield readbackNumber, upsets
+				data = data[needed:]
+				if self.is_complete():
+					if not continuous:
+						return
+					readbackNumber += 1
+					self.reset()
@@ -0,0 +1,470 @@
+__author__ = 'Peter Zabriskie'
+import itertools
+import sqlite3
+import time
+import numpy
+from FradStructure import FradStructure
+
+class UpsetEventStore:
+	"""
+	This class keeps every upset of a time series of readbacks in an SQLite database file, so the history of a
+	device can be queried instead of grepping text dumps of FrameOperations.diff. Readbacks are added in time order
+	and numbered from 0; readbacks whose numbers follow each other are consecutive.
+
+	The upsets table holds one row per upset bit of every readback (readback id, timestamp, bit id, frad, word, bit,
+	type, topBottom, row, column, flags), indexed by frame address, by physical location, and by time.
+	The frameHours table counts the upsets of every frame in every hour (frad, hour, flags, count) and is updated as
+	readbacks are added, so upsets_per_frame() over whole hours is answered without scanning the upsets.
+	The bits table holds one row per bit that was ever upset and is updated as readbacks are added, so questions about
+	the history of bits are answered from it without scanning the upsets:
+		firstReadback, firstTimestamp: readback in which the bit was first upset
+		lastReadback: last readback in which the bit was upset
+		numReadbacks: number of readbacks in which the bit was upset
+		numEpisodes: number of runs of consecutive readbacks in which the bit was upset. A bit with more than one
+		episode was repaired (e.g. by scrubbing) and upset again
+		longestEpisode: number of readbacks in the longest episode. A bit is transient if it is 1, persistent otherwise
+	Flags: MASKED (1) if the bit is masked, ESSENTIAL (2) if the bit is essential. Every upset keeps the flags of its
+	readback; the flags of a bit are those of the last readback in which it was upset.
+	"""
+
+	def __init__(self, path, fradFile, series):
+		"""
+		Opens an upset store, creating it if the file does not exist
+		:param path: Path to the database file, or ':memory:' for a store that is not saved
+		:param fradFile: Path to file containing list of frame addresses
+		:param series: The series of the device
+		:return: returns nothing
+		"""
+		self.MASKED = 1
+		self.ESSENTIAL = 2
+		# Columns of the tables returned by the upset and bit queries
+		self.UPSET_COLUMNS = 'readbackId, frad, word, bit, flags'
+		self.BIT_COLUMNS = 'frad, word, bit, flags, firstReadback, lastReadback, numReadbacks, numEpisodes, longestEpisode'
+		# Page cache in KiB. Upsets land at random places in the indexes, so adding them slows down once the
+		# indexes no longer fit in the cache
+		self.CACHE_SIZE = 256 * 1024
+		# Length in seconds of the intervals counted in the frameHours table. Hour n starts at timestamp n * ROLLUP_INTERVAL
+		self.ROLLUP_INTERVAL = 3600
+
+		self.fradStructure = FradStructure(series)
+		self.fradStructure.load_frads(fradFile)
+		self.device = self.fradStructure.device
+		self.wordsPerFrame = self.fradStructure.wordsPerFrame
+		self.connection = sqlite3.connect(path)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA synchronous=NORMAL')
+		self.connection.execute('PRAGMA cache_size=-%d' % self.CACHE_SIZE)
+		with self.connection:
+			newRollup = self.connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'frameHours'").fetchone()[0] == 0
+			self.create_tables()
+			if newRollup:
+				# A store written before the frameHours table existed is counted once from its upsets
+				self.connection.execute('INSERT INTO frameHours SELECT frad, CAST(timestamp / ? AS INTEGER) AS hour, flags, COUNT(*) '
+					'FROM upsets GROUP BY frad, hour, flags', (float(self.ROLLUP_INTERVAL),))
+			deviceInfo = (series, self.wordsPerFrame, self.device.numFrads)
+			storedInfo = self.connection.execute('SELECT series, wordsPerFrame, numFrads FROM device').fetchone()
+			if storedInfo is None:
+				self.connection.execute('INSERT INTO device VALUES (?, ?, ?)', deviceInfo)
+			elif tuple(storedInfo) != deviceInfo:
+				raise ValueError("Store does not match the device in UpsetEventStore:__init__()")
+		# Bits upset in the readback being added
+		self.connection.execute('CREATE TEMP TABLE newBits (bitId INTEGER PRIMARY KEY, frad INTEGER, word INTEGER, bit INTEGER, flags INTEGER)')
+		self.read_state()
+
+	def read_state(self):
+		"""
+		Helper function which reads the number of readbacks and the time of the last one from the store
+		:return: returns nothing
+		"""
+		self.numReadbacks, self.lastTimestamp = self.connection.execute('SELECT COUNT(*), MAX(timestamp) FROM readbacks').fetchone()
+
+	def create_tables(self):
+		"""
+		Helper function which creates the tables and indexes of a new store
+		:return: returns nothing
+		"""
+		for statement in (
+			'CREATE TABLE IF NOT EXISTS device (series INTEGER, wordsPerFrame INTEGER, numFrads INTEGER)',
+			'CREATE TABLE IF NOT EXISTS readbacks (readbackId INTEGER PRIMARY KEY, timestamp REAL NOT NULL, name TEXT, numUpsets INTEGER)',
+			'CREATE INDEX IF NOT EXISTS readbacksByTime ON readbacks (timestamp)',
+			'CREATE TABLE IF NOT EXISTS upsets (readbackId INTEGER NOT NULL, timestamp REAL NOT NULL, bitId INTEGER NOT NULL, '
+				'frad INTEGER, word INTEGER, bit INTEGER, type INTEGER, topBottom INTEGER, row INTEGER, column INTEGER, flags INTEGER)',
+			'CREATE INDEX IF NOT EXISTS upsetsByFrad ON upsets (frad, timestamp, flags)',
+			'CREATE INDEX IF NOT EXISTS upsetsByLocation ON upsets (type, topBottom, row, column, timestamp)',
+			'CREATE INDEX IF NOT EXISTS upsetsByTime ON upsets (timestamp, readbackId)',
+			'CREATE TABLE IF NOT EXISTS frameHours (frad INTEGER, hour INTEGER, flags INTEGER, count INTEGER, '
+				'PRIMARY KEY (frad, hour, flags)) WITHOUT ROWID',
+			'CREATE INDEX IF NOT EXISTS frameHoursByHour ON frameHours (hour)',
+			'CREATE TABLE IF NOT EXISTS bits (bitId INTEGER PRIMARY KEY, frad INTEGER, word INTEGER, bit INTEGER, flags INTEGER, '
+				'firstReadback INTEGER, firstTimestamp REAL, lastReadback INTEGER, numReadbacks INTEGER, numEpisodes INTEGER, '
+				'episodeLength INTEGER, longestEpisode INTEGER)',
+			'CREATE INDEX IF NOT EXISTS bitsByFirstTime ON bits (firstTimestamp)',
+			'CREATE INDEX IF NOT EXISTS bitsByLongestEpisode ON bits (longestEpisode)',
+			'CREATE INDEX IF NOT EXISTS bitsByEpisodes ON bits (numEpisodes)'):
+			self.connection.execute(statement)
+
+	def add_readback(self, upsets, timestamp=None, name='', masked=None, essential=None):
+		"""
+		Adds the upsets of one readback in a single transaction. Use add_readbacks() to add many readbacks at once.
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates (e.g. from FrameOperations.diff_array) or a
+		list of (frad, word, bit) tuples (e.g. from FrameOperations.diff). A readback without upsets is added too
+		:param timestamp: Time of the readback in seconds since the epoch, no earlier than the readbacks added before.
+		Defaults to the current time
+		:param name: Name of the readback, e.g. its file name
+		:param masked: Optional SparseBitset object of the masked bits, or boolean array flagging every upset
+		:param essential: Optional SparseBitset object of the essential bits, or boolean array flagging every upset
+		:return: Id of the readback
+		"""
+		return self.add_readbacks([(upsets, timestamp, name)], masked, essential)[0]
+
+	def add_readbacks(self, readbacks, masked=None, essential=None):
+		"""
+		Adds the upsets of many readbacks in a single transaction, which is much faster than adding them one by one
+		because the index pages shared by the readbacks are written once. Nothing is added if any readback is rejected.
+		:param readbacks: Iterable of (upsets, timestamp, name) tuples, with the arguments of add_readback()
+		:param masked: Optional SparseBitset object of the masked bits
+		:param essential: Optional SparseBitset object of the essential bits
+		:return: List of the ids of the readbacks
+		"""
+		readbackIds = []
+		try:
+			with self.connection:
+				for upsets, timestamp, name in readbacks:
+					readbackIds.append(self.insert_readback(upsets, timestamp, name, masked, essential))
+		except Exception:
+			self.read_state()
+			raise
+		return readbackIds
+
+	def insert_readback(self, upsets, timestamp, name, masked, essential):
+		"""
+		Helper function which adds the upsets of one readback in the current transaction
+		:param upsets: N x 3 array or list of (frad, word, bit) upset coordinates
+		:param timestamp: Time of the readback in seconds since the epoch, or None for the current time
+		:param name: Name of the readback
+		:param masked: SparseBitset object of the masked bits, boolean array flagging every upset, or None
+		:param essential: SparseBitset object of the essential bits, boolean array flagging every upset, or None
+		:return: Id of the readback
+		"""
+		upsets = numpy.asarray(upsets, dtype=numpy.int64).reshape(-1, 3)
+		if timestamp is None:
+			timestamp = time.time()
+		if self.lastTimestamp is not None and timestamp < self.lastTimestamp:
+			raise ValueError("Readbacks must be added in time order in UpsetEventStore:insert_readback()")
+		frameIndices = self.fradStructure.get_frame_indices(upsets[:, 0])
+		invalid = ((frameIndices == self.fradStructure.FRAD_OUT_OF_BOUNDS) | (upsets[:, 1] < 0) | (upsets[:, 1] >= self.wordsPerFrame) |
+			(upsets[:, 2] < 0) | (upsets[:, 2] >= 32))
+		if invalid.any():
+			raise ValueError("Upset (0x%X, %d, %d) out of bounds in UpsetEventStore:insert_readback()" % tuple(upsets[invalid][0].tolist()))
+		flags = numpy.zeros(len(upsets), dtype=numpy.int64)
+		if masked is not None:
+			flags[self.get_flagged(masked, upsets)] |= self.MASKED
+		if essential is not None:
+			flags[self.get_flagged(essential, upsets)] |= self.ESSENTIAL
+
+		bitIds, unique = numpy.unique((frameIndices * self.wordsPerFrame + upsets[:, 1]) * 32 + upsets[:, 2], return_index=True)
+		upsets = upsets[unique]
+		frameIndices = frameIndices[unique]
+		flags = flags[unique]
+		readbackId = self.numReadbacks
+		numUpsets = len(bitIds)
+		frads, words, bits = upsets[:, 0].tolist(), upsets[:, 1].tolist(), upsets[:, 2].tolist()
+		bitIds, flags = bitIds.tolist(), flags.tolist()
+		self.connection.execute('INSERT INTO readbacks VALUES (?, ?, ?, ?)', (readbackId, timestamp, name, numUpsets))
+		self.connection.executemany('INSERT INTO upsets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', itertools.izip(
+			itertools.repeat(readbackId, numUpsets), itertools.repeat(timestamp, numUpsets), bitIds, frads, words, bits,
+			self.device.types[frameIndices].tolist(), self.device.topBottoms[frameIndices].tolist(),
+			self.device.rows[frameIndices].tolist(), self.device.columns[frameIndices].tolist(), flags))
+		self.update_bits(readbackId, timestamp, itertools.izip(bitIds, frads, words, bits, flags))
+		self.update_frame_hours(timestamp, upsets[:, 0], numpy.asarray(flags, dtype=numpy.int64))
+		self.numReadbacks += 1
+		self.lastTimestamp = timestamp
+		return readbackId
+
+	def get_flagged(self, bitset, upsets):
+		"""
+		Helper function which finds the upsets flagged by a SparseBitset or boolean array
+		:param bitset: SparseBitset object, or boolean array with one entry per upset
+		:param upsets: N x 3 array of (frad, word, bit) upset coordinates
+		:return: Boolean array, True where the upset is flagged
+		"""
+		if hasattr(bitset, 'contains_upsets'):
+			return bitset.contains_upsets(upsets)
+		flagged = numpy.asarray(bitset, dtype=bool).ravel()
+		if len(flagged) != len(upsets):
+			raise ValueError("Flag array does not match the upsets in UpsetEventStore:get_flagged()")
+		return flagged
+
+	def update_bits(self, readbackId, timestamp, bitRows):
+		"""
+		Helper function which updates the history of the bits upset in a new readback
+		:param readbackId: Id of the new readback
+		:param timestamp: Time of the new readback
+		:param bitRows: Iterable of (bitId, frad, word, bit, flags) of every bit upset in the readback
+		:return: returns nothing
+		"""
+		self.connection.execute('DELETE FROM newBits')
+		self.connection.executemany('INSERT INTO newBits VALUES (?, ?, ?, ?, ?)', bitRows)
+		# A bit upset in the previous readback continues its episode, any other bit upset before starts a new one
+		self.connection.execute('UPDATE bits SET '
+			'flags = (SELECT flags FROM newBits WHERE newBits.bitId = bits.bitId), '
+			'numEpisodes = numEpisodes + (lastReadback != ?1 - 1), '
+			'episodeLength = CASE WHEN lastReadback = ?1 - 1 THEN episodeLength + 1 ELSE 1 END, '
+			'longestEpisode = MAX(longestEpisode, CASE WHEN lastReadback = ?1 - 1 THEN episodeLength + 1 ELSE 1 END), '
+			'numReadbacks = numReadbacks + 1, '
+			'lastReadback = ?1 '
+			'WHERE bitId IN (SELECT bitId FROM newBits)', (readbackId,))
+		self.connection.execute('INSERT OR IGNORE INTO bits SELECT bitId, frad, word, bit, flags, ?1, ?2, ?1, 1, 1, 1, 1 FROM newBits',
+			(readbackId, timestamp))
+
+	def update_frame_hours(self, timestamp, frads, flags):
+		"""
+		Helper function which adds the upsets of a new readback to the upset counts of its hour
+		:param timestamp: Time of the new readback
+		:param frads: Array of the frame address of every upset
+		:param flags: Array of the flags of every upset
+		:return: returns nothing
+		"""
+		if len(frads) == 0:
+			return
+		# Same rounding as CAST(timestamp / ROLLUP_INTERVAL AS INTEGER) in SQL
+		hour = int(timestamp / float(self.ROLLUP_INTERVAL))
+		# Flags take 2 bits, so every (frad, flags) pair has its own key
+		keys, inverse = numpy.unique(frads * 4 + flags, return_inverse=True)
+		rows = zip(numpy.bincount(inverse).tolist(), (keys >> 2).tolist(), itertools.repeat(hour), (keys & 3).tolist())
+		self.connection.executemany('UPDATE frameHours SET count = count + ? WHERE frad = ? AND hour = ? AND flags = ?', rows)
+		self.connection.executemany('INSERT OR IGNORE INTO frameHours VALUES (?, ?, ?, ?)',
+			[(frad, hour, flag, count) for count, frad, hour, flag in rows])
+
+	def get_num_readbacks(self):
+		"""
+		:return: Number of readbacks in the store
+		"""
+		return self.numReadbacks
+
+	def get_num_upsets(self):
+		"""
+		:return: Number of upsets of all readbacks in the store
+		"""
+		return self.connection.execute('SELECT COALESCE(SUM(numUpsets), 0) FROM readbacks').fetchone()[0]
+
+	def get_num_bits(self):
+		"""
+		:return: Number of distinct bits upset at least once
+		"""
+		return self.connection.execute('SELECT COUNT(*) FROM bits').fetchone()[0]
+
+	def get_readback_info(self, readbackId):
+		"""
+		:param readbackId: Id of a readback
+		:return: (name, timestamp, numUpsets) of the readback
+		"""
+		info = self.connection.execute('SELECT name, timestamp, numUpsets FROM readbacks WHERE readbackId = ?', (readbackId,)).fetchone()
+		if info is None:
+			raise ValueError("Readback %d not in store in UpsetEventStore:get_readback_info()" % readbackId)
+		return info
+
+	def get_readback_ids(self, start=None, stop=None):
+		"""
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:return: Array of the ids of the readbacks from start up to (but not including) stop
+		"""
+		clause, params = self.time_filter(start, stop)
+		return self.query_table('SELECT readbackId FROM readbacks WHERE 1' + clause + ' ORDER BY readbackId', params, 1).ravel()
+
+	def get_readback_upsets(self, readbackId, includeMasked=1, essentialOnly=0):
+		"""
+		:param readbackId: Id of a readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 5 array of (readbackId, frad, word, bit, flags) ordered by frame, word, then bit
+		"""
+		timestamp = self.get_readback_info(readbackId)[1]
+		return self.query_table('SELECT ' + self.UPSET_COLUMNS + ' FROM upsets INDEXED BY upsetsByTime WHERE timestamp = ? AND readbackId = ?' +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY bitId', (timestamp, readbackId), 5)
+
+	def upsets_in_frames(self, frads, start=None, stop=None, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the upsets of some frames
+		:param frads: Frame address or array of frame addresses
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 5 array of (readbackId, frad, word, bit, flags) ordered by the order of frads, then readback
+		"""
+		clause, params = self.time_filter(start, stop)
+		clause += self.flag_filter(includeMasked, essentialOnly)
+		tables = [self.query_table('SELECT ' + self.UPSET_COLUMNS + ' FROM upsets INDEXED BY upsetsByFrad WHERE frad = ?' + clause +
+			' ORDER BY timestamp, readbackId, word, bit', [frad] + params, 5) for frad in numpy.atleast_1d(frads).tolist()]
+		return numpy.concatenate(tables) if len(tables) > 0 else numpy.zeros((0, 5), dtype=numpy.int64)
+
+	def upsets_at_location(self, blockType=None, topBottom=None, row=None, column=None, start=None, stop=None, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the upsets in a part of the device. Every location argument left as None matches any value; the location
+		index is used for the leading arguments given (blockType, then topBottom, then row, then column).
+		:param blockType: Optional block type
+		:param topBottom: Optional top/bottom half
+		:param row: Optional row
+		:param column: Optional column
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 5 array of (readbackId, frad, word, bit, flags) ordered by readback, then frame, word, and bit
+		"""
+		clause, params = self.time_filter(start, stop)
+		for level, value in (('type', blockType), ('topBottom', topBottom), ('row', row), ('column', column)):
+			if value is not None:
+				clause += ' AND ' + level + ' = ?'
+				params.append(value)
+		return self.query_table('SELECT ' + self.UPSET_COLUMNS + ' FROM upsets WHERE 1' + clause +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY readbackId, bitId', params, 5)
+
+	def upsets_in_time(self, start=None, stop=None, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the upsets of the readbacks in a time range
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 5 array of (readbackId, frad, word, bit, flags) ordered by readback, then frame, word, and bit
+		"""
+		clause, params = self.time_filter(start, stop)
+		return self.query_table('SELECT ' + self.UPSET_COLUMNS + ' FROM upsets INDEXED BY upsetsByTime WHERE 1' + clause +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY readbackId, bitId', params, 5)
+
+	def upsets_per_frame(self, interval=3600.0, start=None, stop=None, includeMasked=1, essentialOnly=0):
+		"""
+		Counts the upsets of every frame in every time interval (e.g. upsets per frame per hour). An interval that is a
+		whole number of hours, with start and stop on hour boundaries, is counted from the frameHours table; any other
+		interval scans the upsets.
+		:param interval: Length of the intervals in seconds. Interval n starts at timestamp n * interval
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 3 array of (frad, interval, count) for every frame and interval with upsets, ordered by frame then interval
+		"""
+		hours = interval / float(self.ROLLUP_INTERVAL)
+		if hours == int(hours) and hours >= 1 and all([t is None or t % self.ROLLUP_INTERVAL == 0 for t in (start, stop)]):
+			startHour = int(start // self.ROLLUP_INTERVAL) if start is not None else None
+			stopHour = int(stop // self.ROLLUP_INTERVAL) if stop is not None else None
+			clause, params = self.time_filter(startHour, stopHour, 'hour')
+			return self.query_table('SELECT frad, hour / ? AS period, SUM(count) FROM frameHours WHERE 1' + clause +
+				self.flag_filter(includeMasked, essentialOnly) + ' GROUP BY frad, period ORDER BY frad, period', [int(hours)] + params, 3)
+		clause, params = self.time_filter(start, stop)
+		# A time range reads only its upsets, otherwise every upset is counted from the frame address index alone
+		index = 'upsetsByFrad' if start is None and stop is None else 'upsetsByTime'
+		return self.query_table('SELECT frad, CAST(timestamp / ? AS INTEGER) AS period, COUNT(*) FROM upsets INDEXED BY ' + index + ' WHERE 1' +
+			clause + self.flag_filter(includeMasked, essentialOnly) + ' GROUP BY frad, period ORDER BY frad, period', [interval] + params, 3)
+
+	def first_appearances(self, start=None, stop=None, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the bits first upset in a time range
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 9 array of (frad, word, bit, flags, firstReadback, lastReadback, numReadbacks, numEpisodes, longestEpisode)
+		ordered by first readback, then frame, word, and bit
+		"""
+		clause, params = self.time_filter(start, stop, 'firstTimestamp')
+		return self.query_table('SELECT ' + self.BIT_COLUMNS + ' FROM bits INDEXED BY bitsByFirstTime WHERE 1' + clause +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY firstReadback, bitId', params, 9)
+
+	def persistent_bits(self, minReadbacks=2, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the bits that stayed upset in consecutive readbacks
+		:param minReadbacks: Number of consecutive readbacks a bit has to stay upset
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 9 array of (frad, word, bit, flags, firstReadback, lastReadback, numReadbacks, numEpisodes, longestEpisode)
+		ordered by frame, word, then bit
+		"""
+		return self.query_table('SELECT ' + self.BIT_COLUMNS + ' FROM bits INDEXED BY bitsByLongestEpisode WHERE longestEpisode >= ?' +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY bitId', (max(minReadbacks, 1),), 9)
+
+	def transient_bits(self, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the bits that were never upset in two consecutive readbacks
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 9 array of (frad, word, bit, flags, firstReadback, lastReadback, numReadbacks, numEpisodes, longestEpisode)
+		ordered by frame, word, then bit
+		"""
+		return self.query_table('SELECT ' + self.BIT_COLUMNS + ' FROM bits INDEXED BY bitsByLongestEpisode WHERE longestEpisode = 1' +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY bitId', (), 9)
+
+	def reappeared_bits(self, minEpisodes=2, includeMasked=1, essentialOnly=0):
+		"""
+		Finds the bits that were repaired and upset again, i.e. were upset, not upset in a later readback, then upset again
+		:param minEpisodes: Number of separate episodes a bit has to be upset in
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: N x 9 array of (frad, word, bit, flags, firstReadback, lastReadback, numReadbacks, numEpisodes, longestEpisode)
+		ordered by frame, word, then bit
+		"""
+		return self.query_table('SELECT ' + self.BIT_COLUMNS + ' FROM bits INDEXED BY bitsByEpisodes WHERE numEpisodes >= ?' +
+			self.flag_filter(includeMasked, essentialOnly) + ' ORDER BY bitId', (max(minEpisodes, 1),), 9)
+
+	def get_bit_history(self, frad, wordNum, bit):
+		"""
+		:param frad: Frame address of the bit
+		:param wordNum: Word of the frame holding the bit
+		:param bit: Bit of the word
+		:return: Array of the ids of the readbacks in which the bit was upset
+		"""
+		return self.query_table('SELECT readbackId FROM upsets INDEXED BY upsetsByFrad WHERE frad = ? AND word = ? AND bit = ? '
+			'ORDER BY readbackId', (frad, wordNum, bit), 1).ravel()
+
+	def time_filter(self, start, stop, column='timestamp'):
+		"""
+		Helper function which builds the condition of a time range
+		:param start: Optional earliest timestamp
+		:param stop: Optional timestamp after the last readback
+		:param column: Name of the timestamp column
+		:return: (clause, params) where clause is an SQL string starting with ' AND ' (or empty) and params its parameters
+		"""
+		clause = ''
+		params = []
+		if start is not None:
+			clause += ' AND ' + column + ' >= ?'
+			params.append(start)
+		if stop is not None:
+			clause += ' AND ' + column + ' < ?'
+			params.append(stop)
+		return clause, params
+
+	def flag_filter(self, includeMasked, essentialOnly):
+		"""
+		Helper function which builds the condition selecting bits by their flags
+		:param includeMasked: 0 to leave out masked bits
+		:param essentialOnly: 1 to keep essential bits only
+		:return: SQL string starting with ' AND ', or empty
+		"""
+		clause = ''
+		if not includeMasked:
+			clause += ' AND flags & %d = 0' % self.MASKED
+		if essentialOnly:
+			clause += ' AND flags & %d != 0' % self.ESSENTIAL
+		return clause
+
+	def query_table(self, sql, params, numColumns):
+		"""
+		Helper function which runs a query and returns its rows as an array
+		:param sql: SQL query
+		:param params: Parameters of the query
+		:param numColumns: Number of columns of the query
+		:return: N x numColumns array of 64 bit integers
+		"""
+		rows = self.connection.execute(sql, params)
+		return numpy.fromiter(itertools.chain.from_iterable(rows), dtype=numpy.int64).reshape(-1, numColumns)
+
+	def close(self):
+		"""
+		Closes the database file
+		:return: returns nothing
+		"""
+		self.connection.close()
@@ -0,0 +1,158 @@
+__author__ = 'Peter Zabriskie'
+import numpy
+from FradStructure import FradStructure
+from FrameOperations import FrameOperations
+
+class UpsetStatistics:
+	"""
+	This class accumulates upset counts of many readbacks compared against one golden FradStructure.
+	Every bit is identified by a single integer, (frameIndex * wordsPerFrame + word) * 32 + bit. Upset bits are kept
+	as a sorted array of bit ids with one count each, so memory grows with the number of distinct upset bits rather
+	than the size of the device. Upset bit counts of every frame are kept in a dense array.
+	"""
+
+	def __init__(self, goldenFradStructure, mskFradStructure=None, includeBram=0, careMask=None):
+		"""
+		Construct a new UpsetStatistics object
+		:param goldenFradStructure: FradStructure object holding the golden configuration
+		:param mskFradStructure: Optional FradStructure object containing mask information. Masked bits are never counted
+		:param includeBram: 1 to count upsets in every frame, 0 to count logic frames only
+		:param careMask: Optional CareMask object. Only cared about bits are counted and its frames replace includeBram
+		:return: returns nothing
+		"""
+		# Number of pending bit ids that triggers merging them into the counts
+		self.MERGE_THRESHOLD = 1 << 22
+
+		self.frameOps = FrameOperations(goldenFradStructure, goldenFradStructure)
+		self.wordsPerFrame = goldenFradStructure.wordsPerFrame
+		self.frads = goldenFradStructure.device.frads
+		self.numFrames = goldenFradStructure.numFrads if (includeBram) else goldenFradStructure.numLogicFrames
+		if careMask is not None:
+			self.numFrames = careMask.numFrames
+		self.golden = self.frameOps.get_image(goldenFradStructure, self.numFrames)
+		self.care = None if careMask is None else careMask.get_image()
+		if mskFradStructure is not None:
+			notMasked = ~self.frameOps.get_image(mskFradStructure, self.numFrames)
+			self.care = notMasked if self.care is None else self.care & notMasked
+
+		self.numReadbacks = 0
+		self.bitIds = numpy.zeros(0, dtype=numpy.int64)
+		self.bitCounts = numpy.zeros(0, dtype=numpy.uint32)
+		self.frameCounts = numpy.zeros(self.numFrames, dtype=numpy.int64)
+		self.pendingIds = []
+		self.numPendingIds = 0
+
+	def add_readback(self, fradStructure):
+		"""
+		Compares a readback FradStructure against the golden configuration and counts its upsets
+		:param fradStructure: FradStructure object holding the readback data
+		:return: Number of upset bits in the readback
+		"""
+		return self.add_image(self.frameOps.get_image(fradStructure, self.numFrames))
+
+	def add_image(self, image):
+		"""
+		Compares one readback image against the golden configuration and counts its upsets
+		:param image: 2D array (numFrames x wordsPerFrame) of 32 bit words in frame index order
+		:return: Number of upset bits in the readback
+		"""
+		diffImage = self.golden ^ numpy.asarray(image, dtype=numpy.uint32)[:self.numFrames]
+		if self.care is not None:
+			diffImage &= self.care
+		return self.add_diff_image(diffImage)
+
+	def add_images(self, images):
+		"""
+		Counts the upsets of a stack of readback images
+		:param images: 3D array (numReadbacks x numFrames x wordsPerFrame) or iterable of readback images
+		:return: Array holding the number of upset bits in every readback
+		"""
+		return numpy.array([self.add_image(image) for image in images], dtype=numpy.int64)
+
+	def add_diff_image(self, diffImage):
+		"""
+		Counts every set bit of an image of XORed frames as an upset of one readback
+		:param diffImage: 2D array (numFrames x wordsPerFrame) with a 1 at every upset bit
+		:return: Number of upset bits in the readback
+		"""
+		diffWords = diffImage.ravel()
+		wordIds = numpy.flatnonzero(diffWords)
+		upsetWords, bits = self.frameOps.find_set_bits(diffWords[wordIds])
+		bitIds = wordIds[upsetWords].astype(numpy.int64) * 32 + bits
+
+		self.frameCounts += numpy.bincount(bitIds / (self.wordsPerFrame * 32), minlength=self.numFrames)
+		self.pendingIds.append(bitIds)
+		self.numPendingIds += len(bitIds)
+		if self.numPendingIds >= self.MERGE_THRESHOLD:
+			self.merge_pending()
+		self.numReadbacks += 1
+		return len(bitIds)
+
+	def merge_pending(self):
+		"""
+		Helper function which merges the bit ids of readbacks added since the last merge into the bit counts
+		:return: returns nothing
+		"""
+		if self.numPendingIds == 0:
+			return
+		bitIds = numpy.concatenate([self.bitIds] + self.pendingIds)
+		weights = numpy.concatenate((self.bitCounts, numpy.ones(self.numPendingIds, dtype=numpy.uint32)))
+		self.bitIds, inverse = numpy.unique(bitIds, return_inverse=True)
+		self.bitCounts = numpy.bincount(inverse, weights=weights).astype(numpy.uint32)
+		self.pendingIds = []
+		self.numPendingIds = 0
+
+	def get_bit_counts(self):
+		"""
+		Returns the upset count of every bit that was upset at least once
+		:return: (bitIds, counts) arrays sorted by bit id
+		"""
+		self.merge_pending()
+		return self.bitIds, self.bitCounts
+
+	def top_bits(self, n):
+		"""
+		Finds the n bits upset in the most readbacks. Ties are ordered by frame, word, then bit.
+		:param n: Number of bits to return
+		:return: N x 4 array of (frad, word, bit, count)
+		"""
+		bitIds, counts = self.get_bit_counts()
+		order = numpy.lexsort((bitIds, -counts.astype(numpy.int64)))[:n]
+		return self.bit_table(bitIds[order], counts[order])
+
+	def bits_upset_at_least(self, k):
+		"""
+		Finds every bit upset in at least k readbacks
+		:param k: Minimum number of readbacks
+		:return: N x 4 array of (frad, word, bit, count) ordered by frame, word, then bit
+		"""
+		bitIds, counts = self.get_bit_counts()
+		selected = counts >= k
+		return self.bit_table(bitIds[selected], counts[selected])
+
+	def top_frames(self, n):
+		"""
+		Finds the n frames with the most upset bits over all readbacks. Ties are ordered by frame index.
+		:param n: Number of frames to return
+		:return: N x 2 array of (frad, count)
+		"""
+		order = numpy.lexsort((numpy.arange(self.numFrames), -self.frameCounts))[:n]
+		frames = numpy.empty((len(order), 2), dtype=numpy.int64)
+		frames[:, 0] = self.frads[order]
+		frames[:, 1] = self.frameCounts[order]
+		return frames
+
+	def bit_table(self, bitIds, counts):
+		"""
+		Helper function which turns bit ids and counts into a table of bit coordinates
+		:param bitIds: Array of bit ids
+		:param counts: Array of upset counts
+		:return: N x 4 array of (frad, word, bit, count)
+		"""
+		wordIds = bitIds / 32
+		table = numpy.empty((len(bitIds), 4), dtype=numpy.uint32)
+		table[:, 0] = self.frads[wordIds / self.wordsPerFrame]
+		table[:, 1] = wordIds % self.wordsPerFrame
+		table[:, 2] = bitIds % 32
+		table[:, 3] = counts
+		return table
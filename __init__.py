@@ -3,6 +3,20 @@ This module provides many useful tools for analyzing bitstreams and readback dat
 """
 
 from FradStructure import FradStructure
+from MappedFradStructure import MappedFradStructure
+from DeviceDatabase import DeviceDatabase
 from FrameOperations import FrameOperations
+from BatchScrubber import BatchScrubber
+from UpsetStatistics import UpsetStatistics
+from SparseBitset import SparseBitset
+from CareMask import CareMask
+from FrameEcc import FrameEcc
+from FrameStore import FrameStore
+from StreamingDiff import StreamingDiff
+from ReadbackServer import ReadbackServer
+from ReadbackArchive import ReadbackArchive
+from UpsetEventStore import UpsetEventStore
+from StageStats import StageStats
 from BinParser import BinParser
-from AsciiParser import AsciiParser
\ No newline at end of file
+from AsciiParser import AsciiParser
+from BitstreamWriter import BitstreamWriter
\ No newline at end of file
@@ -0,0 +1,180 @@
+__author__ = 'Peter Zabriskie'
+import os
+import sys
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FradStructure import FradStructure
+
+class SyntheticBitstreams:
+	"""
+	This class generates synthetic configuration files of full device size for a device in frads/.
+	Frames are laid out the way the device auto-increments the frame address (the order of the frads/*.txt list),
+	with 2 dummy frames at every type, topBottom, or row boundary, a pad frame after FDRI writes, and a pad frame
+	before FDRO reads. Frame data is random, so the files are only useful for timing and round trip checks.
+	"""
+
+	def __init__(self, fradFile, series, seed=1, numUpsets=1000):
+		"""
+		Construct a new SyntheticBitstreams object and generate the frame data of a design, its readback, a mask, and essential bits
+		:param fradFile: Path to file containing list of frame addresses
+		:param series: The series of the device
+		:param seed: Seed of the random frame data
+		:param numUpsets: Number of random bits flipped in the readback
+		:return: returns nothing
+		"""
+		self.SYNC_WORD = 0xAA995566
+		self.DUMMY_WORD = 0xFFFFFFFF
+		self.BUS_WIDTH_WORDS = [0xFFFFFFFF, 0x000000BB, 0x11220044, 0xFFFFFFFF]
+		# .bit header: field 1, then design name (a), part (b), date (c), time (d), and configuration data length (e)
+		self.BIT_HEADER = '\x00\x09\x0f\xf0\x0f\xf0\x0f\xf0\x0f\xf0\x00\x00\x01'
+		self.NOOP = 0x20000000
+		self.WRITE_CMD = 0x30008001
+		self.WRITE_FAR = 0x30002001
+		self.WRITE_FDRI = 0x30004000
+		self.READ_FDRO = 0x28006000
+		self.TYPE_2_WRITE = 0x50000000
+		self.TYPE_2_READ = 0x48000000
+		self.RCRC_COMMAND = 0x7
+		self.WCFG_COMMAND = 0x1
+		self.RCFG_COMMAND = 0x4
+		self.DESYNC_COMMAND = 0xD
+
+		self.part = os.path.basename(fradFile).split('_')[0]
+		self.fradStructure = FradStructure(series)
+		self.fradStructure.load_frads(fradFile)
+		self.device = self.fradStructure.device
+		self.wordsPerFrame = self.fradStructure.wordsPerFrame
+		self.numFrads = self.fradStructure.numFrads
+		self.numLogicFrames = self.fradStructure.numLogicFrames
+
+		random = numpy.random.RandomState(seed)
+		shape = (self.numFrads, self.wordsPerFrame)
+		# About 30% of the words of a design hold configuration bits
+		self.frames = random.randint(0, 1 << 32, size=shape, dtype=numpy.uint64).astype(numpy.uint32)
+		self.frames[random.rand(*shape) >= 0.3] = 0
+		self.readbackFrames = self.frames.copy()
+		upsetWords = random.randint(0, self.numFrads * self.wordsPerFrame, size=numUpsets)
+		upsetBits = random.randint(0, 32, size=numUpsets).astype(numpy.uint32)
+		numpy.bitwise_xor.at(self.readbackFrames.ravel(), upsetWords, numpy.uint32(1) << upsetBits)
+		# Mask and essential bits are sparse: a few percent of the words, a few bits in each
+		self.maskFrames = self.sparse_frames(random, 0.05)
+		self.essentialFrames = self.sparse_frames(random, 0.05)
+
+	def sparse_frames(self, random, wordDensity):
+		"""
+		Helper function which generates frames where only some words have a few random bits set
+		:param random: numpy RandomState object
+		:param wordDensity: Fraction of the words with set bits
+		:return: 2D array (numFrads x wordsPerFrame) of 32 bit words
+		"""
+		shape = (self.numFrads, self.wordsPerFrame)
+		frames = numpy.zeros(shape, dtype=numpy.uint32)
+		for i in range(3):
+			frames |= random.randint(0, 1 << 32, size=shape, dtype=numpy.uint64).astype(numpy.uint32) & \
+				random.randint(0, 1 << 32, size=shape, dtype=numpy.uint64).astype(numpy.uint32) & \
+				random.randint(0, 1 << 32, size=shape, dtype=numpy.uint64).astype(numpy.uint32)
+		frames[random.rand(*shape) >= wordDensity] = 0
+		return frames
+
+	def stream_words(self, frames, includeBram, padFrame, dummyFrames=1):
+		"""
+		Lays frames out in the order they appear in configuration data
+		:param frames: 2D array (numFrads x wordsPerFrame) of 32 bit words in frame index order
+		:param includeBram: 1 to lay out every frame, 0 to stop after the logic frames
+		:param padFrame: 1 to start with a pad frame
+		:param dummyFrames: 1 to insert the dummy frames at type, topBottom, and row boundaries
+		:return: Array of 32 bit words
+		"""
+		numFrames = self.numFrads if (includeBram) else self.numLogicFrames
+		if dummyFrames:
+			streamIndex = self.device.streamIndex[:self.device.framePosition[numFrames - 1] + 1]
+			stream = numpy.zeros((len(streamIndex), self.wordsPerFrame), dtype=numpy.uint32)
+			stream[streamIndex >= 0] = frames[streamIndex[streamIndex >= 0]]
+		else:
+			stream = frames[:numFrames]
+		if padFrame:
+			stream = numpy.concatenate((numpy.zeros((1, self.wordsPerFrame), dtype=numpy.uint32), stream))
+		return stream.ravel()
+
+	def bitstream_words(self, frames):
+		"""
+		Returns the words of a bitstream writing every frame from frame address 0
+		:param frames: 2D array (numFrads x wordsPerFrame) of 32 bit words in frame index order
+		:return: Array of 32 bit words
+		"""
+		# The last frame written to FDRI only flushes the frame buffer
+		payload = numpy.concatenate((self.stream_words(frames, 1, 0), numpy.zeros(self.wordsPerFrame, dtype=numpy.uint32)))
+		header = self.BUS_WIDTH_WORDS + [self.SYNC_WORD, self.NOOP, self.WRITE_CMD, self.RCRC_COMMAND, self.NOOP,
+			self.WRITE_CMD, self.WCFG_COMMAND, self.WRITE_FAR, 0, self.WRITE_FDRI, self.TYPE_2_WRITE | len(payload)]
+		footer = [self.WRITE_CMD, self.DESYNC_COMMAND, self.NOOP, self.NOOP]
+		return numpy.concatenate((numpy.array(header, dtype=numpy.uint32), payload, numpy.array(footer, dtype=numpy.uint32)))
+
+	def readback_words(self, frames):
+		"""
+		Returns the words of a readback of every frame from frame address 0, including the read commands
+		:param frames: 2D array (numFrads x wordsPerFrame) of 32 bit words in frame index order
+		:return: Array of 32 bit words
+		"""
+		# A pad frame precedes the frames read from FDRO
+		payload = self.stream_words(frames, 1, 1)
+		header = [self.DUMMY_WORD, self.SYNC_WORD, self.NOOP, self.WRITE_CMD, self.RCFG_COMMAND, self.WRITE_FAR, 0,
+			self.READ_FDRO, self.TYPE_2_READ | len(payload)]
+		return numpy.concatenate((numpy.array(header, dtype=numpy.uint32), payload))
+
+	def ascii_lines(self, words):
+		"""
+		Converts words to lines of 32 ascii 1's and 0's
+		:param words: Array of 32 bit words
+		:return: String with one line per word
+		"""
+		bits = numpy.unpackbits(numpy.asarray(words, dtype='>u4').view(numpy.uint8).reshape(-1, 32 / 8), axis=1)
+		lines = numpy.empty((len(bits), 33), dtype=numpy.uint8)
+		lines[:, :32] = bits + ord('0')
+		lines[:, 32] = ord('\n')
+		return lines.tostring()
+
+	def bit_header(self, dataLength):
+		"""
+		Returns the header of a .bit file
+		:param dataLength: Number of bytes of configuration data following the header
+		:return: String holding the header
+		"""
+		fields = ''
+		for key, value in (('a', 'synthetic;UserID=0XFFFFFFFF\x00'), ('b', self.part + '\x00'),
+			('c', '2016/01/01\x00'), ('d', '00:00:00\x00')):
+			fields += key + numpy.array([len(value)], dtype='>u2').tostring() + value
+		return self.BIT_HEADER + fields + 'e' + numpy.array([dataLength], dtype='>u4').tostring()
+
+	def write_all(self, directory, name='synthetic'):
+		"""
+		Writes every supported file type of the design, mask, and essential bits to a directory
+		:param directory: Directory the files are written to
+		:param name: Base name of the files
+		:return: Dictionary mapping each file extension to the path written
+		"""
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		bitstream = self.bitstream_words(self.frames).astype('>u4').tostring()
+		maskBitstream = self.bitstream_words(self.maskFrames).astype('>u4').tostring()
+		readback = self.readback_words(self.readbackFrames)
+		contents = {
+			'.bit': self.bit_header(len(bitstream)) + bitstream,
+			'.bin': bitstream,
+			'.msk': self.bit_header(len(maskBitstream)) + maskBitstream,
+			'.rbb': readback.astype('>u4').tostring(),
+			# JCM readback: logic frames only, no pad frame, Little Endian
+			'.data': self.stream_words(self.readbackFrames, 0, 0).astype('<u4').tostring(),
+			'.rbt': 'Xilinx ASCII Bitstream\nDesign name: synthetic\nBits: %d\n' % (len(bitstream) * 8) +
+				self.ascii_lines(self.bitstream_words(self.frames)),
+			'.rba': 'Xilinx ASCII Readback\n' + self.ascii_lines(readback),
+			'.rbd': self.ascii_lines(self.stream_words(self.readbackFrames, 1, 1)),
+			'.msd': self.ascii_lines(self.stream_words(self.maskFrames, 1, 1)),
+			'.ebd': 'Xilinx ASCII Essential Bits\n' + self.ascii_lines(self.stream_words(self.essentialFrames, 0, 0, 0)),
+		}
+		paths = {}
+		for extension, content in contents.items():
+			paths[extension] = os.path.join(directory, name + extension)
+			with open(paths[extension], 'wb') as f:
+				f.write(content)
+		return paths
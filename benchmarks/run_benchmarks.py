@@ -0,0 +1,261 @@
+"""
+Times the parsers, FradStructure.load_frads, the FrameOperations diff modes, and BitstreamWriter.write_repair_file
+on synthetic files of every device in frads/ and prints the results as JSON. The repair benchmark also parses the
+repair back over the readback and fails if any unmasked logic bit still differs from the design.
+
+Every benchmark runs in a fresh Python process so its peak memory (ru_maxrss) is not inflated by earlier ones.
+
+Usage: python benchmarks/run_benchmarks.py [--devices xc7k325t,xcku040] [--benchmarks parse_bit_file,diff]
+	[--repeat 3] [--contiguous] [--workdir DIR] [--output results.json]
+"""
+__author__ = 'Peter Zabriskie'
+import json
+import optparse
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+from FradStructure import FradStructure
+from DeviceDatabase import DeviceDatabase
+from BinParser import BinParser
+from AsciiParser import AsciiParser
+from FrameOperations import FrameOperations
+from CareMask import CareMask
+from FrameStore import FrameStore
+from BitstreamWriter import BitstreamWriter
+from SyntheticBitstreams import SyntheticBitstreams
+
+FRAD_DIR = os.path.join(BENCHMARK_DIR, '..', 'frads')
+
+DEVICES = [
+	('xc5vlx110t', 5),
+	('xc7k325t', 7),
+	('xc7z020', 7),
+	('xcku040', 8),
+]
+
+# Parser benchmarks: (name, parser class, file extension)
+PARSE_BENCHMARKS = [
+	('parse_bit_file', BinParser, '.bit'),
+	('parse_bin_file', BinParser, '.bin'),
+	('parse_msk_file', BinParser, '.msk'),
+	('parse_rbb_file', BinParser, '.rbb'),
+	('parse_data_file', BinParser, '.data'),
+	('parse_rbt_file', AsciiParser, '.rbt'),
+	('parse_rba_file', AsciiParser, '.rba'),
+	('parse_rbd_file', AsciiParser, '.rbd'),
+	('parse_msd_file', AsciiParser, '.msd'),
+	('parse_ebd_file', AsciiParser, '.ebd'),
+]
+
+DIFF_BENCHMARKS = ['diff', 'diff_array', 'diff_ignore_masked', 'find_essential_upsets', 'diff_care', 'diff_digests']
+
+BENCHMARKS = ['load_frads', 'load_frads_cold'] + [name for name, parserClass, extension in PARSE_BENCHMARKS] + DIFF_BENCHMARKS + ['write_repair_file']
+
+def frad_file(device):
+	"""
+	:return: Path to the list of frame addresses of a device
+	"""
+	return os.path.join(FRAD_DIR, device + '_frads.txt')
+
+def new_frad_structure(device, series, contiguous):
+	"""
+	:return: New FradStructure object of a device with its frame addresses loaded
+	"""
+	fradStructure = FradStructure(series, contiguous)
+	fradStructure.load_frads(frad_file(device))
+	return fradStructure
+
+def parse_file(device, series, contiguous, extension, paths):
+	"""
+	Parses the synthetic file with the given extension into a new FradStructure
+	:return: FradStructure object
+	"""
+	for name, parserClass, parserExtension in PARSE_BENCHMARKS:
+		if parserExtension == extension:
+			fradStructure = new_frad_structure(device, series, contiguous)
+			if name == 'parse_rbb_file':
+				# Keep the BRAM frames read back, since the diff benchmarks compare every frame
+				parserClass().parse_rbb_file(paths[extension], fradStructure, 1)
+			else:
+				getattr(parserClass(), name)(paths[extension], fradStructure)
+			return fradStructure
+
+def run_case(device, series, benchmark, paths, repeat, contiguous):
+	"""
+	Runs one benchmark repeat times in this process
+	:return: Dictionary of results
+	"""
+	result = {'device': device, 'benchmark': benchmark, 'repeat': repeat, 'contiguous': contiguous}
+	fileBytes = 0
+	numFrames = 0
+	times = []
+	if benchmark == 'load_frads':
+		fileBytes = os.path.getsize(frad_file(device))
+		for i in range(repeat):
+			start = time.time()
+			fradStructure = new_frad_structure(device, series, contiguous)
+			times.append(time.time() - start)
+		numFrames = fradStructure.numFrads
+	elif benchmark == 'load_frads_cold':
+		fileBytes = os.path.getsize(frad_file(device))
+		# Load a private copy of the list so the compiled file in frads/ is left alone
+		coldDir = tempfile.mkdtemp(prefix='bitstream_benchmarks_frads_')
+		try:
+			coldFile = os.path.join(coldDir, os.path.basename(frad_file(device)))
+			shutil.copy(frad_file(device), coldFile)
+			compiledFile = os.path.splitext(coldFile)[0] + '.npz'
+			for i in range(repeat):
+				# Drop the shared copy and the compiled file so the text list is parsed again
+				DeviceDatabase.registry.clear()
+				if os.path.exists(compiledFile):
+					os.remove(compiledFile)
+				start = time.time()
+				fradStructure = FradStructure(series, contiguous)
+				fradStructure.load_frads(coldFile)
+				times.append(time.time() - start)
+		finally:
+			shutil.rmtree(coldDir)
+		numFrames = fradStructure.numFrads
+	elif benchmark in DIFF_BENCHMARKS:
+		golden = parse_file(device, series, contiguous, '.bit', paths)
+		readback = parse_file(device, series, contiguous, '.rbb', paths)
+		mask = parse_file(device, series, contiguous, '.msk', paths)
+		essential = parse_file(device, series, contiguous, '.ebd', paths)
+		frameOps = FrameOperations(golden, readback)
+		careMask = CareMask(golden, 1).exclude(mask)
+		# Digests are computed when the stores are built, as they would be at load time
+		storeOps = FrameOperations(FrameStore(golden), FrameStore(readback))
+		for i in range(repeat):
+			start = time.time()
+			if benchmark == 'diff':
+				upsets = frameOps.diff(1)
+			elif benchmark == 'diff_array':
+				upsets = frameOps.diff_array(1)
+			elif benchmark == 'diff_ignore_masked':
+				upsets = frameOps.diff_ignore_masked(1, mask)
+			elif benchmark == 'find_essential_upsets':
+				upsets = frameOps.find_essential_upsets(essential)
+			elif benchmark == 'diff_digests':
+				upsets = storeOps.diff_digests(1)
+			else:
+				upsets = frameOps.diff_care(careMask)
+			times.append(time.time() - start)
+		numFrames = golden.numLogicFrames if benchmark == 'find_essential_upsets' else golden.numFrads
+		fileBytes = numFrames * golden.wordsPerFrame * 4
+		result['upsets'] = len(upsets)
+	elif benchmark == 'write_repair_file':
+		golden = parse_file(device, series, contiguous, '.bit', paths)
+		readback = parse_file(device, series, contiguous, '.rbb', paths)
+		mask = parse_file(device, series, contiguous, '.msk', paths)
+		repairFile = os.path.join(os.path.dirname(paths['.bit']), 'repair.bin')
+		writer = BitstreamWriter()
+		for i in range(repeat):
+			start = time.time()
+			runs = writer.write_repair_file(repairFile, golden, readback=readback, mskFradStructure=mask)
+			times.append(time.time() - start)
+		# Round trip: the repair written over the readback must restore every unmasked logic bit of the design
+		repaired = parse_file(device, series, contiguous, '.rbb', paths)
+		BinParser().parse_bin_file(repairFile, repaired)
+		remaining = FrameOperations(golden, repaired).diff_array(0, mask)
+		if len(remaining) > 0:
+			raise ValueError("%d upsets remain after repair in run_benchmarks:run_case()" % len(remaining))
+		numFrames = sum([count for frad, count in runs])
+		fileBytes = os.path.getsize(repairFile)
+		result['packets'] = len(runs)
+	else:
+		extension = [parserExtension for name, parserClass, parserExtension in PARSE_BENCHMARKS if name == benchmark][0]
+		fileBytes = os.path.getsize(paths[extension])
+		for i in range(repeat):
+			start = time.time()
+			fradStructure = parse_file(device, series, contiguous, extension, paths)
+			times.append(time.time() - start)
+		numFrames = fradStructure.numFrads
+
+	best = min(times)
+	result['seconds'] = best
+	result['mean_seconds'] = sum(times) / len(times)
+	result['bytes'] = fileBytes
+	result['frames'] = numFrames
+	result['mb_per_s'] = fileBytes / best / 1e6 if best > 0 else None
+	result['frames_per_s'] = numFrames / best if best > 0 else None
+	return result
+
+def run_child(device, series, benchmark, workdir, repeat, contiguous):
+	"""
+	Runs one benchmark in this (child) process and prints its result as one line of JSON
+	"""
+	paths = dict((extension, os.path.join(workdir, device, 'synthetic' + extension))
+		for name, parserClass, extension in PARSE_BENCHMARKS)
+	baseRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	try:
+		result = run_case(device, series, benchmark, paths, repeat, contiguous)
+	except Exception as e:
+		result = {'device': device, 'benchmark': benchmark, 'error': "%s: %s" % (type(e).__name__, e)}
+	# ru_maxrss is in kilobytes on Linux
+	result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	result['base_rss_kb'] = baseRss
+	print json.dumps(result)
+
+def main():
+	"""
+	Generates the synthetic files of every device, runs every benchmark in a child process, and reports the results
+	"""
+	parser = optparse.OptionParser(usage=__doc__)
+	parser.add_option('--devices', default=','.join([device for device, series in DEVICES]))
+	parser.add_option('--benchmarks', default=','.join(BENCHMARKS))
+	parser.add_option('--repeat', type='int', default=3)
+	parser.add_option('--contiguous', action='store_true', default=False, help='Store frame data in one numpy array')
+	parser.add_option('--workdir', default=None, help='Directory for the synthetic files (kept if given)')
+	parser.add_option('--output', default=None, help='Write JSON here instead of stdout')
+	parser.add_option('--child', nargs=3, default=None, help=optparse.SUPPRESS_HELP)
+	options, args = parser.parse_args()
+	contiguous = 1 if options.contiguous else 0
+	series = dict(DEVICES)
+
+	if options.child:
+		device, benchmark, workdir = options.child
+		run_child(device, series[device], benchmark, workdir, options.repeat, contiguous)
+		return
+
+	workdir = options.workdir if options.workdir else tempfile.mkdtemp(prefix='bitstream_benchmarks_')
+	results = []
+	try:
+		for device in options.devices.split(','):
+			generator = SyntheticBitstreams(frad_file(device), series[device])
+			generator.write_all(os.path.join(workdir, device))
+			del generator
+			for benchmark in options.benchmarks.split(','):
+				command = [sys.executable, os.path.abspath(__file__), '--child', device, benchmark, workdir,
+					'--repeat', str(options.repeat)] + (['--contiguous'] if contiguous else [])
+				output = subprocess.Popen(command, stdout=subprocess.PIPE).communicate()[0]
+				results.append(json.loads(output.strip().split('\n')[-1]))
+				sys.stderr.write("%s %s: %s\n" % (device, benchmark, results[-1].get('error', '%.3f s' % results[-1].get('seconds', 0))))
+	finally:
+		if not options.workdir:
+			shutil.rmtree(workdir)
+
+	report = {
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'platform': platform.platform(),
+		'results': results,
+	}
+	text = json.dumps(report, indent=1, sort_keys=True)
+	if options.output:
+		with open(options.output, 'w') as f:
+			f.write(text + '\n')
+	else:
+		print text
+
+if __name__ == '__main__':
+	main()